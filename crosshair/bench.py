@@ -0,0 +1,193 @@
+'''
+Benchmarks the analysis engine against the modules in crosshair.examples.
+
+Each example module is analyzed in a fresh process, under the usual
+per-condition budgets. For each condition we report its outcome, the
+number of paths explored, paths per second, and how long it took to find
+a counterexample (or to confirm the condition, when it can be confirmed).
+Each module also reports its peak memory use.
+
+Results can be written as JSON, and compared against a previously written
+baseline; outcome changes and slowdowns beyond a threshold are reported
+as regressions.
+'''
+
+import multiprocessing
+import multiprocessing.queues
+import pkgutil
+import queue
+import time
+from typing import *
+from typing import TextIO
+
+try:
+    import resource
+except ImportError:
+    resource = None  # type: ignore
+
+from crosshair.core_and_libs import AnalysisOptions, checkables_for_any, run_checkables
+from crosshair.util import ErrorDuringImport, load_by_qualname
+
+BENCH_FORMAT_VERSION = 1
+
+# Timings below this many seconds are too noisy to compare:
+_MIN_COMPARABLE_SECONDS = 0.05
+
+
+def example_modules() -> List[str]:
+    import crosshair.examples
+    return sorted('crosshair.examples.' + info.name
+                  for info in pkgutil.iter_modules(crosshair.examples.__path__))
+
+
+def peak_memory_kb() -> Optional[int]:
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def bench_module(module_name: str, options: AnalysisOptions) -> dict:
+    try:
+        module = load_by_qualname(module_name)
+    except ErrorDuringImport as e:
+        return {'error': str(e.args[0])}
+    conditions: Dict[str, dict] = {}
+    start = time.time()
+    for checkable in run_checkables(checkables_for_any(module, options), options):
+        states = [m.state for m in checkable.get_messages()]
+        for stats in checkable.get_stats().values():
+            paths = stats.counters['paths']
+            path_seconds = stats.timers['paths']
+            conditions[f'{stats.function}:{stats.line}'] = {
+                'condition': stats.condition,
+                'outcome': max(states).name if states else None,
+                'paths': paths,
+                'paths_per_second': paths / path_seconds if path_seconds else 0.0,
+                'solver_calls': stats.counters['solver_calls'],
+                'until_refuted': stats.timers.get('until_refuted'),
+                'until_confirmed': stats.timers.get('until_confirmed'),
+            }
+    seconds = time.time() - start
+    paths = sum(c['paths'] for c in conditions.values())
+    return {
+        'seconds': seconds,
+        'paths': paths,
+        'paths_per_second': paths / seconds if seconds else 0.0,
+        'peak_memory_kb': peak_memory_kb(),
+        'conditions': conditions,
+    }
+
+
+def _bench_worker(module_name: str, options: AnalysisOptions,
+                  output: multiprocessing.queues.Queue) -> None:
+    result = {'error': 'The benchmark did not finish'}
+    try:
+        result = bench_module(module_name, options)
+    except Exception as e:
+        result = {'error': f'{type(e).__name__}: {e}'}
+    finally:
+        output.put(result)
+
+
+def _await_result(worker: multiprocessing.process.BaseProcess,
+                  output: multiprocessing.queues.Queue) -> dict:
+    while True:
+        try:
+            return output.get(timeout=1.0)
+        except queue.Empty:
+            if worker.exitcode is None:
+                continue
+        # The worker is gone; whatever it put has been flushed to the queue by now:
+        try:
+            return output.get(timeout=1.0)
+        except queue.Empty:
+            return {'error': f'The benchmark process exited with code {worker.exitcode}'}
+
+
+def run_benchmarks(module_names: Sequence[str], options: AnalysisOptions) -> dict:
+    # A fresh process for each module keeps memory measurements independent:
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for module_name in module_names:
+        output = context.Queue()
+        worker = context.Process(target=_bench_worker, args=(module_name, options, output))
+        worker.start()
+        results[module_name] = _await_result(worker, output)
+        worker.join()
+    return {
+        'version': BENCH_FORMAT_VERSION,
+        'per_condition_timeout': options.per_condition_timeout,
+        'per_path_timeout': options.per_path_timeout,
+        'max_iterations': options.max_iterations,
+        'modules': results,
+    }
+
+
+def _slower(name: str, current: Optional[float], baseline: Optional[float],
+            max_slowdown: float) -> Optional[str]:
+    if current is None or baseline is None:
+        return None
+    if current < _MIN_COMPARABLE_SECONDS or current <= baseline * (1 + max_slowdown):
+        return None
+    return f'{name} took {current:.3f}s (baseline: {baseline:.3f}s)'
+
+
+def compare_to_baseline(current: dict, baseline: dict,
+                        max_slowdown: float = 0.25,
+                        max_memory_growth: float = 0.25) -> List[str]:
+    '''
+    Lists regressions of `current` results relative to `baseline`.
+
+    >>> base = {'modules': {'m': {'paths_per_second': 100.0, 'peak_memory_kb': 1000,
+    ...     'conditions': {'f:3': {'outcome': 'POST_FAIL', 'until_refuted': 0.5}}}}}
+    >>> cur = {'modules': {'m': {'paths_per_second': 50.0, 'peak_memory_kb': 1100,
+    ...     'conditions': {'f:3': {'outcome': 'CANNOT_CONFIRM', 'until_refuted': None}}}}}
+    >>> for problem in compare_to_baseline(cur, base): print(problem)
+    m: 50.0 paths/sec (baseline: 100.0)
+    m f:3: outcome is CANNOT_CONFIRM (baseline: POST_FAIL)
+    '''
+    problems = []
+    for module_name, base in sorted(baseline['modules'].items()):
+        cur = current['modules'].get(module_name)
+        if cur is None or 'error' in base:
+            continue
+        if 'error' in cur:
+            problems.append(f'{module_name}: {cur["error"]}')
+            continue
+        if cur['paths_per_second'] * (1 + max_slowdown) < base['paths_per_second']:
+            problems.append(f'{module_name}: {cur["paths_per_second"]:.1f} paths/sec '
+                            f'(baseline: {base["paths_per_second"]:.1f})')
+        cur_memory, base_memory = cur.get('peak_memory_kb'), base.get('peak_memory_kb')
+        if cur_memory and base_memory and cur_memory > base_memory * (1 + max_memory_growth):
+            problems.append(f'{module_name}: peak memory {cur_memory}KB (baseline: {base_memory}KB)')
+        for key, base_condition in sorted(base['conditions'].items()):
+            cur_condition = cur['conditions'].get(key)
+            if cur_condition is None:
+                continue
+            name = f'{module_name} {key}'
+            if cur_condition['outcome'] != base_condition['outcome']:
+                problems.append(f'{name}: outcome is {cur_condition["outcome"]} '
+                                f'(baseline: {base_condition["outcome"]})')
+                continue
+            for timer in ('until_refuted', 'until_confirmed'):
+                problem = _slower(f'{name} {timer}', cur_condition.get(timer),
+                                  base_condition.get(timer), max_slowdown)
+                if problem:
+                    problems.append(problem)
+    return problems
+
+
+def describe_results(results: dict, stdout: TextIO) -> None:
+    for module_name, result in sorted(results['modules'].items()):
+        if 'error' in result:
+            stdout.write(f'{module_name}: {result["error"]}\n')
+            continue
+        memory = result['peak_memory_kb']
+        stdout.write(f'{module_name}: {result["seconds"]:.2f}s, {result["paths"]} paths, '
+                     f'{result["paths_per_second"]:.1f} paths/sec'
+                     + (f', peak memory {memory}KB' if memory else '') + '\n')
+        for key, condition in sorted(result['conditions'].items()):
+            timings = ''.join(f', {timer} {condition[timer]:.3f}s'
+                              for timer in ('until_refuted', 'until_confirmed')
+                              if condition[timer] is not None)
+            stdout.write(f'  {key}: {condition["outcome"]}, {condition["paths"]} paths{timings}\n')
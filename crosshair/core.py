@@ -17,7 +17,8 @@ from dataclasses import dataclass, replace
 from typing import *
 import ast
 import builtins
-import collections
+import collections.abc
+import contextlib
 import copy
 import enum
 import inspect
@@ -25,7 +26,9 @@ import io
 import itertools
 import functools
 import linecache
+import math
 import os.path
+import random
 import sys
 import time
 import traceback
@@ -38,9 +41,21 @@ import z3  # type: ignore
 
 from crosshair import dynamic_typing
 from crosshair.condition_parser import get_fn_conditions, get_class_conditions, ConditionExpr, Conditions, fn_globals
+from crosshair.corpus import Corpus, CorpusEntry, corpus_key
 from crosshair.enforce import EnforcedConditions, PostconditionFailed
-from crosshair.statespace import TrackingStateSpace, StateSpace, HeapRef, SnapshotRef, SearchTreeNode, model_value_to_python, VerificationStatus, IgnoreAttempt, SinglePathNode, CallAnalysis, MessageType, AnalysisMessage
+from crosshair.statespace import TrackingStateSpace, StateSpace, ForkReport, LearnedLemmas, HeapRef, SnapshotRef, SearchTreeNode, model_value_to_python, VerificationStatus, IgnoreAttempt, SinglePathNode, CallAnalysis, MessageType, AnalysisMessage
+from crosshair.forking import fork_supported
+from crosshair.fuzzing import args_for_signature, InputRejected
+from crosshair.guidance import hints_for, narrowed_type, steer_toward
+from crosshair.merging import merged_function
+from crosshair.pathcoverage import CoverageTracer, PathCoverage, coverage_counts
+from crosshair.portfolio import SolverPortfolio
+from crosshair.profiler import SamplingProfiler, profiling
+from crosshair.reproducer import value_source
+from crosshair.smtlog import QueryLogger
+from crosshair.stats import ConditionStats, condition_key, merge_condition_stats
 from crosshair.util import CrosshairInternal, UnexploredPath, IdentityWrapper, AttributeHolder, CrosshairUnsupported
+from crosshair.util import PathTimeout, UnknownSatisfiability, concrete_deadline
 from crosshair.util import debug, set_debug, extract_module_from_file, walk_qualname
 from crosshair.type_repo import get_subclass_map
 
@@ -244,6 +259,42 @@ def with_realized_args(fn: Callable):
     functools.update_wrapper(realizer, fn)
     return realizer
 
+def deep_realize(value: object, memo: Optional[Dict[int, object]] = None) -> object:
+    '''
+    Makes a concrete copy of a (possibly symbolic) value, including its
+    contents and, for instances of user classes, its attributes. This may
+    make decisions on the current path.
+    '''
+    if memo is None:
+        memo = {}
+    if id(value) in memo:
+        return memo[id(value)]
+    realized = realize(value)
+    typ = type(realized)
+    ret: object
+    if typ in (list, tuple, set, frozenset):
+        ret = typ(deep_realize(item, memo) for item in realized)  # type: ignore
+    elif typ is dict or isinstance(realized, collections.abc.Mapping):
+        ret = {deep_realize(k, memo): deep_realize(v, memo)
+               for k, v in realized.items()}  # type: ignore
+    elif isinstance(realized, (collections.abc.Sequence, collections.abc.Set)) and \
+         typ not in (str, bytes, range):
+        items = [deep_realize(item, memo) for item in realized]  # type: ignore
+        ret = items if isinstance(realized, collections.abc.Sequence) else set(items)
+    elif (typ.__module__ != 'builtins' and hasattr(realized, '__dict__') and
+          not isinstance(realized, (type, enum.Enum, types.FunctionType, types.ModuleType))):
+        try:
+            ret = object.__new__(typ)
+        except TypeError:
+            return realized
+        memo[id(value)] = ret
+        for name, attr in vars(realized).items():
+            ret.__dict__[name] = deep_realize(attr, memo)
+    else:
+        ret = realized
+    memo[id(value)] = ret
+    return ret
+
 _IMMUTABLE_TYPES = (int, float, complex, bool, tuple, frozenset, type(None))
 def forget_contents(value: object, space: StateSpace):
     # TODO: pretty sure this doesn't work; need tests here.
@@ -405,6 +456,9 @@ def proxy_for_class(typ: Type, space: StateSpace, varname: str, meet_class_invar
     class_conditions = get_class_conditions(typ)
     # symbolic custom classes may assume their invariants:
     if meet_class_invariants and class_conditions is not None:
+        for inv_condition in class_conditions.inv:
+            if not steer_toward(hints_for(inv_condition, {'self'}), {'self': obj}, space):
+                break
         for inv_condition in class_conditions.inv:
             if inv_condition.expr is None:
                 continue
@@ -470,12 +524,24 @@ def proxy_for_type(typ: Type, space: StateSpace, varname: str,
     return proxy_for_class(typ, space, varname, meet_class_invariants)
 
 
-def gen_args(sig: inspect.Signature, statespace: StateSpace) -> inspect.BoundArguments:
+def gen_args(sig: inspect.Signature, statespace: StateSpace,
+             preconditions: Sequence[ConditionExpr] = ()) -> inspect.BoundArguments:
+    '''
+    Creates symbolic arguments for `sig`. When `preconditions` are given,
+    the arguments are steered toward meeting their simple parts (see
+    crosshair.guidance).
+    '''
+    names = set(sig.parameters.keys())
+    all_hints = [(pre, hints_for(pre, names)) for pre in preconditions]
     args = sig.bind_partial()
     for param in sig.parameters.values():
         smt_name = param.name + statespace.uniq()
         proxy_maker = lambda typ, **kw: proxy_for_type(typ, statespace, smt_name, allow_subtypes=True, **kw)
-        has_annotation = (param.annotation != inspect.Parameter.empty)
+        annotation = param.annotation
+        if param.kind not in (inspect.Parameter.VAR_POSITIONAL, inspect.Parameter.VAR_KEYWORD):
+            for (pre, hints) in all_hints:
+                annotation = narrowed_type(annotation, pre.namespace, hints, param.name)
+        has_annotation = (annotation != inspect.Parameter.empty)
         value: object
         if param.kind == inspect.Parameter.VAR_POSITIONAL:
             if has_annotation:
@@ -499,13 +565,16 @@ def gen_args(sig: inspect.Signature, statespace: StateSpace) -> inspect.BoundArg
             meet_class_invariants = not is_self
             allow_subtypes = not is_self
             if has_annotation:
-                value = proxy_for_type(param.annotation, statespace, smt_name,
+                value = proxy_for_type(annotation, statespace, smt_name,
                                        meet_class_invariants, allow_subtypes)
             else:
                 value = proxy_for_type(cast(type, Any), statespace, smt_name,
                                        meet_class_invariants, allow_subtypes)
         debug('created proxy for', param.name, 'as type:', type(value))
         args.arguments[param.name] = value
+    for (_, hints) in all_hints:
+        if not steer_toward(hints, args.arguments, statespace):
+            break
     return args
 
 _UNABLE_TO_REPR = '<unable to repr>'
@@ -537,14 +606,81 @@ class AnalysisOptions:
     per_condition_timeout: float = 1.5
     per_path_timeout: float = 0.75
     report_all: bool = False
+    # Conditions are analyzed round-robin; these bound how many searches are live
+    # at once, and how many paths each one explores before yielding its turn:
+    max_live_conditions: int = 8
+    paths_per_turn: int = 4
+    # Deterministic budgets. When max_iterations is set, it replaces the timeouts
+    # above, so that the same input explores the same tree on any machine: each
+    # condition explores at most max_iterations paths, each path makes at most
+    # max_path_decisions decisions, and each solver check may use up to
+    # solver_rlimit units of z3's resource counter.
+    max_iterations: Optional[int] = None
+    max_path_decisions: int = 200
+    solver_rlimit: int = 500_000
+    # With adaptive timeouts, each condition starts from per_path_timeout, and
+    # then fits its path and solver timeouts to the latencies it observes,
+    # within these bounds:
+    adaptive_timeouts: bool = False
+    min_path_timeout: float = 0.1
+    max_path_timeout: float = 5.0
+    # With a solver portfolio, solver checks that take longer than
+    # portfolio_threshold seconds are raced under several solver configurations.
+    # (this does not apply with deterministic budgets)
+    solver_portfolio: bool = False
+    portfolio_threshold: float = 0.25
+    # Whether to learn unsat cores from infeasible branches, and use them to
+    # decide branches on later paths without querying the solver:
+    learn_lemmas: bool = False
+    # Whether to split path constraints into groups that share no variables,
+    # and send each query only to the group that it concerns:
+    slice_constraints: bool = False
+    # Where os.fork() is available, paths can resume from their parent's
+    # state at new branches (see crosshair.forking), instead of starting over.
+    # At most max_parked_paths processes wait on each other at a time.
+    fork_paths: bool = False
+    max_parked_paths: int = 4
+    # Whether to join the outcomes of simple branches (that only assign
+    # integer arithmetic to local variables) into z3.If values, rather than
+    # exploring each outcome on a separate path (see crosshair.merging):
+    merge_branches: bool = False
+    # After each path that confirms the condition, find up to this many other
+    # inputs that take the same path (up to its first realized value), and
+    # try them concretely. Only applies when every argument is an int, bool,
+    # or str. Inputs that pass steer the next path toward themselves:
+    concrete_samples: int = 0
+    # Before searching symbolically, check each condition on random concrete
+    # inputs for up to this many seconds (see crosshair.fuzzing). When one of
+    # them refutes the condition, we report it and skip the symbolic search:
+    fuzz_time: float = 0.0
+    # Trace the lines and branches that each path covers in user code, favor
+    # the branches that have led to new coverage, and record the coverage of
+    # each condition's function in its stats (see crosshair.pathcoverage):
+    coverage_guided: bool = False
+    # Give the messages for refuting calls the source of concrete copies of
+    # their inputs, for writing reproducers (see crosshair.reproducer):
+    realize_inputs: bool = False
+    # Record where (in the code under analysis) each decision and realization
+    # happens, for reports on them (see crosshair.util.user_code_site):
+    record_sites: bool = False
 
     # Transient members (not user-configurable):
-    deadline: float = float('NaN')
     stats: Optional[collections.Counter] = None
-
-    def incr(self, key: str):
+    profiler: Optional[SamplingProfiler] = None
+    query_logger: Optional[QueryLogger] = None
+    # Counterexamples to replay before searching, and to record (see crosshair.corpus):
+    corpus: Optional[Corpus] = None
+    # Inputs for the first paths to start from (see crosshair.harvest):
+    seeds: Optional[Corpus] = None
+    # Branch decisions for the first path to take (see TrackingStateSpace.replay):
+    replay_log: Optional[str] = None
+
+    def is_deterministic(self) -> bool:
+        return self.max_iterations is not None
+
+    def incr(self, key: str, amount: int = 1):
         if self.stats is not None:
-            self.stats[key] += 1
+            self.stats[key] += amount
 
 
 _DEFAULT_OPTIONS = AnalysisOptions()
@@ -560,9 +696,79 @@ def analyzable_members(module: types.ModuleType) -> Iterator[Tuple[str, Union[Ty
         yield (name, member)
 
 
-def analyze_any(entity: object, options: AnalysisOptions) -> List[AnalysisMessage]:
+class Checkable:
+    '''
+    A unit of analysis work. Checkables are advanced a turn at a time by
+    run_checkables(), so that many of them can make progress together.
+    '''
+    def is_done(self) -> bool:
+        return True
+
+    def run_turn(self, max_paths: int) -> None:
+        pass
+
+    def get_messages(self) -> List[AnalysisMessage]:
+        raise NotImplementedError
+
+    def get_stats(self) -> Dict[str, ConditionStats]:
+        return {}
+
+    def get_search_trees(self) -> Dict[str, SearchTreeNode]:
+        return {}
+
+
+class ReadyMessages(Checkable):
+    ''' Messages that are known without any analysis (syntax errors, etc). '''
+    def __init__(self, messages: List[AnalysisMessage]):
+        self.messages = messages
+
+    def get_messages(self) -> List[AnalysisMessage]:
+        return self.messages
+
+
+def run_checkables(checkables: Iterable[Checkable],
+                   options: AnalysisOptions) -> Iterator[Checkable]:
+    '''
+    Interleaves checkables round-robin, keeping up to `max_live_conditions` of
+    them in progress at a time. Yields each checkable as soon as it completes,
+    so that quick results are not held up by slow ones.
+    '''
+    pending = iter(checkables)
+    live: Deque[Checkable] = collections.deque()
+    while True:
+        while len(live) < max(1, options.max_live_conditions):
+            checkable = next(pending, None)
+            if checkable is None:
+                break
+            live.append(checkable)
+        if not live:
+            return
+        checkable = live.popleft()
+        checkable.run_turn(options.paths_per_turn)
+        if checkable.is_done():
+            yield checkable
+        else:
+            live.append(checkable)
+
+
+def collect_messages(checkables: Iterable[Checkable],
+                     options: AnalysisOptions,
+                     condition_stats: Optional[Dict[str, ConditionStats]] = None,
+                     search_trees: Optional[Dict[str, SearchTreeNode]] = None
+                     ) -> List[AnalysisMessage]:
+    messages = MessageCollector()
+    for checkable in run_checkables(checkables, options):
+        messages.extend(checkable.get_messages())
+        if condition_stats is not None:
+            merge_condition_stats(condition_stats, checkable.get_stats())
+        if search_trees is not None:
+            search_trees.update(checkable.get_search_trees())
+    return messages.get()
+
+
+def checkables_for_any(entity: object, options: AnalysisOptions) -> Iterator[Checkable]:
     if inspect.isclass(entity):
-        return analyze_class(cast(Type, entity), options)
+        yield from checkables_for_class(cast(Type, entity), options)
     elif inspect.isfunction(entity):
         self_class: Optional[type] = None
         fn = cast(Callable, entity)
@@ -571,20 +777,66 @@ def analyze_any(entity: object, options: AnalysisOptions) -> List[AnalysisMessag
                                        fn.__qualname__.split('.')[-2])
             assert isinstance(self_thing, type)
             self_class = self_thing
-        return analyze_function(fn, options, self_type=self_class)
+        yield from checkables_for_function(fn, options, self_type=self_class)
     elif inspect.ismodule(entity):
-        return analyze_module(cast(types.ModuleType, entity), options)
+        yield from checkables_for_module(cast(types.ModuleType, entity), options)
     else:
         raise CrosshairInternal(
             'Entity type not analyzable: ' + str(type(entity)))
 
 
-def analyze_module(module: types.ModuleType, options: AnalysisOptions) -> List[AnalysisMessage]:
+def checkables_for_module(module: types.ModuleType, options: AnalysisOptions) -> Iterator[Checkable]:
     debug('Analyzing module ', module)
-    messages = MessageCollector()
     for (name, member) in analyzable_members(module):
-        messages.extend(analyze_any(member, options))
-    message_list = messages.get()
+        yield from checkables_for_any(member, options)
+
+
+def checkables_for_class(cls: type, options: AnalysisOptions) -> Iterator[Checkable]:
+    debug('Analyzing class ', cls.__name__)
+    class_conditions = get_class_conditions(cls)
+    for method, conditions in class_conditions.methods.items():
+        if conditions.has_any():
+            yield from checkables_for_function(getattr(cls, method),
+                                               options=options,
+                                               self_type=cls,
+                                               clamp=message_class_clamper(cls))
+
+
+def checkables_for_function(fn: Callable,
+                            options: AnalysisOptions = _DEFAULT_OPTIONS,
+                            self_type: Optional[type] = None,
+                            clamp: Callable[[AnalysisMessage], AnalysisMessage] = lambda m: m
+                            ) -> Iterator[Checkable]:
+    debug('Analyzing ', fn.__name__)
+    if self_type is not None:
+        class_conditions = get_class_conditions(self_type)
+        conditions = class_conditions.methods[fn.__name__]
+    else:
+        conditions = get_fn_conditions(fn, self_type=self_type)
+        if conditions is None:
+            debug('Skipping ', str(fn),
+                  ': Unable to determine the function signature.')
+            return
+
+    syntax_messages = [clamp(AnalysisMessage(MessageType.SYNTAX_ERR,
+                                             syntax_message.message,
+                                             syntax_message.filename,
+                                             syntax_message.line_num, 0, ''))
+                       for syntax_message in conditions.syntax_messages()]
+    if syntax_messages:
+        yield ReadyMessages(syntax_messages)
+    conditions = conditions.compilable()
+    for post_condition in conditions.post:
+        yield ConditionSearch(fn, options, replace(conditions, post=[post_condition]),
+                              clamp=clamp)
+
+
+def analyze_any(entity: object, options: AnalysisOptions) -> List[AnalysisMessage]:
+    return collect_messages(checkables_for_any(entity, options), options)
+
+
+def analyze_module(module: types.ModuleType, options: AnalysisOptions) -> List[AnalysisMessage]:
+    message_list = collect_messages(checkables_for_module(module, options), options)
     debug('Module', module.__name__, 'has', len(message_list), 'messages')
     return message_list
 
@@ -607,71 +859,22 @@ def message_class_clamper(cls: type):
 
 
 def analyze_class(cls: type, options: AnalysisOptions = _DEFAULT_OPTIONS) -> List[AnalysisMessage]:
-    debug('Analyzing class ', cls.__name__)
-    messages = MessageCollector()
-    class_conditions = get_class_conditions(cls)
-    for method, conditions in class_conditions.methods.items():
-        if conditions.has_any():
-            cur_messages = analyze_function(getattr(cls, method),
-                                            options=options,
-                                            self_type=cls)
-            clamper = message_class_clamper(cls)
-            messages.extend(map(clamper, cur_messages))
-
-    return messages.get()
+    return collect_messages(checkables_for_class(cls, options), options)
 
 
 def analyze_function(fn: Callable,
                      options: AnalysisOptions = _DEFAULT_OPTIONS,
                      self_type: Optional[type] = None) -> List[AnalysisMessage]:
-    debug('Analyzing ', fn.__name__)
-    all_messages = MessageCollector()
-
-    if self_type is not None:
-        class_conditions = get_class_conditions(self_type)
-        conditions = class_conditions.methods[fn.__name__]
-    else:
-        conditions = get_fn_conditions(fn, self_type=self_type)
-        if conditions is None:
-            debug('Skipping ', str(fn),
-                  ': Unable to determine the function signature.')
-            return []
-
-    for syntax_message in conditions.syntax_messages():
-        all_messages.append(AnalysisMessage(MessageType.SYNTAX_ERR,
-                                            syntax_message.message,
-                                            syntax_message.filename,
-                                            syntax_message.line_num, 0, ''))
-    conditions = conditions.compilable()
-    for post_condition in conditions.post:
-        messages = analyze_single_condition(fn, options, replace(
-            conditions, post=[post_condition]))
-        all_messages.extend(messages)
-    return all_messages.get()
+    return collect_messages(checkables_for_function(fn, options, self_type), options)
 
 
 def analyze_single_condition(fn: Callable,
                              options: AnalysisOptions,
                              conditions: Conditions) -> Sequence[AnalysisMessage]:
-    debug('Analyzing postcondition: "', conditions.post[0].expr_source, '"')
-    debug('assuming preconditions: ', ','.join(
-        [p.expr_source for p in conditions.pre]))
-    options.deadline = time.time() + options.per_condition_timeout
-
-    analysis = analyze_calltree(fn, options, conditions)
-
-    (condition,) = conditions.post
-    addl_ctx = (' ' + condition.addl_context if condition.addl_context else '') + '.'
-    if analysis.verification_status is VerificationStatus.UNKNOWN:
-        message = 'Not confirmed' + addl_ctx
-        analysis.messages = [AnalysisMessage(MessageType.CANNOT_CONFIRM, message,
-                                             condition.filename, condition.line, 0, '')]
-    elif analysis.verification_status is VerificationStatus.CONFIRMED:
-        message = 'Confirmed over all paths' + addl_ctx
-        analysis.messages = [AnalysisMessage(MessageType.CONFIRMED, message,
-                                             condition.filename, condition.line, 0, '')]
-
-    return analysis.messages
+    search = ConditionSearch(fn, options, conditions)
+    while not search.is_done():
+        search.run_turn(sys.maxsize)
+    return search.get_messages()
 
 
 class ShortCircuitingContext:
@@ -702,10 +905,13 @@ class ShortCircuitingContext:
             # We *heavily* bias towards concrete execution, because it's often the case
             # that a single short-circuit will render the path useless. TODO: consider
             # decaying short-crcuit probability over time.
-            use_short_circuit = self.space_getter().fork_with_confirm_or_else(0.95)
+            space = self.space_getter()
+            use_short_circuit = space.fork_with_confirm_or_else(0.95)
             if not use_short_circuit:
                 debug('short circuit: Choosing not to intercept', original)
+                space.stats.incr('short_circuits_declined')
                 return original(*a, **kw)
+            space.stats.incr('short_circuits_taken')
             try:
                 self.engaged = False
                 debug('short circuit: Intercepted a call to ', original)
@@ -756,108 +962,600 @@ class CallTreeAnalysis:
     num_confirmed_paths: int = 0
 
 
+class PathTimeouts:
+    '''
+    Chooses the path and solver timeouts for each path of a condition search.
+
+    Unless adaptive timeouts are enabled, these are just the per_path_timeout,
+    and half of that for solver checks. Otherwise, timeouts follow a moving
+    average of the observed path durations (and slowest solver checks), with
+    some headroom. Paths that time out double the relevant timeout.
+
+    >>> timeouts = PathTimeouts(AnalysisOptions(adaptive_timeouts=True, per_path_timeout=1.0))
+    >>> for _ in range(20):
+    ...     timeouts.observe(0.05, 0.01)
+    >>> (round(timeouts.path_timeout, 2), round(timeouts.query_timeout, 2))
+    (0.2, 0.05)
+    >>> timeouts.observe(0.2, 0.05, query_timed_out=True)
+    >>> (round(timeouts.path_timeout, 2), round(timeouts.query_timeout, 2))
+    (0.2, 0.1)
+    '''
+    HEADROOM = 4.0
+    SMOOTHING = 0.3
+
+    def __init__(self, options: AnalysisOptions):
+        self.adaptive = options.adaptive_timeouts
+        self.min_path_timeout = options.min_path_timeout
+        self.max_path_timeout = options.max_path_timeout
+        self.path_timeout = options.per_path_timeout
+        self.query_timeout = options.per_path_timeout / 2
+        self.path_latency: Optional[float] = None
+        self.query_latency: Optional[float] = None
+
+    def _clamp_path(self, seconds: float) -> float:
+        return min(max(seconds, self.min_path_timeout), self.max_path_timeout)
+
+    def _clamp_query(self, seconds: float) -> float:
+        return min(max(seconds, self.min_path_timeout / 2), self.path_timeout)
+
+    def observe(self, path_seconds: float, slowest_query: float,
+                path_timed_out: bool = False, query_timed_out: bool = False) -> None:
+        if not self.adaptive:
+            return
+        if path_timed_out:
+            self.path_timeout = self._clamp_path(self.path_timeout * 2)
+        if query_timed_out:
+            self.query_timeout = self._clamp_query(self.query_timeout * 2)
+        if path_timed_out or query_timed_out:
+            debug('Raised timeouts to ', self.path_timeout, 's per path and ',
+                  self.query_timeout, 's per solver check')
+            return
+        smoothing = self.SMOOTHING
+        if self.path_latency is None or self.query_latency is None:
+            self.path_latency, self.query_latency = path_seconds, slowest_query
+        else:
+            self.path_latency += smoothing * (path_seconds - self.path_latency)
+            self.query_latency += smoothing * (slowest_query - self.query_latency)
+        self.path_timeout = self._clamp_path(self.path_latency * self.HEADROOM)
+        self.query_timeout = self._clamp_query(self.query_latency * self.HEADROOM)
+
+
+class ConditionSearch(Checkable):
+    '''
+    A resumable search over the call tree of a function, for a single
+    postcondition. Each call to run_turn() explores a bounded number of paths.
+    The per-condition timeout is measured against the time actually spent in
+    this search, so it does not depend on how searches are interleaved.
+    '''
+    def __init__(self,
+                 fn: Callable,
+                 options: AnalysisOptions,
+                 conditions: Conditions,
+                 clamp: Callable[[AnalysisMessage], AnalysisMessage] = lambda m: m):
+        self.fn = fn
+        # (what we actually call; it behaves like fn)
+        self.fn_to_call = merged_function(fn) if options.merge_branches else fn
+        self.options = options
+        self.conditions = conditions
+        self.clamp = clamp
+        self.search_root = SinglePathNode(True)
+        self.space_exhausted = False
+        self.failing_precondition: Optional[ConditionExpr] = conditions.pre[0] if conditions.pre else None
+        self.failing_precondition_reason: str = ''
+        self.num_confirmed_paths = 0
+        self.num_iterations = 0
+        self.time_spent = 0.0
+        self.timeouts = PathTimeouts(options)
+        self.portfolio = SolverPortfolio(threshold=options.portfolio_threshold) \
+            if options.solver_portfolio and not options.is_deterministic() else None
+        self.lemmas = LearnedLemmas() if options.learn_lemmas else None
+        # The inputs that we have sampled, as Python values and as z3 values:
+        self.sampled_inputs: Set[Tuple] = set()
+        self.sampled_smt_inputs: List[Tuple[z3.ExprRef, ...]] = []
+        self.samplable = bool(conditions.sig.parameters) and all(
+            param.annotation in (int, bool, str) and
+            param.kind not in (inspect.Parameter.VAR_POSITIONAL, inspect.Parameter.VAR_KEYWORD)
+            for param in conditions.sig.parameters.values())
+        self.sampled_messages: List[AnalysisMessage] = []
+        self.model_seeds: List[z3.ModelRef] = []
+        self.prepasses_done = False
+        self.seeds: List[CorpusEntry] = \
+            options.seeds.entries_for(corpus_key(fn)) if options.seeds is not None else []
+        self.fork_budget = options.max_parked_paths \
+            if options.fork_paths and fork_supported() else 0
+        self.cur_space: Optional[StateSpace] = None
+        self.coverage = PathCoverage()
+        self.tracer = CoverageTracer() if options.coverage_guided else None
+        (condition,) = conditions.post
+        self.stats = ConditionStats(function=fn.__qualname__,
+                                    condition=condition.expr_source,
+                                    filename=condition.filename,
+                                    line=condition.line)
+        self.short_circuit = ShortCircuitingContext(lambda: cast(StateSpace, self.cur_space))
+        self.enforced_conditions = EnforcedConditions(
+            fn_globals(fn), builtin_patches(),
+            interceptor=self.short_circuit.make_interceptor)
+        self.patched = Patched(self.in_symbolic_mode)
+        self.result: Optional[CallTreeAnalysis] = None
+
+    def in_symbolic_mode(self) -> bool:
+        space = self.cur_space
+        return space is not None and not space.running_framework_code
+
+    def is_done(self) -> bool:
+        return self.result is not None
+
+    def run_turn(self, max_paths: int) -> None:
+        if self.result is not None:
+            return
+        if self.num_iterations == 0:
+            debug('Analyzing postcondition: "', self.conditions.post[0].expr_source, '"')
+            debug('assuming preconditions: ', ','.join(
+                [p.expr_source for p in self.conditions.pre]))
+            debug('Begin analyze calltree ', self.fn.__name__)
+            _ = get_subclass_map()  # ensure loaded
+        enforced_conditions = self.enforced_conditions
+        with enforced_conditions, self.patched, enforced_conditions.disabled_enforcement(), \
+                profiling(self.options.profiler, lambda: self.cur_space):
+            if not self.prepasses_done:
+                self.run_prepasses()
+            for _ in range(max_paths):
+                if self.num_iterations == 0 and self.sampled_messages:
+                    debug('Refuted by a concrete input; skipping the symbolic search')
+                    break
+                if self.options.is_deterministic():
+                    if self.num_iterations >= cast(int, self.options.max_iterations):
+                        debug('Exhausted the iteration budget, stopping')
+                        break
+                elif self.time_spent > self.options.per_condition_timeout:
+                    debug('Exceeded condition timeout, stopping')
+                    break
+                start = time.time()
+                try:
+                    self.run_iteration(start)
+                except BaseException:
+                    space = self.cur_space
+                    if isinstance(space, TrackingStateSpace) and space.forked_child is not None:
+                        # A forked child must not carry on with the parent's work:
+                        space.forked_child.abandon()
+                    raise
+                finally:
+                    self.time_spent += time.time() - start
+                    self.cur_space = None
+                if self.space_exhausted:
+                    break
+            else:
+                return
+        self.result = self.finish()
+
+    def run_iteration(self, start: float) -> None:
+        options, conditions = self.options, self.conditions
+        self.num_iterations += 1
+        options.incr('num_paths')
+        stats = self.stats
+        stats.incr('paths')
+        debug('Iteration ', self.num_iterations)
+        deterministic = options.is_deterministic()
+        timeouts = self.timeouts
+        space = TrackingStateSpace(execution_deadline=start + timeouts.path_timeout,
+                                   model_check_timeout=timeouts.query_timeout,
+                                   search_root=self.search_root,
+                                   stats=stats,
+                                   query_logger=options.query_logger,
+                                   solver_rlimit=options.solver_rlimit if deterministic else None,
+                                   max_decisions=options.max_path_decisions if deterministic else None,
+                                   portfolio=self.portfolio,
+                                   lemmas=self.lemmas,
+                                   slice_constraints=options.slice_constraints,
+                                   fork_budget=self.fork_budget,
+                                   record_sites=options.record_sites)
+        space.fork_report_handler = self.adopt_fork_report
+        space.seed_models(self.model_seeds)
+        self.model_seeds = []
+        if options.replay_log is not None and self.num_iterations == 1:
+            space.replay(options.replay_log)
+        space.coverage_guided = options.coverage_guided
+        self.cur_space = space
+        path_timed_out = query_timed_out = False
+        try:
+            # The real work happens here!:
+            with stats.timing('paths'):
+                bound_args = gen_args(conditions.sig, space, conditions.pre)
+                if self.seeds:
+                    self.steer_toward_seed(space, bound_args, self.seeds.pop(0))
+                with (self.tracer.tracing() if self.tracer else contextlib.nullcontext()):
+                    call_analysis = attempt_call(
+                        conditions, space, self.fn_to_call, self.short_circuit, self.enforced_conditions,
+                        bound_args, options.realize_inputs)
+            failing_precondition = self.failing_precondition
+            if failing_precondition is not None:
+                cur_precondition = call_analysis.failing_precondition
+                if cur_precondition is None:
+                    if call_analysis.verification_status is not None:
+                        # We escaped the all the pre conditions on this try:
+                        self.failing_precondition = None
+                elif (cur_precondition.line == failing_precondition.line and
+                      call_analysis.failing_precondition_reason):
+                    self.failing_precondition_reason = call_analysis.failing_precondition_reason
+                elif cur_precondition.line > failing_precondition.line:
+                    self.failing_precondition = cur_precondition
+                    self.failing_precondition_reason = call_analysis.failing_precondition_reason
+
+        except UnexploredPath as e:
+            if isinstance(e, PathTimeout):
+                stats.incr('path_timeouts')
+                path_timed_out = True
+                debug('Path timed out; its execution log is', space.execution_log())
+            elif isinstance(e, UnknownSatisfiability):
+                stats.incr('unknown_satisfiability')
+                query_timed_out = True
+            else:
+                stats.incr('unsupported')
+            call_analysis = CallAnalysis(VerificationStatus.UNKNOWN)
+        except IgnoreAttempt:
+            call_analysis = CallAnalysis()
+        if space.resumed_paths:
+            # (the forked children took the other paths, and reported on them)
+            self.num_iterations += space.resumed_paths
+            options.incr('num_paths', space.resumed_paths)
+        timeouts.observe(time.time() - start, space.slowest_check,
+                         path_timed_out=path_timed_out, query_timed_out=query_timed_out)
+        status = call_analysis.verification_status
+        if status == VerificationStatus.REFUTED:
+            # (so that `crosshair replay` can take this path again)
+            log = space.execution_log()
+            call_analysis = replace(call_analysis, messages=[
+                replace(m, execution_log=log) for m in call_analysis.messages])
+        if status == VerificationStatus.CONFIRMED:
+            self.num_confirmed_paths += 1
+            if options.concrete_samples > 0 and self.samplable:
+                self.sample_concretely(space, bound_args, start)
+        elif status is None:
+            if call_analysis.failing_precondition is None:
+                stats.incr('ignored_attempts')
+            else:
+                stats.incr('failed_preconditions')
+        stats.record_path(len(space.choices_made))
+        stats.record_heap_size(len(space.heaps[-1]))
+        if self.tracer is not None:
+            new_coverage = self.coverage.update(self.tracer.coverage)
+            if new_coverage:
+                stats.incr('paths_with_new_coverage')
+                space.credit_coverage(new_coverage)
+        top_analysis, self.space_exhausted = space.bubble_status(call_analysis)
+        overall_status = top_analysis.verification_status if top_analysis else None
+        if overall_status == VerificationStatus.REFUTED and 'until_refuted' not in stats.timers:
+            stats.timers['until_refuted'] = self.time_spent + (time.time() - start)
+        debug('Iter complete. Worst status found so far:',
+              overall_status.name if overall_status else 'None')
+        if space.forked_child is not None:
+            space.forked_child.report(stats, self.fork_search_state())
+
+    def steer_toward_seed(self, space: StateSpace, bound_args: inspect.BoundArguments,
+                          seed: CorpusEntry) -> None:
+        '''
+        Steers this path toward a harvested input, by way of its arguments
+        that are ints, bools, floats, or strings.
+        '''
+        with space.framework():
+            try:
+                values = {name: eval(src, fn_globals(self.fn)) for (name, src) in seed}
+            except Exception as e:
+                debug('Unable to use seed', seed, 'because', repr(e))
+                return
+            equalities = []
+            for name, param in self.conditions.sig.parameters.items():
+                if param.annotation not in (int, bool, float, str) or name not in values:
+                    continue
+                expr = getattr(bound_args.arguments.get(name), 'var', None)
+                literal = _smt_literal(values[name]) if isinstance(expr, z3.ExprRef) else None
+                if literal is not None and literal.sort() == expr.sort():
+                    equalities.append(expr == literal)
+            if not equalities:
+                return
+            model = space.find_model_with(equalities)
+            if model is not None:
+                self.stats.incr('seeded_paths')
+                space.steer_by(model)
+
+    def sample_concretely(self, space: TrackingStateSpace,
+                          bound_args: inspect.BoundArguments, start: float) -> None:
+        '''
+        Runs the function (and checks its conditions) on other inputs that
+        follow this (confirmed) path until its first realized value. That is
+        where paths tend to diverge, but exploring each alternative costs a
+        full symbolic path.
+        '''
+        exprs = [getattr(value, 'var', None) for value in bound_args.arguments.values()]
+        if not all(isinstance(expr, z3.ExprRef) for expr in exprs):
+            return
+        stats = self.stats
+        names = list(bound_args.arguments.keys())
+        with stats.timing('sampling'):
+            models = space.find_diverse_models(exprs, self.options.concrete_samples,
+                                               space.num_unrealized_constraints,
+                                               exclude=self.sampled_smt_inputs)
+            for model in models:
+                smt_values = tuple(model.evaluate(expr, model_completion=True) for expr in exprs)
+                self.sampled_smt_inputs.append(smt_values)
+                try:
+                    values = tuple(map(model_value_to_python, smt_values))
+                except (ValueError, SyntaxError):
+                    continue
+                if values in self.sampled_inputs:
+                    continue
+                self.sampled_inputs.add(values)
+                stats.incr('concrete_samples')
+                concrete_args = inspect.BoundArguments(
+                    self.conditions.sig, collections.OrderedDict(zip(names, values)))
+                analysis = self.call_concretely(space, concrete_args)
+                if analysis is None:
+                    continue
+                if analysis.verification_status == VerificationStatus.REFUTED:
+                    stats.incr('sampled_refutations')
+                    self.sampled_messages.extend(analysis.messages)
+                    if 'until_refuted' not in stats.timers:
+                        stats.timers['until_refuted'] = self.time_spent + (time.time() - start)
+                elif analysis.verification_status == VerificationStatus.CONFIRMED:
+                    self.model_seeds.append(model)
+
+    def call_concretely(self, space: StateSpace, bound_args: inspect.BoundArguments,
+                        deadline: float = float('inf')) -> Optional[CallAnalysis]:
+        '''
+        Calls the function on concrete arguments (None if the attempt is
+        ignored). A call that runs for longer than a path may, or past the
+        deadline, is stopped, and its result is UNKNOWN.
+        '''
+        prev_space, self.cur_space = self.cur_space, None
+        try:
+            # Call without short-circuiting, nor symbolic patches (cur_space is unset):
+            with concrete_deadline(min(deadline, time.time() + self.timeouts.path_timeout)):
+                return attempt_call(self.conditions, space, self.fn_to_call,
+                                    ShortCircuitingContext(lambda: space),
+                                    self.enforced_conditions, bound_args, self.options.realize_inputs)
+        except PathTimeout:
+            self.stats.incr('concrete_timeouts')
+            return CallAnalysis(VerificationStatus.UNKNOWN)
+        except (UnexploredPath, IgnoreAttempt):
+            return None
+        finally:
+            self.cur_space = prev_space
+
+    def run_prepasses(self) -> None:
+        ''' Checks concrete inputs (known counterexamples, then random ones). '''
+        self.prepasses_done = True
+        if self.options.corpus is not None:
+            self.replay_corpus(self.options.corpus)
+        if self.options.fuzz_time > 0 and not self.sampled_messages:
+            self.fuzz()
+
+    def concrete_space(self, deadline: float) -> TrackingStateSpace:
+        # (concrete calls make no decisions; this just keeps them off our search tree)
+        return TrackingStateSpace(execution_deadline=deadline,
+                                  model_check_timeout=self.timeouts.query_timeout,
+                                  search_root=SinglePathNode(True))
+
+    def replay_corpus(self, corpus: Corpus) -> None:
+        '''
+        Runs the function (and checks its conditions) on the counterexamples
+        that were recorded for it. Like any concrete call, each replay stops
+        when it runs for longer than a path may.
+        '''
+        key = corpus_key(self.fn)
+        entries = corpus.entries_for(key)
+        if not entries:
+            return
+        stats, sig = self.stats, self.conditions.sig
+        start = time.time()
+        space = self.concrete_space(start + self.timeouts.path_timeout)
+        try:
+            with stats.timing('replaying'):
+                for entry in entries:
+                    analysis = None
+                    reprs = dict(entry)
+                    if reprs.keys() == sig.parameters.keys():
+                        try:
+                            namespace = fn_globals(self.fn)
+                            values = [(name, eval(reprs[name], namespace)) for name in sig.parameters]
+                        except Exception as e:
+                            debug('Unable to replay', entry, 'because', repr(e))
+                        else:
+                            stats.incr('corpus_replays')
+                            analysis = self.call_concretely(
+                                space, inspect.BoundArguments(sig, collections.OrderedDict(values)))
+                    status = analysis.verification_status if analysis is not None else None
+                    if status == VerificationStatus.UNKNOWN:
+                        # (it ran out of time; that does not show that the bug is fixed)
+                        continue
+                    refuted = status == VerificationStatus.REFUTED
+                    corpus.record_replay(key, entry, refuted)
+                    if refuted:
+                        stats.incr('corpus_refutations')
+                        self.sampled_messages.extend(cast(CallAnalysis, analysis).messages)
+                        stats.timers['until_refuted'] = time.time() - start
+                        return
+        finally:
+            self.time_spent += time.time() - start
+
+    def fuzz(self) -> None:
+        '''
+        Runs the function (and checks its conditions) on random concrete
+        inputs, until one refutes the condition or `fuzz_time` runs out.
+        '''
+        stats = self.stats
+        # (seeded by name, so that runs are repeatable)
+        r = random.Random(self.fn.__qualname__)
+        start = time.time()
+        deadline = start + self.options.fuzz_time
+        space = self.concrete_space(deadline)
+        try:
+            with stats.timing('fuzzing'):
+                while time.time() < deadline:
+                    try:
+                        bound_args = args_for_signature(self.conditions.sig, r)
+                    except InputRejected as e:
+                        debug('Rejected fuzzed input:', e)
+                        continue
+                    except NotImplementedError as e:
+                        debug('Unable to fuzz:', e)
+                        return
+                    stats.incr('fuzzed_inputs')
+                    analysis = self.call_concretely(space, bound_args, deadline)
+                    if analysis is not None and \
+                            analysis.verification_status == VerificationStatus.REFUTED:
+                        stats.incr('fuzzed_refutations')
+                        self.sampled_messages.extend(analysis.messages)
+                        stats.timers['until_refuted'] = time.time() - start
+                        return
+        finally:
+            self.time_spent += time.time() - start
+
+    def fork_search_state(self) -> Tuple[Optional[int], str, int, List[AnalysisMessage]]:
+        failing_precondition = self.failing_precondition
+        pre_index = None
+        if failing_precondition is not None:
+            pre_index = next((i for i, pre in enumerate(self.conditions.pre)
+                              if pre is failing_precondition), -1)
+        return (pre_index, self.failing_precondition_reason, self.num_confirmed_paths,
+                self.sampled_messages)
+
+    def adopt_fork_report(self, report: ForkReport) -> None:
+        # We were parked while the child searched, so its view is the current one:
+        pre_index, reason, num_confirmed_paths, sampled_messages = cast(
+            Tuple[Optional[int], str, int, List[AnalysisMessage]], report.search_state)
+        if pre_index is None:
+            self.failing_precondition = None
+        elif pre_index >= 0:
+            self.failing_precondition = self.conditions.pre[pre_index]
+        self.failing_precondition_reason = reason
+        self.num_confirmed_paths = num_confirmed_paths
+        self.sampled_messages = sampled_messages
+
+    def finish(self) -> CallTreeAnalysis:
+        fn, conditions = self.fn, self.conditions
+        all_messages = MessageCollector()
+        top_analysis = self.search_root.child.get_result()
+        if top_analysis.messages:
+            all_messages.extend(
+                replace(m,
+                        test_fn=fn.__qualname__,
+                        condition_src=conditions.post[0].expr_source)
+                for m in top_analysis.messages)
+        if self.sampled_messages:
+            all_messages.extend(
+                replace(m, test_fn=fn.__qualname__, condition_src=conditions.post[0].expr_source)
+                for m in self.sampled_messages)
+            top_analysis = replace(top_analysis, verification_status=VerificationStatus.REFUTED)
+        corpus = self.options.corpus
+        if corpus is not None:
+            for message in all_messages.get():
+                if message.input_reprs and _UNABLE_TO_REPR not in dict(message.input_reprs).values():
+                    corpus.add(corpus_key(fn), message.input_reprs)
+        if top_analysis.verification_status is None:
+            top_analysis.verification_status = VerificationStatus.UNKNOWN
+        failing_precondition = self.failing_precondition
+        if failing_precondition:
+            assert self.num_confirmed_paths == 0
+            addl_ctx = ' ' + failing_precondition.addl_context if failing_precondition.addl_context else ''
+            message = f'Unable to meet precondition{addl_ctx}'
+            if self.failing_precondition_reason:
+                message += f' (possibly because {self.failing_precondition_reason}?)'
+            all_messages.extend([AnalysisMessage(MessageType.PRE_UNSAT, message + '.',
+                                                 failing_precondition.filename, failing_precondition.line, 0, '')])
+            top_analysis = CallAnalysis(VerificationStatus.REFUTED)
+
+        assert top_analysis.verification_status is not None
+        if top_analysis.verification_status == VerificationStatus.CONFIRMED:
+            self.stats.timers['until_confirmed'] = self.time_spent
+        if self.tracer is not None:
+            self.stats.counters.update(coverage_counts(fn, self.coverage))
+        debug(('Exhausted' if self.space_exhausted else 'Aborted'),
+              ' calltree search with', top_analysis.verification_status.name,
+              'and', len(all_messages.get()), 'messages.',
+              'Number of iterations: ', self.num_iterations)
+        return CallTreeAnalysis(messages=all_messages.get(),
+                                verification_status=top_analysis.verification_status,
+                                num_confirmed_paths=self.num_confirmed_paths)
+
+    def get_messages(self) -> List[AnalysisMessage]:
+        analysis = self.result
+        assert analysis is not None
+        (condition,) = self.conditions.post
+        addl_ctx = (' ' + condition.addl_context if condition.addl_context else '') + '.'
+        messages = list(analysis.messages)
+        if analysis.verification_status is VerificationStatus.UNKNOWN:
+            message = 'Not confirmed' + addl_ctx
+            messages = [AnalysisMessage(MessageType.CANNOT_CONFIRM, message,
+                                        condition.filename, condition.line, 0, '')]
+        elif analysis.verification_status is VerificationStatus.CONFIRMED:
+            message = 'Confirmed over all paths' + addl_ctx
+            messages = [AnalysisMessage(MessageType.CONFIRMED, message,
+                                        condition.filename, condition.line, 0, '')]
+        return list(map(self.clamp, messages))
+
+    def get_stats(self) -> Dict[str, ConditionStats]:
+        stats = self.stats
+        return {condition_key(stats.function, stats.filename, stats.line): stats}
+
+    def get_search_trees(self) -> Dict[str, SearchTreeNode]:
+        stats = self.stats
+        return {condition_key(stats.function, stats.filename, stats.line): self.search_root}
+
+
+def _smt_literal(value: object) -> Optional[z3.ExprRef]:
+    if type(value) is bool:
+        return z3.BoolVal(value)
+    if type(value) is int:
+        return z3.IntVal(value)
+    if type(value) is float and math.isfinite(cast(float, value)):
+        return z3.RealVal(value)
+    if type(value) is str and value.isascii() and value.isprintable():  # type: ignore
+        return z3.StringVal(value)
+    return None
+
+
 def analyze_calltree(fn: Callable,
                      options: AnalysisOptions,
                      conditions: Conditions) -> CallTreeAnalysis:
-    debug('Begin analyze calltree ', fn.__name__)
-
-    all_messages = MessageCollector()
-    search_root = SinglePathNode(True)
-    space_exhausted = False
-    failing_precondition: Optional[ConditionExpr] = conditions.pre[0] if conditions.pre else None
-    failing_precondition_reason: str = ''
-    num_confirmed_paths = 0
-
-    cur_space: List[StateSpace] = [cast(StateSpace, None)]
-    short_circuit = ShortCircuitingContext(lambda: cur_space[0])
-    _ = get_subclass_map()  # ensure loaded
-    top_analysis: Optional[CallAnalysis] = None
-    enforced_conditions = EnforcedConditions(
-        fn_globals(fn), builtin_patches(),
-        interceptor=short_circuit.make_interceptor)
-    def in_symbolic_mode():
-        return (cur_space[0] is not None and
-                not cur_space[0].running_framework_code)
-    patched = Patched(in_symbolic_mode)
-    with enforced_conditions, patched, enforced_conditions.disabled_enforcement():
-        for i in itertools.count(1):
-            start = time.time()
-            if start > options.deadline:
-                debug('Exceeded condition timeout, stopping')
-                break
-            options.incr('num_paths')
-            debug('Iteration ', i)
-            space = TrackingStateSpace(execution_deadline=start + options.per_path_timeout,
-                                       model_check_timeout=options.per_path_timeout / 2,
-                                       search_root=search_root)
-            cur_space[0] = space
-            try:
-                # The real work happens here!:
-                call_analysis = attempt_call(
-                    conditions, space, fn, short_circuit, enforced_conditions)
-                if failing_precondition is not None:
-                    cur_precondition = call_analysis.failing_precondition
-                    if cur_precondition is None:
-                        if call_analysis.verification_status is not None:
-                            # We escaped the all the pre conditions on this try:
-                            failing_precondition = None
-                    elif (cur_precondition.line == failing_precondition.line and
-                          call_analysis.failing_precondition_reason):
-                        failing_precondition_reason = call_analysis.failing_precondition_reason
-                    elif cur_precondition.line > failing_precondition.line:
-                        failing_precondition = cur_precondition
-                        failing_precondition_reason = call_analysis.failing_precondition_reason
-
-            except UnexploredPath:
-                call_analysis = CallAnalysis(VerificationStatus.UNKNOWN)
-            except IgnoreAttempt:
-                call_analysis = CallAnalysis()
-            status = call_analysis.verification_status
-            if status == VerificationStatus.CONFIRMED:
-                num_confirmed_paths += 1
-            top_analysis, space_exhausted = space.bubble_status(call_analysis)
-            overall_status = top_analysis.verification_status if top_analysis else None
-            debug('Iter complete. Worst status found so far:',
-                  overall_status.name if overall_status else 'None')
-            if space_exhausted or top_analysis == VerificationStatus.REFUTED:
-                break
-    top_analysis = search_root.child.get_result()
-    if top_analysis.messages:
-        #log = space.execution_log()
-        all_messages.extend(
-            replace(m,
-                    #execution_log=log,
-                    test_fn=fn.__qualname__,
-                    condition_src=conditions.post[0].expr_source)
-            for m in top_analysis.messages)
-    if top_analysis.verification_status is None:
-        top_analysis.verification_status = VerificationStatus.UNKNOWN
-    if failing_precondition:
-        assert num_confirmed_paths == 0
-        addl_ctx = ' ' + failing_precondition.addl_context if failing_precondition.addl_context else ''
-        message = f'Unable to meet precondition{addl_ctx}'
-        if failing_precondition_reason:
-            message += f' (possibly because {failing_precondition_reason}?)'
-        all_messages.extend([AnalysisMessage(MessageType.PRE_UNSAT, message + '.',
-                                             failing_precondition.filename, failing_precondition.line, 0, '')])
-        top_analysis = CallAnalysis(VerificationStatus.REFUTED)
-
-    assert top_analysis.verification_status is not None
-    debug(('Exhausted' if space_exhausted else 'Aborted'),
-          ' calltree search with', top_analysis.verification_status.name,
-          'and', len(all_messages.get()), 'messages.',
-          'Number of iterations: ', i)
-    return CallTreeAnalysis(messages=all_messages.get(),
-                            verification_status=top_analysis.verification_status,
-                            num_confirmed_paths=num_confirmed_paths)
-
-
-def get_input_description(statespace: StateSpace,
-                          fn_name: str,
-                          bound_args: inspect.BoundArguments,
-                          return_val: object = _MISSING,
-                          addl_context: str = '') -> str:
-    debug('get_input_description: return_val: ', type(return_val))
+    search = ConditionSearch(fn, options, conditions)
+    while not search.is_done():
+        search.run_turn(sys.maxsize)
+    assert search.result is not None
+    return search.result
+
+
+def input_reprs(bound_args: inspect.BoundArguments) -> Tuple[Tuple[str, str], ...]:
+    ret = []
+    for argname, argval in list(bound_args.arguments.items()):
+        try:
+            repr_str = repr(argval)
+        except Exception as e:
+            if isinstance(e, IgnoreAttempt):
+                raise
+            debug(f'Exception attempting to repr input "{argname}": {repr(e)}')
+            repr_str = _UNABLE_TO_REPR
+        ret.append((argname, repr_str))
+    return tuple(ret)
+
+
+def input_sources(space: StateSpace,
+                  bound_args: inspect.BoundArguments) -> Optional[Tuple[Tuple[str, str], ...]]:
+    ''' Source for a concrete copy of each argument (None if some argument has none). '''
+    try:
+        realized = [(name, deep_realize(value)) for name, value in bound_args.arguments.items()]
+        with space.framework():
+            return tuple((name, value_source(value)) for name, value in realized)
+    except (ValueError, NotImplementedError) as e:
+        debug(f'Unable to write the inputs as source: {e!r}')
+        return None
+
+
+def describe_call(fn_name: str,
+                  bound_args: inspect.BoundArguments,
+                  return_val: object = _MISSING,
+                  addl_context: str = '') -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+    ''' Describes a call, and also returns the reprs of its arguments. '''
+    debug('describe_call: return_val: ', type(return_val))
     call_desc = ''
     if return_val is not _MISSING:
         try:
@@ -869,24 +1567,16 @@ def get_input_description(statespace: StateSpace,
             repr_str = _UNABLE_TO_REPR
         if repr_str != 'None':
             call_desc = call_desc + ' (which returns ' + repr_str + ')'
-    messages: List[str] = []
-    for argname, argval in list(bound_args.arguments.items()):
-        try:
-            repr_str = repr(argval)
-        except Exception as e:
-            if isinstance(e, IgnoreAttempt):
-                raise
-            debug(f'Exception attempting to repr input "{argname}": {repr(e)}')
-            repr_str = _UNABLE_TO_REPR
-        messages.append(argname + ' = ' + repr_str)
+    arg_reprs = input_reprs(bound_args)
+    messages = [argname + ' = ' + repr_str for (argname, repr_str) in arg_reprs]
     call_desc = fn_name + '(' + ', '.join(messages) + ')' + call_desc
 
     if addl_context:
-        return addl_context + ' when calling ' + call_desc # ' and '.join(messages)
+        return (addl_context + ' when calling ' + call_desc, arg_reprs) # ' and '.join(messages)
     elif messages:
-        return 'when calling ' + call_desc # ' and '.join(messages)
+        return ('when calling ' + call_desc, arg_reprs) # ' and '.join(messages)
     else:
-        return 'for any input'
+        return ('for any input', arg_reprs)
 
 
 class UnEqual:
@@ -940,8 +1630,11 @@ def attempt_call(conditions: Conditions,
                  space: StateSpace,
                  fn: Callable,
                  short_circuit: ShortCircuitingContext,
-                 enforced_conditions: EnforcedConditions) -> CallAnalysis:
-    bound_args = gen_args(conditions.sig, space)
+                 enforced_conditions: EnforcedConditions,
+                 bound_args: Optional[inspect.BoundArguments] = None,
+                 realize_inputs: bool = False) -> CallAnalysis:
+    if bound_args is None:
+        bound_args = gen_args(conditions.sig, space)
 
     code_obj = fn.__code__
     fn_filename, fn_start_lineno = (
@@ -1014,11 +1707,15 @@ def attempt_call(conditions: Conditions,
         detail = name_of_type(type(e)) + ': ' + str(e)
         frame_filename, frame_lineno = frame_summary_for_fn(tb, fn)
         debug('exception while evaluating function body:', detail, frame_filename, 'line', frame_lineno)
-        detail += ' ' + get_input_description(space, fn.__name__, original_args, _MISSING)
+        call_desc, arg_reprs = describe_call(fn.__name__, original_args, _MISSING)
+        detail += ' ' + call_desc
         return CallAnalysis(VerificationStatus.REFUTED,
                             [AnalysisMessage(MessageType.EXEC_ERR,
                                              *locate_msg(detail, frame_filename, frame_lineno),
-                                             ''.join(tb.format()))])
+                                             ''.join(tb.format()),
+                                             input_reprs=arg_reprs,
+                                             input_sources=input_sources(space, original_args)
+                                             if realize_inputs else None)])
 
     for argname, argval in bound_args.arguments.items():
         if (conditions.mutable_args is not None and
@@ -1030,7 +1727,8 @@ def attempt_call(conditions: Conditions,
                 debug('Mutablity problem:', detail)
                 return CallAnalysis(VerificationStatus.REFUTED,
                                     [AnalysisMessage(MessageType.POST_ERR, detail,
-                                                     fn_filename, fn_start_lineno, 0, '')])
+                                                     fn_filename, fn_start_lineno, 0, '',
+                                                     input_reprs=input_reprs(original_args))])
 
     (post_condition,) = conditions.post
     with ExceptionFilter(expected_exceptions) as efilter:
@@ -1044,21 +1742,27 @@ def attempt_call(conditions: Conditions,
         return efilter.analysis
     elif efilter.user_exc is not None:
         (e, tb) = efilter.user_exc
-        detail = repr(e) + ' ' + get_input_description(space, fn.__name__,
-                                                       original_args, __return__, post_condition.addl_context)
+        detail = repr(e) + ' '
+        call_desc, arg_reprs = describe_call(fn.__name__, original_args, __return__,
+                                             post_condition.addl_context)
+        detail += call_desc
         debug('exception while calling postcondition:', detail)
         failures = [AnalysisMessage(MessageType.POST_ERR,
                                     *locate_msg(detail, post_condition.filename, post_condition.line),
-                                    ''.join(tb.format()))]
+                                    ''.join(tb.format()),
+                                    input_reprs=arg_reprs)]
         return CallAnalysis(VerificationStatus.REFUTED, failures)
     if isok:
         debug('Postcondition confirmed.')
         return CallAnalysis(VerificationStatus.CONFIRMED)
     else:
-        detail = 'false ' + \
-                 get_input_description(
-                     space, fn.__name__, original_args, __return__, post_condition.addl_context)
+        call_desc, arg_reprs = describe_call(fn.__name__, original_args, __return__,
+                                             post_condition.addl_context)
+        detail = 'false ' + call_desc
         debug(detail)
         failures = [AnalysisMessage(MessageType.POST_FAIL,
-                                    *locate_msg(detail, post_condition.filename, post_condition.line), '')]
+                                    *locate_msg(detail, post_condition.filename, post_condition.line), '',
+                                    input_reprs=arg_reprs,
+                                    input_sources=input_sources(space, original_args)
+                                    if realize_inputs else None)]
         return CallAnalysis(VerificationStatus.REFUTED, failures)
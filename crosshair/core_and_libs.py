@@ -3,6 +3,9 @@ from crosshair.core import analyze_any
 from crosshair.core import analyze_class
 from crosshair.core import analyze_module
 from crosshair.core import analyzable_members
+from crosshair.core import checkables_for_any
+from crosshair.core import collect_messages
+from crosshair.core import run_checkables
 from crosshair.core import AnalysisMessage
 from crosshair.core import AnalysisOptions
 from crosshair.core import MessageType
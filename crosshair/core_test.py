@@ -1,12 +1,15 @@
 import collections
 import copy
 import dataclasses
+import itertools
 import re
 import sys
 import unittest
 from typing import *
 
 from crosshair.core import make_fake_object
+from crosshair.core import checkables_for_function
+from crosshair.core import run_checkables
 from crosshair.core_and_libs import *
 from crosshair.test_util import check_ok
 from crosshair.test_util import check_exec_err
@@ -14,6 +17,7 @@ from crosshair.test_util import check_post_err
 from crosshair.test_util import check_fail
 from crosshair.test_util import check_unknown
 from crosshair.test_util import check_messages
+from crosshair.test_util import analyze_function_stats
 from crosshair.util import set_debug
 from crosshair.statespace import SimpleStateSpace
 
@@ -26,10 +30,6 @@ from crosshair.statespace import SimpleStateSpace
 
 
 
-
-
-
-
 #
 # Begin fixed line number area.
 # Tests depend on the line number of the following section.
@@ -635,6 +635,243 @@ class BehaviorsTest(unittest.TestCase):
             return bool(re.match('(\d+)', s))
         self.assertEqual(*check_unknown(f))
 
+    def test_quick_conditions_are_not_starved(self) -> None:
+        def slow(x: List[int]) -> int:
+            ''' post: _ >= 0 '''
+            total = 0
+            for i in x:
+                total += abs(i)
+            return total
+        def quick(x: int) -> int:
+            ''' post: _ == x '''
+            return x
+        options = AnalysisOptions(per_condition_timeout=2.0, paths_per_turn=1)
+        checkables = itertools.chain(checkables_for_function(slow, options),
+                                     checkables_for_function(quick, options))
+        completed = list(run_checkables(checkables, options))
+        self.assertEqual([[m.state for m in c.get_messages()] for c in completed],
+                         [[MessageType.CONFIRMED], [MessageType.CANNOT_CONFIRM]])
+
+    def test_deterministic_budgets(self) -> None:
+        def f(x: List[int]) -> int:
+            ''' post: _ != 3 '''
+            return sum(x)
+        options = AnalysisOptions(max_iterations=15)
+        def run():
+            messages, stats = analyze_function_stats(f, options)
+            return ([m.state for m in messages], stats)
+        states1, stats1 = run()
+        states2, stats2 = run()
+        self.assertEqual(stats1.counters['paths'], 15)
+        self.assertEqual(states1, states2)
+        self.assertEqual(stats1.counters, stats2.counters)
+
+    def test_solver_portfolio(self) -> None:
+        def f(s: str, n: int) -> int:
+            ''' post: _ != 9 '''
+            return len(s) * n
+        # With no threshold, every check that is not instantaneous gets raced:
+        options = AnalysisOptions(solver_portfolio=True, portfolio_threshold=0.0)
+        messages, stats = analyze_function_stats(f, options)
+        self.assertEqual([m.state for m in messages], [MessageType.POST_FAIL])
+        self.assertGreater(stats.counters['portfolio_races'], 0)
+
+    def test_learned_lemmas(self) -> None:
+        def f(a: int, b: int, x: int) -> int:
+            ''' post: _ != 42 '''
+            a = 1 if a > 0 else 2
+            b = 1 if b > 0 else 2
+            if x > 10:
+                if x < 5:
+                    return 42
+            return a + b
+        # Each (a, b) subtree meets the infeasible `x < 5` branch on its own:
+        options = AnalysisOptions(learn_lemmas=True, max_iterations=20)
+        messages, stats = analyze_function_stats(f, options)
+        self.assertEqual([m.state for m in messages
+                          if m.state != MessageType.CONFIRMED], [])
+        self.assertEqual(stats.counters['lemmas_learned'], 1)
+        self.assertGreater(stats.counters['lemma_prunes'], 0)
+
+    def test_slice_constraints(self) -> None:
+        def f(l: List[int], n: int, m: int) -> int:
+            ''' post: _ != 7 '''
+            if len(l) > 2 and n > 3 and m < 0:
+                return n
+            return 0
+        options = AnalysisOptions(slice_constraints=True)
+        self.assertEqual(*check_fail(f, options))
+
+    def test_repeated_branches_skip_the_solver(self) -> None:
+        def f(x: int) -> int:
+            ''' post: _ != 15 '''
+            total = 0
+            for _ in range(3):
+                if x > 3:
+                    total += 5
+            return total
+        options = AnalysisOptions(max_iterations=10)
+        messages, stats = analyze_function_stats(f, options)
+        self.assertEqual([m.state for m in messages], [MessageType.POST_FAIL])
+        # Only the first test of `x > 3` on each path needs the solver:
+        self.assertEqual(stats.counters['repeated_branches'], 2 * stats.counters['paths'])
+
+    def test_branches_reuse_models(self) -> None:
+        def f(x: int, y: int) -> int:
+            ''' post: _ != 3 '''
+            return (1 if x > 0 else 0) + (2 if y > 0 else 0)
+        options = AnalysisOptions(max_iterations=10)
+        messages, stats = analyze_function_stats(f, options)
+        self.assertEqual([m.state for m in messages], [MessageType.POST_FAIL])
+        # Each new branch needs at most one query, when a model decides the other direction:
+        self.assertGreater(stats.counters['model_reuses'], 0)
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'forking paths is only supported on Linux')
+    def test_forked_paths_resume_at_branches(self) -> None:
+        def f(a: List[int], n: int, m: int) -> int:
+            ''' post: _ != 11 '''
+            r = 0
+            for x in a:
+                if x > n:
+                    r += 1
+            if m > 5:
+                r += 10
+            return r
+        options = AnalysisOptions(fork_paths=True)
+        messages, stats = analyze_function_stats(f, options)
+        self.assertEqual([MessageType.POST_FAIL], [m.state for m in messages])
+        self.assertGreater(stats.counters['resumed_paths'], 0)
+
+    def test_merge_branches(self) -> None:
+        def f(a: int, b: int, c: int) -> int:
+            ''' post: _ != 6 '''
+            r = 0
+            if a > 0:
+                r += 1
+            if b > 0:
+                r += 2
+            if c > 0:
+                r += 3
+            return r
+        options = AnalysisOptions(merge_branches=True, max_iterations=10)
+        messages, stats = analyze_function_stats(f, options)
+        self.assertEqual([MessageType.POST_FAIL], [m.state for m in messages])
+        # Each path takes all three branches at once:
+        self.assertEqual(stats.counters['merged_branches'], 3 * stats.counters['paths'])
+
+    def test_concrete_samples(self) -> None:
+        def f(x: int) -> str:
+            '''
+            pre: 0 <= x < 100
+            post: _ != '42'
+            '''
+            return str(x)
+        options = AnalysisOptions(concrete_samples=4, max_iterations=25)
+        messages, stats = analyze_function_stats(f, options)
+        self.assertEqual([MessageType.POST_FAIL], [m.state for m in messages])
+        self.assertIn('f(x = 42)', messages[0].message)
+        # (symbolically, each path tries one more value of x)
+        self.assertEqual(stats.counters['sampled_refutations'], 1)
+
+    def test_inputs_steered_toward_conditions(self) -> None:
+        @dataclasses.dataclass
+        class Span:
+            '''
+            inv: 0 <= self.lo <= self.hi
+            inv: self.hi - self.lo < 10
+            '''
+            lo: int
+            hi: int
+        def f(span: Span, n: Union[int, str]) -> int:
+            '''
+            pre: isinstance(n, int) and n in (2, 3)
+            post: _ < 12
+            '''
+            return span.hi - span.lo + n
+        options = AnalysisOptions(max_iterations=20)
+        messages, stats = analyze_function_stats(f, options)
+        self.assertEqual([MessageType.POST_FAIL], [m.state for m in messages])
+        self.assertEqual(stats.counters['ignored_attempts'], 0)
+
+    def test_fuzzed_refutation_skips_symbolic_search(self) -> None:
+        def f(x: int, items: List[str]) -> int:
+            ''' post: _ != 3 '''
+            return x + len(items)
+        options = AnalysisOptions(fuzz_time=10.0, max_iterations=10)
+        messages, stats = analyze_function_stats(f, options)
+        self.assertEqual([MessageType.POST_FAIL], [m.state for m in messages])
+        self.assertEqual(stats.counters['fuzzed_refutations'], 1)
+        self.assertEqual(stats.counters['paths'], 0)
+
+    def test_coverage_guided_search(self) -> None:
+        def f(a: int, b: int) -> int:
+            ''' post: _ > 0 '''
+            if a > 5:
+                if b > a:
+                    return 3
+                return 2
+            return 1
+        options = AnalysisOptions(coverage_guided=True, max_iterations=10)
+        _, stats = analyze_function_stats(f, options)
+        counters = stats.counters
+        self.assertEqual((counters['covered_lines'], counters['covered_branches']),
+                         (counters['coverable_lines'], counters['coverable_branches']))
+        self.assertEqual(counters['coverable_branches'], 4)
+        self.assertEqual(counters['paths_with_new_coverage'], 3)
+        self.assertGreater(counters['coverage_guided_branches'], 0)
+
+    def test_fuzzing_stops_nonterminating_calls(self) -> None:
+        def f(n: int) -> int:
+            ''' post: True '''
+            while n != n - 1:
+                n += 1
+            return n
+        options = AnalysisOptions(fuzz_time=0.5, per_path_timeout=0.1, max_iterations=1)
+        _, stats = analyze_function_stats(f, options)
+        self.assertGreater(stats.counters['concrete_timeouts'], 0)
+        self.assertLess(stats.timers['fuzzing'], 1.0)
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'forking paths is only supported on Linux')
+    def test_resumed_paths_count_as_iterations(self) -> None:
+        def f(a: List[int], n: int, m: int) -> int:
+            ''' post: _ != 11 '''
+            r = 0
+            for x in a:
+                if x > n:
+                    r += 1
+            if m > 5:
+                r += 10
+            return r
+        options = AnalysisOptions(fork_paths=True, max_iterations=4)
+        (search,) = checkables_for_function(f, options)
+        (completed,) = run_checkables([search], options)
+        (stats,) = completed.get_stats().values()
+        self.assertGreater(stats.counters['resumed_paths'], 0)
+        self.assertEqual(search.num_iterations, stats.counters['paths'])
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'forking paths is only supported on Linux')
+    def test_forked_paths_are_not_revisited(self) -> None:
+        def f(a: int, b: int, c: int, d: int, e: int) -> int:
+            ''' post: _ >= 0 '''
+            r = 0
+            if a > 0:
+                r += 1
+            if b > 0:
+                r += 2
+            if c > 0:
+                r += 4
+            if d > 0:
+                r += 8
+            if e > 0:
+                r += 16
+            return r
+        # (there are more branches than forks per path, so children return unexhausted subtrees)
+        messages, stats = analyze_function_stats(f, AnalysisOptions(fork_paths=True, max_iterations=100))
+        self.assertEqual([MessageType.CONFIRMED], [m.state for m in messages])
+        self.assertGreater(stats.counters['resumed_paths'], 0)
+        # One path per leaf:
+        self.assertEqual(stats.counters['paths'], 32)
+
 
 def profile():
     # This is a scratch area to run quick profiles.
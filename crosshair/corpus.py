@@ -0,0 +1,79 @@
+'''
+A persistent corpus of counterexamples.
+
+When a condition is refuted, the arguments of the refuting call (as the
+reprs that its message reports) are recorded under the function's
+qualified name. On later runs, each function's entries are replayed
+concretely before any symbolic search, so that a known bug that has come
+back is reported right away. Entries that were replayed, but no longer
+refute any condition, are pruned when the corpus is saved.
+
+The corpus is a JSON file, so that it can be reviewed and checked in
+along with the code that it describes.
+'''
+
+import json
+import os
+from typing import *
+
+# The (name, repr) of each argument in a refuting call:
+CorpusEntry = Tuple[Tuple[str, str], ...]
+
+
+def corpus_key(fn: Callable) -> str:
+    return f'{fn.__module__}.{fn.__qualname__}'
+
+
+class Corpus:
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.entries: Dict[str, List[CorpusEntry]] = {}
+        self._replayed: Set[Tuple[str, CorpusEntry]] = set()
+        self._refuting: Set[Tuple[str, CorpusEntry]] = set()
+        self.load()
+
+    def load(self) -> None:
+        try:
+            with open(self.filename) as fh:
+                data = json.load(fh)
+        except FileNotFoundError:
+            return
+        for key, entries in data.get('entries', {}).items():
+            self.entries[key] = [tuple(entry.items()) for entry in entries]
+
+    def entries_for(self, key: str) -> List[CorpusEntry]:
+        return list(self.entries.get(key, ()))
+
+    def add(self, key: str, entry: CorpusEntry) -> None:
+        entries = self.entries.setdefault(key, [])
+        if entry not in entries:
+            entries.append(entry)
+        self._refuting.add((key, entry))
+
+    def record_replay(self, key: str, entry: CorpusEntry, refuted: bool) -> None:
+        self._replayed.add((key, entry))
+        if refuted:
+            self._refuting.add((key, entry))
+
+    def prune(self) -> int:
+        ''' Drops the entries that were replayed, but refuted nothing. Returns how many. '''
+        stale = self._replayed - self._refuting
+        for key, entries in list(self.entries.items()):
+            entries[:] = [e for e in entries if (key, e) not in stale]
+            if not entries:
+                del self.entries[key]
+        self._replayed -= stale
+        return len(stale)
+
+    def save(self) -> None:
+        self.prune()
+        data = {
+            'version': 1,
+            'entries': {key: [dict(entry) for entry in entries]
+                        for key, entries in sorted(self.entries.items())},
+        }
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'w') as fh:
+            json.dump(data, fh, indent=2)
+            fh.write('\n')
+        os.replace(tmp_filename, self.filename)
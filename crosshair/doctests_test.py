@@ -7,13 +7,14 @@ import unittest
 
 from crosshair import util
 
-# Runs all the doctests in sibling *.py files
+# Runs all the doctests in sibling *.py files (and those in libimpl/)
 
 
 def load_tests(loader, tests, pattern):
     tests = unittest.TestSuite()
     root = os.path.split(__file__)[0]
-    for path in glob.glob(os.path.join(root, "*.py")):
+    paths = glob.glob(os.path.join(root, "*.py")) + glob.glob(os.path.join(root, "libimpl", "*.py"))
+    for path in paths:
         (_, module_name) = util.extract_module_from_file(path)
         module = importlib.import_module(module_name)
         tests.addTests(doctest.DocTestSuite(module))
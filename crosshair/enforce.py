@@ -52,6 +52,8 @@ def EnforcementWrapper(fn: Callable, conditions: Conditions, enforced: 'Enforced
                     raise PreconditionFailed(
                         f'Precondition "{precondition.expr_source}" was not satisfied '
                         f'before calling "{fn.__name__}"')
+            if enforced.observer is not None:
+                enforced.observer(fn, bound_args)
         ret = fn(*a, **kw)
         with enforced.currently_enforcing(fn):
             lcls = {**bound_args.arguments, '__return__': ret,
@@ -68,9 +70,12 @@ def EnforcementWrapper(fn: Callable, conditions: Conditions, enforced: 'Enforced
 
 
 class EnforcedConditions:
-    def __init__(self, *envs, interceptor=lambda x: x):
+    def __init__(self, *envs, interceptor=lambda x: x,
+                 observer: Optional[Callable[[Callable, inspect.BoundArguments], None]] = None):
         self.envs = envs
         self.interceptor = interceptor
+        # Called with the (valid) arguments of each enforced call:
+        self.observer = observer
         self.fns_enforcing: Optional[Set[Callable]] = set()
         self.wrapper_map: Dict[Callable, Callable] = {}
         self.original_map: Dict[IdentityWrapper[Callable], Callable] = {}
@@ -60,6 +60,15 @@ class CoreTest(unittest.TestCase):
                 Pokeable().pokeby(-1)
         self.assertEqual(id(env['Pokeable'].poke), old_id)
 
+    def test_observe_valid_calls(self) -> None:
+        env = {'foo': foo}
+        observed = []
+        with EnforcedConditions(env, observer=lambda fn, args: observed.append(dict(args.arguments))):
+            env['foo'](5)
+            with self.assertRaises(PreconditionFailed):
+                env['foo'](-1)
+        self.assertEqual(observed, [{'x': 5}])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,66 @@
+'''
+Process plumbing for resuming paths at branch points.
+
+With `--fork_paths`, a path that reaches a new branch (where both
+directions are possible) forks. The child continues down one direction,
+while the parent parks until the child's path is over. The child then
+sends back the subtree that it explored and exits; the parent grafts that
+subtree into its own search tree, and resumes down the other direction.
+The parent's next path therefore starts right at the branch, instead of
+re-running argument generation, preconditions, and the function body to
+get there.
+
+See TrackingStateSpace.fork_at() for the search tree side of this.
+'''
+
+import os
+import pickle
+import sys
+from typing import *
+
+
+def fork_supported() -> bool:
+    # (other platforms either lack fork(), or do not support it well
+    # for processes with native libraries like z3 loaded)
+    return hasattr(os, 'fork') and sys.platform.startswith('linux')
+
+
+class ForkChannel:
+    '''
+    Forks the current process, with a pipe from the child to the parent.
+    The child must leave by calling send_and_exit() or abandon(); it never
+    returns to the caller's caller.
+    '''
+    def __init__(self):
+        self.read_fd, self.write_fd = os.pipe()
+        self.pid = os.fork()
+        if self.pid == 0:
+            os.close(self.read_fd)
+        else:
+            os.close(self.write_fd)
+
+    def is_child(self) -> bool:
+        return self.pid == 0
+
+    def send_and_exit(self, payload: object) -> NoReturn:
+        try:
+            with os.fdopen(self.write_fd, 'wb') as fh:
+                pickle.dump(payload, fh)
+        finally:
+            # Skip cleanup handlers and buffered output; those belong to the parent:
+            os._exit(0)
+
+    def abandon(self) -> NoReturn:
+        os._exit(1)
+
+    def receive(self) -> Optional[object]:
+        ''' Waits for the child to finish; returns its payload, if it sent one. '''
+        with os.fdopen(self.read_fd, 'rb') as fh:
+            data = fh.read()
+        os.waitpid(self.pid, 0)
+        if not data:
+            return None
+        try:
+            return pickle.loads(data)
+        except Exception:
+            return None
@@ -0,0 +1,175 @@
+'''
+Random concrete inputs, for a quick search before the symbolic one.
+
+Many contract violations show up on small (or otherwise unremarkable)
+concrete inputs. With `--fuzz_time`, each condition is first checked on
+random inputs built from the function's signature; a refutation found this
+way is reported right away, without ever calling the solver.
+
+>>> r = random.Random(0)
+>>> isinstance(value_for_type(Dict[str, Optional[List[int]]], r), dict)
+True
+>>> bound = args_for_signature(inspect.signature(lambda x, *ys: x), r)
+>>> sorted(bound.arguments.keys())
+['x', 'ys']
+'''
+
+import collections.abc
+import enum
+import inspect
+import random
+import string
+from typing import *
+
+import typing_inspect  # type: ignore
+
+from crosshair.condition_parser import get_class_conditions, resolve_signature
+from crosshair.dynamic_typing import origin_of
+
+
+class InputRejected(Exception):
+    ''' Raised when a generated value is not suitable (the next one may be). '''
+
+
+# Generated values nest no deeper than this:
+_MAX_DEPTH = 3
+
+_INTS = (-1, 0, 1, 2, 3, 10, 100, -100, 255, 256, 2 ** 31, -2 ** 31)
+_FLOATS = (-1.0, 0.0, 1.0, 2.0, 0.5, -0.5, 10.0, 1e10, -1e-10)
+_STRS = ('', 'x', '0', 'xyz', ' ', 'a b', 'A', '-1', '\n')
+_CHARS = string.ascii_letters[:3] + string.digits[:3] + ' -_.'
+
+_IMMUTABLE_TYPES = (bool, int, float, str, type(None))
+_SEQUENCE_ORIGINS = (list, collections.abc.Sequence, collections.abc.MutableSequence,
+                     collections.abc.Iterable, collections.abc.Collection,
+                     collections.abc.Container, collections.abc.Reversible)
+_SET_ORIGINS = (set, collections.abc.Set, collections.abc.MutableSet)
+_MAPPING_ORIGINS = (dict, collections.abc.Mapping, collections.abc.MutableMapping)
+
+
+def _type_args(typ: Type) -> Tuple[Type, ...]:
+    return typing_inspect.get_args(typ, evaluate=True) if getattr(typ, '__args__', None) else ()
+
+
+def _normalize(typ: Type) -> Type:
+    if typing_inspect.is_typevar(typ):
+        bound = typing_inspect.get_bound(typ)
+        if bound is not None:
+            return _normalize(bound)
+        constraints = typing_inspect.get_constraints(typ)
+        return Union.__getitem__(constraints) if constraints else object  # type: ignore
+    if typ is Any or typ is inspect.Parameter.empty:
+        return object
+    return typ
+
+
+def _length(r: random.Random, depth: int) -> int:
+    return 0 if depth >= _MAX_DEPTH else r.choice([0, 1, 1, 2, 3])
+
+
+def _str(r: random.Random) -> str:
+    if r.random() < 0.5:
+        return r.choice(_STRS)
+    return ''.join(r.choice(_CHARS) for _ in range(r.randint(1, 5)))
+
+
+def _instance(cls: type, r: random.Random, depth: int) -> object:
+    if depth >= _MAX_DEPTH or cls.__module__ == 'builtins':
+        raise NotImplementedError(f'Unable to construct {cls}')
+    sig = resolve_signature(cls.__init__)  # type: ignore
+    if sig is None:
+        raise NotImplementedError(f'Unable to construct {cls}')
+    params = list(sig.parameters.values())[1:]
+    bound = args_for_signature(sig.replace(parameters=params), r, depth + 1)
+    try:
+        obj = cls(*bound.args, **bound.kwargs)
+    except Exception as e:
+        raise InputRejected(f'Unable to construct {cls}: {e!r}')
+    # Instances must meet their class invariants:
+    for inv in get_class_conditions(cls).inv:
+        if inv.expr is None:
+            continue
+        try:
+            ok = inv.evaluate({'self': obj})
+        except Exception:
+            ok = False
+        if not ok:
+            raise InputRejected(f'Instance does not meet "{inv.expr_source}"')
+    return obj
+
+
+def value_for_type(typ: Type, r: random.Random, depth: int = 0) -> object:
+    '''
+    Generates a concrete value for the given type. Raises
+    NotImplementedError when the type is not supported, and InputRejected
+    when a (user-defined) value could not be made this time.
+    '''
+    typ = _normalize(typ)
+    origin = origin_of(typ)
+    type_args = _type_args(typ)
+    if typ is object or typ is Hashable:
+        choices = _IMMUTABLE_TYPES if typ is Hashable or depth >= _MAX_DEPTH else \
+            _IMMUTABLE_TYPES + (List[object], Dict[Hashable, object])
+        return value_for_type(r.choice(choices), r, depth + 1)
+    if typing_inspect.is_union_type(typ):
+        options = list(type_args)
+        if depth >= _MAX_DEPTH and type(None) in options:
+            return None
+        return value_for_type(r.choice(options), r, depth)
+    if typ is type(None) or typ is None:
+        return None
+    if typ is bool:
+        return r.choice([True, False])
+    if typ is int:
+        return r.choice(_INTS) if r.random() < 0.5 else r.randint(-1000, 1000)
+    if typ is float:
+        return r.choice(_FLOATS) if r.random() < 0.5 else r.uniform(-1000.0, 1000.0)
+    if typ is complex:
+        return complex(cast(float, value_for_type(float, r)), cast(float, value_for_type(float, r)))
+    if typ is str:
+        return _str(r)
+    if typ in (bytes, bytearray, ByteString):
+        value = _str(r).encode()
+        return bytearray(value) if typ is bytearray else value
+    if isinstance(typ, type) and issubclass(typ, enum.Enum):
+        return r.choice(list(typ))  # type: ignore
+    if origin is tuple:
+        if type_args == ((),):
+            return ()
+        if not type_args or (len(type_args) == 2 and type_args[1] == ...):
+            item_type = type_args[0] if type_args else object
+            return tuple(value_for_type(item_type, r, depth + 1) for _ in range(_length(r, depth)))
+        return tuple(value_for_type(t, r, depth + 1) for t in type_args)
+    if origin in _SEQUENCE_ORIGINS or origin in _SET_ORIGINS or origin is frozenset:
+        (item_type,) = type_args or (object,)
+        if origin in _SET_ORIGINS or origin is frozenset:
+            item_type = Hashable if _normalize(item_type) is object else item_type
+        items = [value_for_type(item_type, r, depth + 1) for _ in range(_length(r, depth))]
+        if origin is frozenset:
+            return frozenset(items)
+        return set(items) if origin in _SET_ORIGINS else items
+    if origin in _MAPPING_ORIGINS:
+        (key_type, val_type) = type_args or (Hashable, object)
+        key_type = Hashable if _normalize(key_type) is object else key_type
+        return {value_for_type(key_type, r, depth + 1): value_for_type(val_type, r, depth + 1)
+                for _ in range(_length(r, depth))}
+    if isinstance(typ, type) and not type_args:
+        return _instance(typ, r, depth)
+    raise NotImplementedError(f'Unable to generate values of type {typ}')
+
+
+def args_for_signature(sig: inspect.Signature, r: random.Random,
+                       depth: int = 0) -> inspect.BoundArguments:
+    ''' Generates concrete arguments for every parameter of the signature. '''
+    args = sig.bind_partial()
+    for param in sig.parameters.values():
+        if param.kind == inspect.Parameter.VAR_POSITIONAL:
+            value: object = value_for_type(Tuple[param.annotation, ...], r, depth) \
+                if param.annotation != inspect.Parameter.empty else ()
+        elif param.kind == inspect.Parameter.VAR_KEYWORD:
+            value = value_for_type(Dict[str, param.annotation], r, depth) \
+                if param.annotation != inspect.Parameter.empty else {}
+        else:
+            value = value_for_type(param.annotation, r, depth)
+        args.arguments[param.name] = value
+    return args
@@ -0,0 +1,236 @@
+'''
+Steering symbolic inputs toward their preconditions.
+
+Arguments are created fully general, and only then checked against the
+`pre:` conditions (and class `inv:` conditions); every path on which a
+condition fails is wasted. Here we recognize simple parts of those
+conditions from their syntax, so that inputs can be made to satisfy them
+as they are created:
+
+* comparisons among arguments, their attributes, `len()` of arguments,
+  and constants (with +, - and *), like `0 <= x < len(items)`
+* membership in literal collections, like `mode in ('r', 'w')`
+* `isinstance(x, SomeClass)`, which narrows the type of the proxy for x
+
+A condition is a conjunction of parts (`a and b and ...`); each simple
+part is recognized on its own. Preconditions are still evaluated in full
+afterwards, so this only changes which inputs we try first.
+
+>>> hints = condition_hints('isinstance(x, int) and 0 <= x < len(s) and s[0] == "a"', {'x', 's'})
+>>> [c.source for c in hints.comparisons], sorted(hints.isinstance_sources)
+(['0 <= x', 'x < len(s)'], ['x'])
+'''
+
+import ast
+import functools
+import inspect
+import operator
+from typing import *
+
+import typing_inspect  # type: ignore
+import z3  # type: ignore
+
+from crosshair.condition_parser import ConditionExpr
+from crosshair.statespace import StateSpace
+from crosshair.util import debug, CrosshairInternal, IgnoreAttempt, UnexploredPath
+
+_COMPARISON_OPS: Dict[type, Callable[[object, object], object]] = {
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+}
+_ARITHMETIC_OPS = (ast.Add, ast.Sub, ast.Mult)
+_CONSTANTS = (ast.Num, ast.Str, ast.Bytes, ast.NameConstant)
+
+
+def _conjuncts(node: ast.expr) -> Iterator[ast.expr]:
+    if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.And):
+        for value in node.values:
+            yield from _conjuncts(value)
+    else:
+        yield node
+
+
+def _is_term(node: ast.expr, names: AbstractSet[str]) -> bool:
+    ''' Whether `node` can be evaluated without branching or side effects. '''
+    if isinstance(node, ast.Name):
+        return node.id in names
+    if isinstance(node, _CONSTANTS):
+        return True
+    if isinstance(node, ast.Attribute):
+        return isinstance(node.value, ast.Name) and node.value.id in names
+    if isinstance(node, ast.Call):
+        return (isinstance(node.func, ast.Name) and node.func.id == 'len' and
+                len(node.args) == 1 and not node.keywords and
+                isinstance(node.args[0], ast.Name) and node.args[0].id in names)
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        return _is_term(node.operand, names)
+    if isinstance(node, ast.BinOp) and isinstance(node.op, _ARITHMETIC_OPS):
+        return _is_term(node.left, names) and _is_term(node.right, names)
+    return False
+
+
+def _mentions(node: ast.expr, names: AbstractSet[str]) -> bool:
+    return any(isinstance(n, ast.Name) and n.id in names for n in ast.walk(node))
+
+
+def _compile(node: ast.expr) -> Any:
+    return compile(ast.fix_missing_locations(ast.Expression(body=node)), '<string>', 'eval')
+
+
+def _source(first: ast.expr, last: ast.expr, source: str) -> str:
+    # (end positions need Python 3.8; we only use these for debugging)
+    end = getattr(last, 'end_col_offset', None)
+    return source[first.col_offset:end] if end is not None else source
+
+
+def _smt_value(value: object) -> Union[bool, z3.ExprRef, None]:
+    ''' The result of a comparison, as a bool or a z3 expression (None if neither). '''
+    # (builtinslib imports crosshair.core, which imports us)
+    from crosshair.libimpl.builtinslib import SmtBool
+    if type(value) is bool:
+        return value
+    if type(value) is SmtBool:
+        return value.var  # type: ignore
+    return None
+
+
+class Comparison:
+    def __init__(self, left: ast.expr, op: ast.cmpop, right: ast.expr, source: str):
+        self.left = _compile(left)
+        self.op = _COMPARISON_OPS[type(op)]
+        self.right = _compile(right)
+        self.source = source
+
+    def smt_condition(self, bindings: Mapping[str, object]) -> Optional[z3.ExprRef]:
+        ''' The condition as a z3 expression, if it is (still) symbolic. '''
+        scope = dict(bindings)
+        ret = _smt_value(self.op(eval(self.left, scope), eval(self.right, scope)))
+        return None if ret is None or isinstance(ret, bool) else ret
+
+
+class Membership:
+    def __init__(self, item: ast.expr, options: Sequence[object], negated: bool, source: str):
+        self.item = _compile(item)
+        self.options = options
+        self.negated = negated
+        self.source = source
+
+    def smt_condition(self, bindings: Mapping[str, object]) -> Optional[z3.ExprRef]:
+        item = eval(self.item, dict(bindings))
+        if self.negated:
+            values = [_smt_value(item != option) for option in self.options]
+        else:
+            values = [_smt_value(item == option) for option in self.options]
+        # (a concrete outcome for any option may decide the whole condition)
+        if None in values or (not self.negated) in values:
+            return None
+        exprs = [v for v in values if not isinstance(v, bool)]
+        if not exprs:
+            return None
+        return z3.And(exprs) if self.negated else z3.Or(exprs)
+
+
+class ConditionHints:
+    def __init__(self):
+        self.comparisons: List[Union[Comparison, Membership]] = []
+        # The source of the class in `isinstance(name, <class>)`, by name:
+        self.isinstance_sources: Dict[str, Any] = {}
+
+
+def condition_hints(source: str, names: AbstractSet[str]) -> ConditionHints:
+    ''' Recognizes the simple parts of a condition over the given `names`. '''
+    hints = ConditionHints()
+    source = source.strip()
+    try:
+        tree = ast.parse(source, mode='eval')
+    except SyntaxError:
+        return hints
+    for node in _conjuncts(tree.body):
+        if isinstance(node, ast.Compare):
+            operands = [node.left] + node.comparators
+            if len(node.ops) == 1 and isinstance(node.ops[0], (ast.In, ast.NotIn)):
+                (container,) = node.comparators
+                if (_is_term(node.left, names) and _mentions(node.left, names) and
+                        isinstance(container, (ast.Tuple, ast.List, ast.Set)) and
+                        all(isinstance(e, _CONSTANTS) for e in container.elts)):
+                    options = [ast.literal_eval(e) for e in container.elts]
+                    hints.comparisons.append(Membership(
+                        node.left, options, isinstance(node.ops[0], ast.NotIn),
+                        _source(node, node, source)))
+                continue
+            # Chains like `0 <= x < n` are split into pairs:
+            for left, op, right in zip(operands, node.ops, node.comparators):
+                if type(op) in _COMPARISON_OPS and _is_term(left, names) and \
+                        _is_term(right, names) and (_mentions(left, names) or _mentions(right, names)):
+                    hints.comparisons.append(Comparison(left, op, right, _source(left, right, source)))
+        elif (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and
+              node.func.id == 'isinstance' and len(node.args) == 2 and not node.keywords and
+              isinstance(node.args[0], ast.Name) and node.args[0].id in names):
+            hints.isinstance_sources[node.args[0].id] = _compile(node.args[1])
+    return hints
+
+
+# (hints depend only on the source of a condition and the names it may
+# bind, so conditions that are reloaded, say in watch mode, share them)
+@functools.lru_cache(maxsize=1024)
+def _cached_hints(source: str, names: FrozenSet[str]) -> ConditionHints:
+    return condition_hints(source, names)
+
+
+def hints_for(condition: ConditionExpr, names: AbstractSet[str]) -> ConditionHints:
+    if condition.expr is None:
+        return ConditionHints()
+    return _cached_hints(condition.expr_source, frozenset(names))
+
+
+def steer_toward(hints: ConditionHints, bindings: Mapping[str, object], space: StateSpace) -> bool:
+    '''
+    Decides, where possible, that the simple parts of a condition hold. We
+    favor these decisions on new branches; the other outcomes are left for
+    later paths, which will then fail the condition itself. Returns False
+    when this path has taken such an other outcome (there is no point in
+    steering it further).
+    '''
+    for part in hints.comparisons:
+        try:
+            expr = part.smt_condition(bindings)
+        except (IgnoreAttempt, UnexploredPath, CrosshairInternal):
+            raise
+        except Exception as e:
+            debug('Unable to steer toward', part.source, 'because', repr(e))
+            continue
+        if expr is not None and not space.choose_possible(expr, favor_true=True):
+            return False
+    return True
+
+
+def narrowed_type(typ: Type, namespace: Dict[str, object], hints: ConditionHints, name: str) -> Type:
+    '''
+    Narrows the type of argument `name` to the class that the condition
+    requires it to be an instance of, when that class is among the values of
+    `typ` (or a subclass of one).
+    '''
+    class_source = hints.isinstance_sources.get(name)
+    if class_source is None:
+        return typ
+    try:
+        cls = eval(class_source, dict(namespace))
+    except Exception:
+        return typ
+    if not isinstance(cls, type):
+        return typ
+    if typ in (Any, object, inspect.Parameter.empty):
+        return cls
+    candidates = typing_inspect.get_args(typ, evaluate=True) if typing_inspect.is_union_type(typ) \
+        else (typ,)
+    for candidate in candidates:
+        try:
+            if isinstance(candidate, type) and issubclass(cls, candidate):
+                return cls
+        except TypeError:
+            continue
+    return typ
@@ -0,0 +1,84 @@
+'''
+Harvesting the inputs that tests pass to functions with contracts.
+
+`crosshair harvest` runs the doctests of some modules (and, optionally, a
+pytest session) with the contracts of those modules enforced. Each call
+to a function with contracts goes through an enforcement wrapper (see
+crosshair.enforce); we record the arguments of the calls that meet their
+preconditions. The records are kept in the same format as a counterexample
+corpus (see crosshair.corpus).
+
+`crosshair check --seeds FILE` then starts its first paths from these
+inputs, so that the analysis reaches the behaviors that the tests
+exercise right away, instead of by random walk.
+'''
+
+import doctest
+import inspect
+import io
+import types
+import unittest
+from typing import *
+
+from crosshair.condition_parser import fn_globals
+from crosshair.corpus import Corpus, CorpusEntry, corpus_key
+from crosshair.enforce import EnforcedConditions
+from crosshair.util import debug
+
+
+def round_trip_reprs(fn: Callable, bound_args: inspect.BoundArguments) -> Optional[CorpusEntry]:
+    '''
+    The reprs of the arguments, if each of them evaluates (in the
+    function's globals) back to an equal value.
+
+    >>> round_trip_reprs(len, inspect.signature(divmod).bind(7, 2))
+    (('x', '7'), ('y', '2'))
+    >>> round_trip_reprs(len, inspect.signature(divmod).bind(7, object())) is None
+    True
+    '''
+    namespace = fn_globals(fn) if isinstance(fn, types.FunctionType) else {}
+    entry = []
+    for name, value in bound_args.arguments.items():
+        try:
+            repr_str = repr(value)
+            if eval(repr_str, dict(namespace)) != value:
+                return None
+        except Exception:
+            return None
+        entry.append((name, repr_str))
+    return tuple(entry)
+
+
+class Harvester:
+    def __init__(self, corpus: Corpus, max_per_function: int = 16):
+        self.corpus = corpus
+        self.max_per_function = max_per_function
+        self.num_observed = 0
+
+    def observe(self, fn: Callable, bound_args: inspect.BoundArguments) -> None:
+        self.num_observed += 1
+        key = corpus_key(fn)
+        if len(self.corpus.entries_for(key)) >= self.max_per_function:
+            return
+        entry = round_trip_reprs(fn, bound_args)
+        if entry is None:
+            debug('Not harvesting inputs for', key, '; they do not round trip through repr()')
+            return
+        self.corpus.add(key, entry)
+
+    def run_doctests(self, modules: Sequence[types.ModuleType]) -> unittest.TestResult:
+        with EnforcedConditions(*(m.__dict__ for m in modules), observer=self.observe):
+            # (the examples run in copies of the module globals, which we
+            # make after the functions are wrapped)
+            suite = unittest.TestSuite()
+            for module in modules:
+                try:
+                    suite.addTests(doctest.DocTestSuite(module))
+                except ValueError:  # (it has no doctests)
+                    continue
+            return unittest.TextTestRunner(stream=io.StringIO()).run(suite)
+
+    def run_pytest(self, modules: Sequence[types.ModuleType], pytest_args: Sequence[str]) -> int:
+        import pytest  # type: ignore
+        with EnforcedConditions(*(m.__dict__ for m in modules), observer=self.observe):
+            return pytest.main(['-q', '-p', 'no:cacheprovider', *pytest_args])
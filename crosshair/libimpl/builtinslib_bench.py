@@ -0,0 +1,161 @@
+'''
+Microbenchmarks for the symbolic values in builtinslib.
+
+Each iteration of a benchmark makes fresh symbolic inputs (untimed), and
+then times a single operation on them. Like an analysis, iterations share a
+search tree, so that successive iterations take different paths through the
+operation. We report operations per second and the number of solver calls
+that each operation makes.
+
+Run them with `crosshair bench --micro [NAME ...]`.
+'''
+
+import time
+from dataclasses import dataclass
+from typing import *
+from typing import TextIO
+
+from crosshair.core import proxy_for_type
+from crosshair.statespace import CallAnalysis, SinglePathNode, StateSpace, TrackingStateSpace, VerificationStatus
+from crosshair.util import CrosshairInternal
+
+
+# Each benchmark is a pair of (input types, operation). The operation is
+# given the state space, followed by symbolic inputs of those types:
+_Benchmark = Tuple[Tuple[type, ...], Callable[..., object]]
+
+
+def _branch(condition: object) -> bool:
+    return True if condition else False
+
+
+def _iterate(space: StateSpace, values: Iterable) -> None:
+    for _ in values:
+        pass
+
+
+def _append(space: StateSpace, values: List[int], value: int) -> None:
+    values.append(value)
+
+
+def _set_and_get(space: StateSpace, d: Dict[int, int], k1: int, k2: int) -> object:
+    d[k1] = 1
+    return d.get(k2)
+
+
+BENCHMARKS: Dict[str, _Benchmark] = {
+    'int_arithmetic': ((int, int), lambda space, a, b: (a + b) * 3 - a),
+    'int_compare': ((int, int), lambda space, a, b: _branch(a < b)),
+    'bool_branch': ((bool, bool), lambda space, a, b: _branch(a and not b)),
+    'dict_get_set': ((Dict[int, int], int, int), _set_and_get),
+    'dict_iterate': ((Dict[int, int],), _iterate),
+    'set_contains': ((Set[int], int), lambda space, s, x: _branch(x in s)),
+    'set_iterate': ((Set[int],), _iterate),
+    'list_index': ((List[int], int), lambda space, l, i: l[i]),
+    'list_slice': ((List[int], int), lambda space, l, i: l[1:i]),
+    'list_append': ((List[int], int), _append),
+    'str_concat': ((str, str), lambda space, s, t: s + t),
+    'str_slice': ((str, int), lambda space, s, i: s[1:i]),
+    'str_find': ((str, str), lambda space, s, t: s.find(t)),
+    'proxy_nested_generic': ((), lambda space: proxy_for_type(
+        Dict[str, List[Tuple[int, Optional[str]]]], space, 'nested')),
+}
+
+
+@dataclass
+class MicroResult:
+    name: str
+    ops: int
+    seconds: float
+    solver_calls: int
+    errors: int
+
+    def ops_per_second(self) -> float:
+        return self.ops / self.seconds if self.seconds else 0.0
+
+    def solver_calls_per_op(self) -> float:
+        return self.solver_calls / self.ops if self.ops else 0.0
+
+    def toJSON(self) -> dict:
+        return {
+            'ops': self.ops,
+            'seconds': self.seconds,
+            'ops_per_second': self.ops_per_second(),
+            'solver_calls_per_op': self.solver_calls_per_op(),
+            'errors': self.errors,
+        }
+
+
+def run_microbenchmark(name: str, iterations: int = 100) -> MicroResult:
+    arg_types, operation = BENCHMARKS[name]
+    seconds = 0.0
+    solver_calls = 0
+    errors = 0
+    search_root = SinglePathNode(True)
+    for iteration in range(iterations):
+        space = TrackingStateSpace(execution_deadline=time.time() + 10.0,
+                                   model_check_timeout=5.0,
+                                   search_root=search_root)
+        args = [proxy_for_type(typ, space, f'arg{idx}_{iteration}')
+                for idx, typ in enumerate(arg_types)]
+        calls_before = space.stats.counters['solver_calls']
+        start = time.time()
+        try:
+            operation(space, *args)
+        except CrosshairInternal:
+            raise
+        except Exception:
+            # Symbolic inputs legitimately produce errors (IndexError, ...),
+            # and some paths cannot be explored; the time still counts.
+            errors += 1
+        seconds += time.time() - start
+        solver_calls += space.stats.counters['solver_calls'] - calls_before
+        _, exhausted = space.bubble_status(CallAnalysis(VerificationStatus.CONFIRMED))
+        if exhausted:
+            search_root = SinglePathNode(True)
+    return MicroResult(name, iterations, seconds, solver_calls, errors)
+
+
+def run_microbenchmarks(names: Sequence[str], iterations: int = 100) -> Dict[str, MicroResult]:
+    names = names or sorted(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            raise ValueError(f'Unknown microbenchmark "{name}"; choose from: ' +
+                             ', '.join(sorted(BENCHMARKS)))
+    return {name: run_microbenchmark(name, iterations) for name in names}
+
+
+def describe_microbenchmarks(results: Mapping[str, MicroResult], stdout: TextIO) -> None:
+    stdout.write(f'{"benchmark":24}  {"ops/sec":>10}  {"solver calls/op":>15}  {"errors":>6}\n')
+    for name, result in results.items():
+        stdout.write(f'{name:24}  {result.ops_per_second():10.1f}  '
+                     f'{result.solver_calls_per_op():15.2f}  {result.errors:6d}\n')
+
+
+def microbenchmarks_to_json(results: Mapping[str, MicroResult]) -> dict:
+    return {'micro': {name: result.toJSON() for name, result in results.items()}}
+
+
+def compare_microbenchmarks(current: dict, baseline: dict, max_slowdown: float = 0.25) -> List[str]:
+    '''
+    Lists regressions of `current` results relative to `baseline` (both as
+    produced by microbenchmarks_to_json()).
+
+    >>> base = {'micro': {'x': {'ops_per_second': 100.0, 'solver_calls_per_op': 1.0}}}
+    >>> cur = {'micro': {'x': {'ops_per_second': 70.0, 'solver_calls_per_op': 2.0}}}
+    >>> for problem in compare_microbenchmarks(cur, base): print(problem)
+    x: 70.0 ops/sec (baseline: 100.0)
+    x: 2.00 solver calls/op (baseline: 1.00)
+    '''
+    problems = []
+    for name, base in sorted(baseline.get('micro', {}).items()):
+        cur = current['micro'].get(name)
+        if cur is None:
+            continue
+        if cur['ops_per_second'] * (1 + max_slowdown) < base['ops_per_second']:
+            problems.append(f'{name}: {cur["ops_per_second"]:.1f} ops/sec '
+                            f'(baseline: {base["ops_per_second"]:.1f})')
+        if cur['solver_calls_per_op'] > base['solver_calls_per_op'] * (1 + max_slowdown):
+            problems.append(f'{name}: {cur["solver_calls_per_op"]:.2f} solver calls/op '
+                            f'(baseline: {base["solver_calls_per_op"]:.2f})')
+    return problems
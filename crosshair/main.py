@@ -1,5 +1,6 @@
 import argparse
 import collections
+import contextlib
 import dataclasses
 import enum
 import heapq
@@ -18,11 +19,22 @@ import signal
 import sys
 import time
 import traceback
+import types
 from typing import *
 from typing import TextIO
 
+from crosshair.bench import compare_to_baseline, describe_results, example_modules, run_benchmarks
+from crosshair.corpus import Corpus
+from crosshair.harvest import Harvester
+from crosshair.libimpl.builtinslib_bench import compare_microbenchmarks, describe_microbenchmarks, microbenchmarks_to_json, run_microbenchmarks
 from crosshair.localhost_comms import StateUpdater, read_states
-from crosshair.core_and_libs import AnalysisMessage, AnalysisOptions, MessageType, analyzable_members, analyze_module, analyze_any, exception_line_in_file
+from crosshair.profiler import SamplingProfiler
+from crosshair.reproducer import write_reproducers
+from crosshair.smtlog import QueryLogger
+from crosshair.statespace import SearchTreeNode
+from crosshair.stats import ConditionStats, coverage_report, merge_condition_stats, realization_report, stats_to_json
+from crosshair.treedump import write_search_trees
+from crosshair.core_and_libs import AnalysisMessage, AnalysisOptions, MessageType, analyzable_members, analyze_module, analyze_any, checkables_for_any, collect_messages, run_checkables, exception_line_in_file
 from crosshair.util import debug, extract_module_from_file, set_debug, CrosshairInternal, load_file, load_by_qualname, NotFound, ErrorDuringImport
 import crosshair.core_and_libs
 
@@ -31,13 +43,77 @@ def command_line_parser() -> argparse.ArgumentParser:
     common.add_argument('--verbose', '-v', action='store_true')
     common.add_argument('--per_path_timeout', type=float)
     common.add_argument('--per_condition_timeout', type=float)
+    common.add_argument('--adaptive_timeouts', action='store_true',
+                        help='fit path and solver timeouts to the latencies observed for each condition')
+    common.add_argument('--min_path_timeout', type=float)
+    common.add_argument('--max_path_timeout', type=float)
+    common.add_argument('--max_iterations', type=int,
+                        help='explore at most this many paths per condition, and use the deterministic budgets below instead of timeouts')
+    common.add_argument('--max_path_decisions', type=int,
+                        help='(with --max_iterations) abandon paths after this many decisions')
+    common.add_argument('--solver_rlimit', type=int,
+                        help='(with --max_iterations) limit each solver check to this many z3 resource units')
+    common.add_argument('--solver_portfolio', action='store_true',
+                        help='race several solver configurations on slow solver checks')
+    common.add_argument('--portfolio_threshold', type=float,
+                        help='(with --solver_portfolio) race solver checks that take longer than this many seconds')
+    common.add_argument('--learn_lemmas', action='store_true',
+                        help='learn unsat cores from infeasible branches, and reuse them to decide branches on later paths')
+    common.add_argument('--slice_constraints', action='store_true',
+                        help='split path constraints into independent groups, with a solver for each')
+    common.add_argument('--fork_paths', action='store_true',
+                        help='(Linux only) fork at new branches, so that later paths resume there instead of starting over')
+    common.add_argument('--max_parked_paths', type=int,
+                        help='(with --fork_paths) how many forked processes may wait on each other at once')
+    common.add_argument('--merge_branches', action='store_true',
+                        help='join the outcomes of simple integer branches, instead of exploring each separately')
+    common.add_argument('--concrete_samples', type=int, metavar='K',
+                        help='after each confirmed path, run up to K other inputs along it concretely')
+    common.add_argument('--fuzz_time', type=float, metavar='SECONDS',
+                        help='first check each condition on random concrete inputs for up to this long')
+    common.add_argument('--coverage_guided', action='store_true',
+                        help='trace the lines and branches that paths cover, and favor branches that lead to new coverage')
     parser = argparse.ArgumentParser(description='CrossHair Analysis Tool')
     subparsers = parser.add_subparsers(help='sub-command help', dest='action')
     check_parser = subparsers.add_parser(
         'check', help='Analyze one or more files', parents=[common])
     check_parser.add_argument('--report_all', action='store_true')
+    check_parser.add_argument('--stats_json', metavar='FILE', type=str,
+                              help='write counters and timers for each condition to FILE as JSON')
+    check_parser.add_argument('--report_realizations', action='store_true',
+                              help='finish with a ranked list of the source lines that forced symbolic values to be made concrete')
+    check_parser.add_argument('--report_coverage', action='store_true',
+                              help='finish with the line and branch coverage of each condition (implies --coverage_guided)')
+    check_parser.add_argument('--profile', metavar='FILE', type=str,
+                              help='sample the analysis and write collapsed stacks (or speedscope JSON, for a .json FILE)')
+    check_parser.add_argument('--search_tree', metavar='FILE', type=str,
+                              help='write the explored search tree of each condition to FILE as JSON (or Graphviz, for a .dot FILE)')
+    check_parser.add_argument('--dump_smt', metavar='DIR', type=str,
+                              help='write every solver query to DIR as an SMT-LIB2 file (replay them with `python -m crosshair.smtreplay DIR`)')
+    check_parser.add_argument('--corpus', metavar='FILE', type=str,
+                              help='replay the counterexamples recorded in FILE before searching, and record new ones there')
+    check_parser.add_argument('--seeds', metavar='FILE', type=str,
+                              help='start the first paths from the inputs in FILE (see the `harvest` command)')
+    check_parser.add_argument('--reproducers', metavar='FILE', type=str,
+                              help='write a pytest file to FILE that repeats each counterexample as a concrete call')
     check_parser.add_argument('files', metavar='F', type=str, nargs='+',
                               help='files or fully qualified modules, classes, or functions')
+    harvest_parser = subparsers.add_parser(
+        'harvest', help='Record the inputs that tests pass to functions with contracts', parents=[common])
+    harvest_parser.add_argument('--seeds', metavar='FILE', type=str, required=True,
+                                help='the file to add the inputs to (for use with `check --seeds`)')
+    harvest_parser.add_argument('--pytest', metavar='ARG', type=str, action='append',
+                                help='also run pytest, with this argument (may be repeated; write options as --pytest=-k)')
+    harvest_parser.add_argument('files', metavar='F', type=str, nargs='+',
+                                help='files or fully qualified modules; runs their doctests')
+    replay_parser = subparsers.add_parser(
+        'replay', help='Take a single path of the analysis again, by its execution log', parents=[common])
+    replay_parser.add_argument('--condition', metavar='EXPR', type=str,
+                               help='the postcondition to check (when the function has several)')
+    replay_parser.add_argument('target', metavar='T', type=str,
+                               help='a fully qualified function or method')
+    replay_parser.add_argument('log', metavar='LOG', type=str,
+                               help='the branch decisions to make, as reported in a message\'s execution_log')
     watch_parser = subparsers.add_parser(
         'watch', help='Continuously watch and analyze files', parents=[common])
     watch_parser.add_argument('files', metavar='F', type=str, nargs='+',
@@ -46,6 +122,20 @@ def command_line_parser() -> argparse.ArgumentParser:
         'showresults', help='Display results from a currently running `watch` command', parents=[common])
     showresults_parser.add_argument('files', metavar='F', type=str, nargs='+',
                                     help='files or directories to analyze')
+    bench_parser = subparsers.add_parser(
+        'bench', help='Benchmark the analysis of the bundled examples', parents=[common])
+    bench_parser.add_argument('--output', metavar='FILE', type=str,
+                              help='write the results to FILE as JSON')
+    bench_parser.add_argument('--baseline', metavar='FILE', type=str,
+                              help='report regressions relative to results previously written with --output')
+    bench_parser.add_argument('--max_slowdown', type=float, default=0.25,
+                              help='the fraction by which timings may degrade before they are reported (default: 0.25)')
+    bench_parser.add_argument('--micro', action='store_true',
+                              help='run microbenchmarks of symbolic value operations instead of the examples')
+    bench_parser.add_argument('--iterations', type=int, default=100,
+                              help='the number of operations timed for each microbenchmark (default: 100)')
+    bench_parser.add_argument('modules', metavar='M', type=str, nargs='*',
+                              help='example modules (or, with --micro, microbenchmarks) to run (default: all)')
     return parser
 
 def mtime(path: str) -> Optional[float]:
@@ -56,8 +146,14 @@ def mtime(path: str) -> Optional[float]:
 
 def process_level_options(command_line_args: argparse.Namespace) -> AnalysisOptions:
     options = AnalysisOptions()
-    for optname in ('per_path_timeout', 'per_condition_timeout', 'report_all'):
-        arg_val = getattr(command_line_args, optname)
+    for optname in ('per_path_timeout', 'per_condition_timeout', 'report_all',
+                    'adaptive_timeouts', 'min_path_timeout', 'max_path_timeout',
+                    'max_iterations', 'max_path_decisions', 'solver_rlimit',
+                    'solver_portfolio', 'portfolio_threshold', 'learn_lemmas',
+                    'slice_constraints', 'fork_paths', 'max_parked_paths',
+                    'merge_branches', 'concrete_samples', 'fuzz_time',
+                    'coverage_guided'):
+        arg_val = getattr(command_line_args, optname, None)
         if arg_val is not None:
             setattr(options, optname, arg_val)
     return options
@@ -87,7 +183,8 @@ class WatchedMember:
 
 WorkItemInput = Tuple[str, # (filename)
                       AnalysisOptions, float]  # (float is a deadline)
-WorkItemOutput = Tuple[WatchedMember, Counter[str], List[AnalysisMessage]]
+WorkItemOutput = Tuple[str, # (filename)
+                       Counter[str], Dict[str, ConditionStats], List[AnalysisMessage]]
 
 def import_error_msg(err: ErrorDuringImport) -> AnalysisMessage:
     orig, frame = err.args
@@ -112,11 +209,14 @@ def pool_worker_main(item: WorkItemInput, output: multiprocessing.queues.Queue)
         except NotFound:
             return
         except ErrorDuringImport as e:
-            output.put((filename, stats, [import_error_msg(e)]))
+            output.put((filename, stats, {}, [import_error_msg(e)]))
             debug(f'Not analyzing "{filename}" because import failed: {e}')
             return
-        messages = analyze_any(module, options)
-        output.put((filename, stats, messages))
+        # Report each condition as it completes; quick conditions should not
+        # wait on slow ones:
+        for checkable in run_checkables(checkables_for_any(module, options), options):
+            output.put((filename, stats.copy(), checkable.get_stats(), checkable.get_messages()))
+            stats.clear()
     except BaseException as e:
         raise CrosshairInternal(
             'Worker failed while analyzing ' + filename) from e
@@ -234,7 +334,7 @@ class Watcher:
 
     def run_iteration(self,
                       max_condition_timeout=0.5) -> Iterator[
-                          Tuple[Counter[str], List[AnalysisMessage]]]:
+                          Tuple[Counter[str], Dict[str, ConditionStats], List[AnalysisMessage]]]:
         debug(f'starting pass '
               f'with a condition timeout of {max_condition_timeout}')
         debug('Files:', self._modtimes.keys())
@@ -249,8 +349,8 @@ class Watcher:
         while pool.is_working():
             result = pool.get_result(timeout=1.0)
             if result is not None:
-                (_, counters, messages) = result
-                yield (counters, messages)
+                (_, counters, condition_stats, messages) = result
+                yield (counters, condition_stats, messages)
                 if pool.has_result():
                     continue
             change_detected = self.check_changed()
@@ -262,11 +362,12 @@ class Watcher:
                 return
             pool.garden_workers()
         debug('Worker pool tasks complete')
-        yield (Counter(), [])
+        yield (Counter(), {}, [])
 
     def run_watch_loop(self) -> NoReturn:
         restart = True
         stats: Counter[str] = Counter()
+        condition_stats: Dict[str, ConditionStats] = {}
         active_messages: Dict[Tuple[str, int], AnalysisMessage]
         while True:
             if restart:
@@ -277,18 +378,21 @@ class Watcher:
                 max_condition_timeout = 0.5
                 restart = False
                 stats = Counter()
+                condition_stats = {}
                 active_messages = {}
             else:
                 time.sleep(0.5)
                 max_condition_timeout *= 2
-            for curstats, messages in self.run_iteration(max_condition_timeout):
+            for curstats, cur_condition_stats, messages in self.run_iteration(max_condition_timeout):
                 debug('stats', curstats, messages)
                 stats.update(curstats)
+                merge_condition_stats(condition_stats, cur_condition_stats)
                 if messages_merged(active_messages, messages):
                     self._state_updater.update(json.dumps({
                         'version': 1,
                         'time': time.time(),
-                        'messages': [m.toJSON() for m in active_messages.values()]}))
+                        'messages': [m.toJSON() for m in active_messages.values()],
+                        'condition_stats': {k: v.toJSON() for k, v in condition_stats.items()}}))
                     linecache.checkcache()
                     clear_screen()
                     for message in active_messages.values():
@@ -449,26 +553,148 @@ def showresults(args: argparse.Namespace, options: AnalysisOptions) -> int:
 
 def check(args: argparse.Namespace, options: AnalysisOptions, stdout: TextIO) -> int:
     any_problems = False
+    condition_stats: Dict[str, ConditionStats] = {}
+    search_trees: Optional[Dict[str, SearchTreeNode]] = {} if args.search_tree else None
+    profiler = SamplingProfiler() if args.profile else None
+    if profiler is not None:
+        options = dataclasses.replace(options, profiler=profiler)
+    if args.dump_smt:
+        options = dataclasses.replace(options, query_logger=QueryLogger(args.dump_smt))
+    if args.corpus:
+        options = dataclasses.replace(options, corpus=Corpus(args.corpus))
+    if args.seeds:
+        options = dataclasses.replace(options, seeds=Corpus(args.seeds))
+    if args.report_coverage:
+        options = dataclasses.replace(options, coverage_guided=True)
+    refutations: List[AnalysisMessage] = []
+    if args.reproducers:
+        options = dataclasses.replace(options, realize_inputs=True)
+    if args.report_realizations or args.search_tree or args.stats_json:
+        options = dataclasses.replace(options, record_sites=True)
+    with profiler or contextlib.nullcontext():
+        for name in args.files:
+            entity: object
+            try:
+                entity = load_file(name) if name.endswith('.py') else load_by_qualname(name)
+            except ErrorDuringImport as e:
+                stdout.write(str(short_describe_message(import_error_msg(e), options)) + '\n')
+                any_problems = True
+                continue
+            debug('Check ', getattr(entity, '__name__', str(entity)))
+            for message in collect_messages(checkables_for_any(entity, options), options,
+                                            condition_stats, search_trees):
+                line = short_describe_message(message, options)
+                if line is None:
+                    continue
+                stdout.write(line + '\n')
+                debug('Traceback for output message:\n', message.traceback)
+                if message.execution_log is not None and message.test_fn is not None:
+                    _, module = extract_module_from_file(message.filename)
+                    debug('Replay this path with: crosshair replay',
+                          f'{module}.{message.test_fn}', message.execution_log or "''")
+                if message.state > MessageType.PRE_UNSAT:
+                    any_problems = True
+                    refutations.append(message)
+    if profiler is not None:
+        profiler.write(args.profile)
+        debug(profiler.summary())
+    if args.stats_json:
+        with open(args.stats_json, 'w') as fh:
+            fh.write(stats_to_json(condition_stats))
+    if search_trees is not None:
+        write_search_trees(args.search_tree, search_trees)
+    if options.corpus is not None:
+        options.corpus.save()
+    if args.reproducers:
+        num_tests = write_reproducers(args.reproducers, refutations)
+        debug('Wrote', num_tests, 'reproducers to', args.reproducers)
+    if args.report_realizations:
+        print(realization_report(condition_stats), file=stdout)
+    if args.report_coverage:
+        print(coverage_report(condition_stats), file=stdout)
+    return 2 if any_problems else 0
+
+
+def harvest(args: argparse.Namespace, options: AnalysisOptions, stdout: TextIO) -> int:
+    modules: List[types.ModuleType] = []
     for name in args.files:
-        entity: object
         try:
-            entity = load_file(name) if name.endswith('.py') else load_by_qualname(name)
+            module = load_file(name) if name.endswith('.py') else load_by_qualname(name)
         except ErrorDuringImport as e:
             stdout.write(str(short_describe_message(import_error_msg(e), options)) + '\n')
-            any_problems = True
-            continue
-        debug('Check ', getattr(entity, '__name__', str(entity)))
-        for message in analyze_any(entity, options):
-            line = short_describe_message(message, options)
-            if line is None:
-                continue
+            return 2
+        if not isinstance(module, types.ModuleType):
+            stdout.write(f'Not a module: "{name}"\n')
+            return 2
+        modules.append(module)
+    corpus = Corpus(args.seeds)
+    harvester = Harvester(corpus)
+    result = harvester.run_doctests(modules)
+    stdout.write(f'Ran {result.testsRun} doctests ({len(result.failures) + len(result.errors)} failed)\n')
+    exitcode = harvester.run_pytest(modules, args.pytest) if args.pytest else 0
+    corpus.save()
+    num_inputs = sum(map(len, corpus.entries.values()))
+    stdout.write(f'Observed {harvester.num_observed} calls; {args.seeds} has {num_inputs} '
+                 f'inputs for {len(corpus.entries)} functions\n')
+    return exitcode
+
+
+def replay_path(args: argparse.Namespace, options: AnalysisOptions, stdout: TextIO) -> int:
+    try:
+        entity = load_by_qualname(args.target)
+    except ErrorDuringImport as e:
+        stdout.write(str(short_describe_message(import_error_msg(e), options)) + '\n')
+        return 2
+    options = dataclasses.replace(options, replay_log=args.log, max_iterations=1)
+    searches = []
+    for checkable in checkables_for_any(entity, options):
+        for stats in checkable.get_stats().values():
+            if args.condition is None or stats.condition == args.condition:
+                searches.append(checkable)
+    if len(searches) != 1:
+        stdout.write(f'Found {len(searches)} matching conditions for "{args.target}"; '
+                     'choose one with --condition\n')
+        return 2
+    condition_stats: Dict[str, ConditionStats] = {}
+    any_problems = False
+    for message in collect_messages(searches, options, condition_stats):
+        line = short_describe_message(message, options)
+        if line is not None:
             stdout.write(line + '\n')
-            debug('Traceback for output message:\n', message.traceback)
-            if message.state > MessageType.PRE_UNSAT:
-                any_problems = True
+        if message.state > MessageType.PRE_UNSAT:
+            any_problems = True
+    (stats,) = condition_stats.values()
+    diverged = ' (and then diverged)' if stats.counters['replay_divergences'] else ''
+    stdout.write(f'Replayed {stats.counters["replayed_decisions"]} of {len(args.log)} decisions'
+                 f'{diverged} in {stats.timers["paths"]:.3f}s\n')
     return 2 if any_problems else 0
 
 
+def bench(args: argparse.Namespace, options: AnalysisOptions, stdout: TextIO) -> int:
+    if args.micro:
+        micro_results = run_microbenchmarks(args.modules, args.iterations)
+        describe_microbenchmarks(micro_results, stdout)
+        results = microbenchmarks_to_json(micro_results)
+    else:
+        results = run_benchmarks(args.modules or example_modules(), options)
+        describe_results(results, stdout)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+    if not args.baseline:
+        return 0
+    with open(args.baseline) as fh:
+        baseline = json.load(fh)
+    if args.micro:
+        problems = compare_microbenchmarks(results, baseline, max_slowdown=args.max_slowdown)
+    else:
+        problems = compare_to_baseline(results, baseline, max_slowdown=args.max_slowdown,
+                                       max_memory_growth=args.max_slowdown)
+    for problem in problems:
+        stdout.write(f'Regression: {problem}\n')
+    return 2 if problems else 0
+
+
 def main() -> None:
     args = command_line_parser().parse_args()
     set_debug(args.verbose)
@@ -482,6 +708,12 @@ def main() -> None:
         exitcode = showresults(args, options)
     elif args.action == 'watch':
         exitcode = watch(args, options)
+    elif args.action == 'bench':
+        exitcode = bench(args, options, sys.stdout)
+    elif args.action == 'harvest':
+        exitcode = harvest(args, options, sys.stdout)
+    elif args.action == 'replay':
+        exitcode = replay_path(args, options, sys.stdout)
     else:
         print(f'Unknown action: "{args.action}"', file=sys.stderr)
         exitcode = 1
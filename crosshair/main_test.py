@@ -1,3 +1,4 @@
+import glob
 import shutil
 import sys
 import tempfile
@@ -8,6 +9,7 @@ from os.path import join
 from typing import *
 
 from crosshair.core_and_libs import AnalysisOptions
+from crosshair.smtreplay import replay
 from crosshair.util import add_to_pypath, NotFound
 
 from crosshair.main import *
@@ -25,11 +27,12 @@ def simplefs(path: str, files:dict) -> None:
         else:
             raise Exception('bad input to simplefs')
 
-def call_check(files: List[str], options=None) -> Tuple[int, List[str]]:
+def call_check(files: List[str], options=None, flags: Sequence[str] = ()) -> Tuple[int, List[str]]:
     if options is None:
         options = AnalysisOptions()
     buf: io.StringIO = io.StringIO()
-    retcode = check(Namespace(files=files), options, buf)
+    args = command_line_parser().parse_args(['check', *flags, *files])
+    retcode = check(args, options, buf)
     lines = [l for l in buf.getvalue().split('\n') if l]
     return retcode, lines
 
@@ -102,6 +105,278 @@ class MainTest(unittest.TestCase):
         self.assertIn('foo.py:3:info:Confirmed over all paths.', output_text)
         self.assertIn('foo.py:7:info:Unable to meet precondition.', output_text)
         
+    def test_stats_json(self):
+        simplefs(self.root, SIMPLE_FOO)
+        stats_file = join(self.root, 'stats.json')
+        retcode, lines = call_check([join(self.root, 'foo.py')],
+                                    flags=['--stats_json', stats_file])
+        self.assertEqual(retcode, 2)
+        with open(stats_file) as fh:
+            stats = json.load(fh)['conditions']
+        self.assertEqual(len(stats), 1)
+        (condition_stats,) = stats.values()
+        self.assertEqual(condition_stats['function'], 'foofn')
+        self.assertEqual(condition_stats['condition'], '_ == x')
+        self.assertGreater(condition_stats['counters']['paths'], 0)
+        self.assertGreater(condition_stats['counters']['solver_calls'], 0)
+        self.assertIn('solver', condition_stats['timers'])
+
+    def test_slice_constraints(self):
+        showcase = os.path.join(os.path.dirname(__file__), 'examples', 'showcase.py')
+        args = command_line_parser().parse_args(['check', '--slice_constraints', showcase])
+        buf = io.StringIO()
+        self.assertEqual(check(args, process_level_options(args), buf), 2)
+        for line in buf.getvalue().splitlines():
+            self.assertIn('showcase.py:', line)
+            self.assertIn(':error:false when calling ', line)
+
+    def test_report_realizations(self):
+        simplefs(self.root, {'foo.py': """
+def foofn(x: int) -> str:
+  ''' post: len(_) > 0 '''
+  return str(x)
+"""})
+        retcode, lines = call_check([join(self.root, 'foo.py')],
+                                    flags=['--report_realizations'])
+        self.assertEqual(retcode, 0)
+        self.assertEqual(lines[0], 'Realization hot spots:')
+        self.assertTrue(lines[2].endswith('foo.py:4'), lines[2])
+
+    def test_report_coverage(self):
+        simplefs(self.root, {'foo.py': """
+def foofn(x: int) -> int:
+  ''' post: _ > 0 '''
+  if x > 100:
+    return 2
+  return 1
+"""})
+        retcode, lines = call_check([join(self.root, 'foo.py')], flags=['--report_coverage'])
+        self.assertEqual(retcode, 0)
+        self.assertEqual(lines[0], 'Coverage:')
+        self.assertEqual(lines[2].split(), ['3/3', '100%', '2/2', '100%', '0', 'foofn', '(foo.py:3)'])
+
+    def test_profile_speedscope(self):
+        simplefs(self.root, SIMPLE_FOO)
+        profile_file = join(self.root, 'profile.json')
+        retcode, lines = call_check([join(self.root, 'foo.py')],
+                                    flags=['--profile', profile_file])
+        self.assertEqual(retcode, 2)
+        with open(profile_file) as fh:
+            profile = json.load(fh)
+        frame_names = {f['name'] for f in profile['shared']['frames']}
+        self.assertTrue(frame_names & {'z3', 'framework', 'builtins', 'user'})
+        (sampled,) = profile['profiles']
+        self.assertEqual(len(sampled['samples']), len(sampled['weights']))
+
+    def test_search_tree_json(self):
+        simplefs(self.root, SIMPLE_FOO)
+        tree_file = join(self.root, 'tree.json')
+        retcode, lines = call_check([join(self.root, 'foo.py')],
+                                    flags=['--search_tree', tree_file])
+        self.assertEqual(retcode, 2)
+        with open(tree_file) as fh:
+            (nodes,) = json.load(fh)['trees'].values()
+        root = nodes[0]
+        self.assertEqual(root['type'], 'SinglePathNode')
+        self.assertGreater(root['visits'], 0)
+        self.assertEqual(root['result'], 'REFUTED')
+        node_types = {node['type'] for node in nodes}
+        self.assertTrue(node_types & {'WorstResultNode', 'ModelValueNode'}, node_types)
+        self.assertTrue(all(node['site'] for node in nodes
+                            if node['type'] in ('WorstResultNode', 'ModelValueNode')))
+
+    def test_dump_smt_and_replay(self):
+        simplefs(self.root, SIMPLE_FOO)
+        smt_dir = join(self.root, 'smt')
+        retcode, lines = call_check([join(self.root, 'foo.py')],
+                                    flags=['--dump_smt', smt_dir])
+        self.assertEqual(retcode, 2)
+        filenames = sorted(glob.glob(join(smt_dir, '*.smt2')))
+        self.assertGreater(len(filenames), 0)
+        report = replay(filenames, 'smt', 1.0)
+        self.assertEqual(len(report.latencies), len(filenames))
+        self.assertEqual(report.mismatches, 0)
+
+    def test_dump_smt_logs_every_check(self):
+        simplefs(self.root, {'foo.py': """
+def foofn(x: int, y: int) -> int:
+  ''' post: _ != 3 '''
+  if x > 10 and y < 0:
+    return 1
+  return 2
+"""})
+        smt_dir = join(self.root, 'smt')
+        options = AnalysisOptions(slice_constraints=True, concrete_samples=2, max_iterations=10)
+        call_check([join(self.root, 'foo.py')], options=options, flags=['--dump_smt', smt_dir])
+        queries = []
+        for filename in glob.glob(join(smt_dir, '*.smt2')):
+            with open(filename) as fh:
+                label = fh.readline()
+                queries.append((label[label.rindex('(') + 1:label.rindex(')')], fh.read()))
+        self.assertEqual({kind for (kind, _) in queries}, {'solver_is_sat', 'find_diverse_models'})
+        # With sliced constraints, the inputs are checked separately:
+        for kind, query in queries:
+            if kind == 'solver_is_sat':
+                self.assertFalse('declare-fun x' in query and 'declare-fun y' in query, query)
+
+    def test_corpus_replay_and_prune(self):
+        simplefs(self.root, SIMPLE_FOO)
+        corpus_file = join(self.root, 'corpus.json')
+        stats_file = join(self.root, 'stats.json')
+        flags = ['--corpus', corpus_file, '--stats_json', stats_file]
+        retcode, lines = call_check([join(self.root, 'foo.py')], flags=flags)
+        self.assertEqual(retcode, 2)
+        with open(corpus_file) as fh:
+            (entries,) = json.load(fh)['entries'].values()
+        self.assertEqual([list(entry.keys()) for entry in entries], [['x']])
+        # The known counterexample is found again, without a symbolic search:
+        retcode, lines = call_check([join(self.root, 'foo.py')], flags=flags)
+        self.assertEqual(retcode, 2)
+        self.assertIn('foo.py:3:error:false when calling foofn', lines[0])
+        with open(stats_file) as fh:
+            (condition_stats,) = json.load(fh)['conditions'].values()
+        self.assertEqual(condition_stats['counters']['corpus_refutations'], 1)
+        self.assertNotIn('paths', condition_stats['counters'])
+        # Once fixed, the entry is pruned:
+        simplefs(self.root, {'foo.py': SIMPLE_FOO['foo.py'].replace('x + 1', 'x')})
+        del sys.modules['foo']
+        retcode, lines = call_check([join(self.root, 'foo.py')], flags=flags)
+        self.assertEqual(retcode, 0)
+        with open(corpus_file) as fh:
+            self.assertEqual(json.load(fh)['entries'], {})
+
+    def test_corpus_replay_timeout(self):
+        simplefs(self.root, SIMPLE_FOO)
+        corpus_file = join(self.root, 'corpus.json')
+        stats_file = join(self.root, 'stats.json')
+        flags = ['--corpus', corpus_file, '--stats_json', stats_file]
+        retcode, lines = call_check([join(self.root, 'foo.py')], flags=flags)
+        self.assertEqual(retcode, 2)
+        # Now the recorded input makes the function loop without end:
+        simplefs(self.root, {'foo.py': SIMPLE_FOO['foo.py'].replace(
+            '  return x + 1', '  while x != x - 1:\n    x += 1\n  return x')})
+        del sys.modules['foo']
+        options = AnalysisOptions(per_path_timeout=0.2, max_iterations=1)
+        retcode, lines = call_check([join(self.root, 'foo.py')], options=options, flags=flags)
+        with open(stats_file) as fh:
+            (condition_stats,) = json.load(fh)['conditions'].values()
+        self.assertEqual(condition_stats['counters']['concrete_timeouts'], 1)
+        self.assertNotIn('corpus_refutations', condition_stats['counters'])
+        # A replay that runs out of time does not show that the bug is fixed:
+        with open(corpus_file) as fh:
+            (entries,) = json.load(fh)['entries'].values()
+        self.assertEqual(len(entries), 1)
+
+    def test_harvest_seeds(self):
+        simplefs(self.root, {'foo.py': """
+def foofn(x: int) -> int:
+  '''
+  post: _ > 0
+
+  >>> foofn(12345)
+  2
+  '''
+  return 2 if x == 12345 else 1
+"""})
+        seeds_file = join(self.root, 'seeds.json')
+        stats_file = join(self.root, 'stats.json')
+        args = command_line_parser().parse_args(
+            ['harvest', '--seeds', seeds_file, join(self.root, 'foo.py')])
+        buf = io.StringIO()
+        self.assertEqual(harvest(args, AnalysisOptions(), buf), 0)
+        self.assertIn('Ran 1 doctests (0 failed)', buf.getvalue())
+        with open(seeds_file) as fh:
+            self.assertEqual(json.load(fh)['entries'], {'foo.foofn': [{'x': '12345'}]})
+        # The first path follows the harvested input:
+        retcode, lines = call_check([join(self.root, 'foo.py')],
+                                    options=AnalysisOptions(max_iterations=1),
+                                    flags=['--seeds', seeds_file, '--stats_json', stats_file])
+        self.assertEqual(retcode, 0)
+        with open(stats_file) as fh:
+            (condition_stats,) = json.load(fh)['conditions'].values()
+        self.assertEqual(condition_stats['counters']['seeded_paths'], 1)
+        self.assertEqual(condition_stats['counters']['steered_branches'], 1)
+
+    def test_reproducers(self):
+        simplefs(self.root, SIMPLE_FOO)
+        repro_file = join(self.root, 'test_repro.py')
+        retcode, lines = call_check([join(self.root, 'foo.py')], flags=['--reproducers', repro_file])
+        self.assertEqual(retcode, 2)
+        with open(repro_file) as fh:
+            source = fh.read()
+        self.assertIn("check_call(foo, 'foofn', {'x': ", source)
+        # It runs without CrossHair (and z3):
+        imports = [line for line in source.splitlines() if line.startswith(('import ', 'from '))]
+        self.assertFalse([line for line in imports if 'crosshair' in line])
+        namespace: Dict[str, object] = {}
+        with add_to_pypath(self.root):
+            exec(source, namespace)
+            with self.assertRaises(AssertionError):
+                namespace['test_foofn']()  # type: ignore
+            # Once fixed, the reproducer passes:
+            simplefs(self.root, {'foo.py': SIMPLE_FOO['foo.py'].replace('x + 1', 'x')})
+            del sys.modules['foo']
+            exec(source, namespace)
+            namespace['test_foofn']()  # type: ignore
+
+    def test_replay_path(self):
+        simplefs(self.root, {'foo.py': """
+from typing import List
+def foofn(xs: List[int]) -> int:
+  ''' post: _ != 2 '''
+  return len([x for x in xs if x > 10])
+"""})
+        with add_to_pypath(self.root):
+            (message,) = analyze_any(load_by_qualname('foo.foofn'), AnalysisOptions())
+            log = message.execution_log
+            self.assertTrue(log)
+            args = command_line_parser().parse_args(['replay', 'foo.foofn', log])
+            buf = io.StringIO()
+            self.assertEqual(replay_path(args, AnalysisOptions(), buf), 2)
+        lines = buf.getvalue().splitlines()
+        self.assertIn('foo.py:4:error:false when calling foofn', lines[0])
+        self.assertTrue(lines[1].startswith(f'Replayed {len(log)} of {len(log)} decisions in'), lines[1])
+
+    def test_bench(self):
+        results_file = join(self.root, 'bench.json')
+        args = command_line_parser().parse_args(
+            ['bench', '--output', results_file, 'crosshair.examples.nesting_inference'])
+        buf = io.StringIO()
+        options = AnalysisOptions(per_condition_timeout=0.5)
+        self.assertEqual(bench(args, options, buf), 0)
+        self.assertIn('mydiv:7: CONFIRMED', buf.getvalue())
+        with open(results_file) as fh:
+            results = json.load(fh)
+        module = results['modules']['crosshair.examples.nesting_inference']
+        self.assertGreater(module['paths'], 0)
+        self.assertIsNotNone(module['conditions']['mydiv:7']['until_confirmed'])
+        self.assertEqual(compare_to_baseline(results, results), [])
+
+    def test_bench_worker_crash(self):
+        simplefs(self.root, {'crashes.py': 'import os\nos._exit(3)\n'})
+        results_file = join(self.root, 'bench.json')
+        args = command_line_parser().parse_args(['bench', '--output', results_file, 'crashes'])
+        with add_to_pypath(self.root):
+            self.assertEqual(bench(args, AnalysisOptions(), io.StringIO()), 0)
+        with open(results_file) as fh:
+            results = json.load(fh)
+        self.assertEqual(results['modules']['crashes'],
+                         {'error': 'The benchmark process exited with code 3'})
+
+    def test_bench_micro(self):
+        results_file = join(self.root, 'micro.json')
+        args = command_line_parser().parse_args(
+            ['bench', '--micro', '--iterations', '5', '--output', results_file,
+             'int_compare', 'str_concat'])
+        buf = io.StringIO()
+        self.assertEqual(bench(args, AnalysisOptions(), buf), 0)
+        with open(results_file) as fh:
+            results = json.load(fh)['micro']
+        self.assertEqual(set(results.keys()), {'int_compare', 'str_concat'})
+        self.assertEqual(results['int_compare']['ops'], 5)
+        self.assertGreater(results['int_compare']['solver_calls_per_op'], 0)
+        self.assertEqual(results['str_concat']['solver_calls_per_op'], 0)
+
     def test_check_nonexistent_filename(self):
         simplefs(self.root, SIMPLE_FOO)
         retcode, lines = call_check([join(self.root, 'notexisting.py')])
@@ -0,0 +1,298 @@
+'''
+Joining the outcomes of simple branches, instead of forking paths on them.
+
+Every symbolic branch normally splits the search, so a function with n
+independent `if` statements has 2^n paths. With `--merge_branches`, we
+recompile the function under analysis so that simple `if` statements can
+be joined instead: when the branch condition is symbolic, and both sides
+only assign integer (or boolean) arithmetic to local variables, we compute
+both sides and give each variable a `z3.If` value.
+
+A merged `if` keeps its original statement as a fallback, for when (at
+run time) the condition is concrete, the inputs are not all integers, or
+the two sides give a variable values of different types:
+
+    if x > n:
+        r += 1
+
+becomes, in effect:
+
+    _crosshair_branch0 = x > n
+    _crosshair_merged0 = _crosshair_can_merge(_crosshair_branch0, r) and \
+        _crosshair_merge(_crosshair_branch0, (r + 1,), (r,))
+    if _crosshair_merged0:
+        (r,) = _crosshair_merged0
+    elif _crosshair_branch0:
+        r += 1
+'''
+
+import ast
+import functools
+import inspect
+import textwrap
+from typing import *
+
+import z3  # type: ignore
+
+# Arithmetic that cannot raise, nor branch, when applied to integers:
+_PURE_BINARY_OPS = (ast.Add, ast.Sub, ast.Mult)
+_PURE_COMPARE_OPS = (ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+
+
+def _constant_value(node: ast.AST) -> object:
+    if isinstance(node, ast.Num):
+        return node.n
+    if isinstance(node, ast.NameConstant):
+        return node.value
+    return None
+
+
+def _pure_expression_inputs(node: ast.expr) -> Optional[Set[str]]:
+    '''
+    The names that `node` reads, if it only combines them with integer
+    arithmetic; None otherwise.
+    '''
+    if isinstance(node, ast.Name):
+        return {node.id}
+    if isinstance(node, (ast.Num, ast.NameConstant)):
+        return set() if type(_constant_value(node)) in (int, bool) else None
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        return _pure_expression_inputs(node.operand)
+    if isinstance(node, ast.BinOp) and isinstance(node.op, _PURE_BINARY_OPS):
+        left = _pure_expression_inputs(node.left)
+        right = _pure_expression_inputs(node.right)
+        return None if left is None or right is None else left | right
+    # (chained comparisons would branch, so only single ones are allowed)
+    if isinstance(node, ast.Compare) and len(node.ops) == 1 and \
+            isinstance(node.ops[0], _PURE_COMPARE_OPS):
+        left = _pure_expression_inputs(node.left)
+        right = _pure_expression_inputs(node.comparators[0])
+        return None if left is None or right is None else left | right
+    return None
+
+
+def _branch_assignments(stmts: List[ast.stmt]) -> Optional[Dict[str, ast.expr]]:
+    '''
+    The values that a branch assigns, by variable name, if it does nothing
+    but assign pure expressions to distinct local variables, without reading
+    the variables that it assigns earlier. None otherwise.
+    '''
+    assignments: Dict[str, ast.expr] = {}
+    for stmt in stmts:
+        if isinstance(stmt, ast.Assign) and len(stmt.targets) == 1 and \
+                isinstance(stmt.targets[0], ast.Name):
+            name, value = stmt.targets[0].id, stmt.value
+        elif isinstance(stmt, ast.AugAssign) and isinstance(stmt.target, ast.Name) and \
+                isinstance(stmt.op, _PURE_BINARY_OPS):
+            name = stmt.target.id
+            value = ast.BinOp(left=ast.Name(id=name, ctx=ast.Load()), op=stmt.op, right=stmt.value)
+        else:
+            return None
+        inputs = _pure_expression_inputs(value)
+        if inputs is None or name in assignments or inputs & assignments.keys():
+            return None
+        assignments[name] = value
+    return assignments
+
+
+def _assigned_names(node: ast.AST) -> Set[str]:
+    return {n.id for n in ast.walk(node) if isinstance(n, ast.Name) and isinstance(n.ctx, ast.Store)}
+
+
+class _BranchMergingRewriter:
+    '''
+    Rewrites the mergeable `if` statements in a function body. We only read
+    variables that are certainly bound at the `if`, which we conservatively
+    take to be the parameters and the variables assigned by earlier simple
+    statements (in the same block, or in the blocks that contain it).
+    '''
+    def __init__(self, fn_def: ast.FunctionDef):
+        self.fn_def = fn_def
+        self.num_merged = 0
+        args = fn_def.args
+        self.params = {a.arg for a in args.args + args.kwonlyargs + getattr(args, 'posonlyargs', [])}
+        self.params.update(a.arg for a in (args.vararg, args.kwarg) if a is not None)
+        # Variables that may become unbound again, or that are not local:
+        self.unsafe: Set[str] = set()
+        for node in ast.walk(fn_def):
+            if isinstance(node, ast.Delete):
+                self.unsafe.update(n.id for n in ast.walk(node) if isinstance(n, ast.Name))
+            elif isinstance(node, (ast.Global, ast.Nonlocal)):
+                self.unsafe.update(node.names)
+
+    def rewrite(self) -> int:
+        self.fn_def.body = self.rewrite_block(self.fn_def.body, self.params - self.unsafe)
+        return self.num_merged
+
+    def rewrite_block(self, stmts: List[ast.stmt], bound: Set[str]) -> List[ast.stmt]:
+        bound = set(bound)
+        ret: List[ast.stmt] = []
+        for stmt in stmts:
+            if isinstance(stmt, ast.If):
+                ret.extend(self.rewrite_if(stmt, bound))
+                continue
+            if isinstance(stmt, (ast.For, ast.AsyncFor)):
+                stmt.body = self.rewrite_block(stmt.body, bound | (_assigned_names(stmt.target) - self.unsafe))
+                stmt.orelse = self.rewrite_block(stmt.orelse, bound)
+            elif isinstance(stmt, ast.While):
+                stmt.body = self.rewrite_block(stmt.body, bound)
+                stmt.orelse = self.rewrite_block(stmt.orelse, bound)
+            elif isinstance(stmt, (ast.With, ast.AsyncWith)):
+                targets: Set[str] = set()
+                for item in stmt.items:
+                    if item.optional_vars is not None:
+                        targets |= _assigned_names(item.optional_vars)
+                stmt.body = self.rewrite_block(stmt.body, bound | (targets - self.unsafe))
+            elif isinstance(stmt, ast.Try):
+                stmt.body = self.rewrite_block(stmt.body, bound)
+                for handler in stmt.handlers:
+                    handler.body = self.rewrite_block(handler.body, bound)
+                stmt.orelse = self.rewrite_block(stmt.orelse, bound)
+                stmt.finalbody = self.rewrite_block(stmt.finalbody, bound)
+            elif isinstance(stmt, (ast.Assign, ast.AugAssign, ast.AnnAssign)) and \
+                    getattr(stmt, 'value', None) is not None:
+                bound |= _assigned_names(stmt) - self.unsafe
+            ret.append(stmt)
+        return ret
+
+    def rewrite_if(self, stmt: ast.If, bound: Set[str]) -> List[ast.stmt]:
+        then_assignments = _branch_assignments(stmt.body)
+        else_assignments = _branch_assignments(stmt.orelse)
+        if then_assignments is None or else_assignments is None:
+            stmt.body = self.rewrite_block(stmt.body, bound)
+            stmt.orelse = self.rewrite_block(stmt.orelse, bound)
+            return [stmt]
+        names = sorted(then_assignments.keys() | else_assignments.keys())
+        # (variables that both sides assign need not be bound beforehand)
+        inputs = then_assignments.keys() ^ else_assignments.keys()
+        for value in list(then_assignments.values()) + list(else_assignments.values()):
+            inputs |= cast(Set[str], _pure_expression_inputs(value))
+        if not inputs <= bound:
+            return [stmt]
+
+        def load(name: str) -> ast.Name:
+            return ast.Name(id=name, ctx=ast.Load())
+
+        def values(assignments: Dict[str, ast.expr]) -> ast.Tuple:
+            return ast.Tuple(elts=[assignments.get(name, load(name)) for name in names], ctx=ast.Load())
+        condition = f'_crosshair_branch{self.num_merged}'
+        merged_values = f'_crosshair_merged{self.num_merged}'
+        self.num_merged += 1
+        test = ast.Assign(targets=[ast.Name(id=condition, ctx=ast.Store())], value=stmt.test)
+        merge = ast.Assign(
+            targets=[ast.Name(id=merged_values, ctx=ast.Store())],
+            value=ast.BoolOp(op=ast.And(), values=[
+                ast.Call(func=load('_crosshair_can_merge'),
+                         args=[load(condition)] + [load(name) for name in sorted(inputs)],
+                         keywords=[]),
+                ast.Call(func=load('_crosshair_merge'),
+                         args=[load(condition), values(then_assignments), values(else_assignments)],
+                         keywords=[])]))
+        fallback = ast.If(test=load(condition), body=stmt.body, orelse=stmt.orelse)
+        merged = ast.If(
+            test=load(merged_values),
+            body=[ast.Assign(
+                targets=[ast.Tuple(elts=[ast.Name(id=name, ctx=ast.Store()) for name in names],
+                                   ctx=ast.Store())],
+                value=load(merged_values))],
+            orelse=[fallback])
+        ret: List[ast.stmt] = [test, merge, merged]
+        for node in ret:
+            for child in ast.walk(node):
+                ast.copy_location(child, stmt)
+        bound |= set(names) - self.unsafe
+        return ret
+
+
+def _mangles_names(fn_def: ast.FunctionDef) -> bool:
+    # (we compile outside of any class, so private names would not be mangled)
+    for node in ast.walk(fn_def):
+        name = node.id if isinstance(node, ast.Name) else node.attr if isinstance(node, ast.Attribute) else ''
+        if name.startswith('__') and not name.endswith('__'):
+            return True
+    return False
+
+
+def merged_function(fn: Callable) -> Callable:
+    '''
+    Returns a version of `fn` that merges its simple branches, or `fn`
+    itself, if it has none (or if we cannot recompile it faithfully).
+    '''
+    if not inspect.isfunction(fn) or fn.__code__.co_freevars:
+        return fn
+    try:
+        filename = inspect.getsourcefile(fn)
+        (lines, start_line) = inspect.getsourcelines(fn)
+        module = ast.parse(textwrap.dedent(''.join(lines)))
+    except (OSError, TypeError, SyntaxError):
+        return fn
+    if filename is None or len(module.body) != 1 or not isinstance(module.body[0], ast.FunctionDef):
+        return fn
+    fn_def = module.body[0]
+    if fn_def.name != fn.__name__ or _mangles_names(fn_def):
+        return fn
+    if _BranchMergingRewriter(fn_def).rewrite() == 0:
+        return fn
+    # Decorators, defaults, and annotations were evaluated already; we copy
+    # them over below, rather than re-evaluating them in a different scope:
+    fn_def.decorator_list = []
+    fn_def.returns = None
+    args = fn_def.args
+    for arg in args.args + args.kwonlyargs + getattr(args, 'posonlyargs', []) + [args.vararg, args.kwarg]:
+        if arg is not None:
+            arg.annotation = None
+    args.defaults = [ast.NameConstant(value=None) for _ in args.defaults]
+    args.kw_defaults = [None if d is None else ast.NameConstant(value=None) for d in args.kw_defaults]
+    ast.increment_lineno(module, start_line - 1)
+    factory = ast.parse(f'def _crosshair_factory(_crosshair_can_merge, _crosshair_merge):\n'
+                        f'    return {fn_def.name}\n')
+    factory_def = cast(ast.FunctionDef, factory.body[0])
+    factory_def.body.insert(0, fn_def)
+    namespace: Dict[str, object] = {}
+    exec(compile(ast.fix_missing_locations(factory), filename, 'exec'), fn.__globals__, namespace)
+    merged = cast(Callable, namespace['_crosshair_factory'])(can_merge, merge_values)
+    merged.__defaults__ = fn.__defaults__  # type: ignore
+    merged.__kwdefaults__ = fn.__kwdefaults__  # type: ignore
+    merged.__annotations__ = fn.__annotations__
+    return functools.update_wrapper(merged, fn)
+
+
+def can_merge(condition: object, *inputs: object) -> bool:
+    # (builtinslib imports crosshair.core, which imports us)
+    from crosshair.libimpl.builtinslib import SmtBool, SmtInt
+    # (note that isinstance() may be patched while we run)
+    return type(condition) is SmtBool and all(
+        type(value) in (int, bool, SmtInt, SmtBool) for value in inputs)
+
+
+def merge_values(condition: Any, then_values: Tuple, else_values: Tuple) -> Optional[Tuple]:
+    '''
+    The values of the variables after the branch, or None when some
+    variable would be an int on one side and a bool on the other (merging
+    those would change the type of the variable on one of the sides).
+    '''
+    from crosshair.libimpl.builtinslib import SmtBool, SmtInt, force_to_smt_sort
+    bools, ints = (bool, SmtBool), (int, SmtInt)
+    for then_value, else_value in zip(then_values, else_values):
+        if not ((type(then_value) in bools and type(else_value) in bools) or
+                (type(then_value) in ints and type(else_value) in ints)):
+            return None
+    space = condition.statespace
+    space.stats.incr('merged_branches')
+    merged = []
+    for then_value, else_value in zip(then_values, else_values):
+        if then_value is else_value or (
+                type(then_value) is type(else_value) and type(then_value) in (int, bool)
+                and then_value == else_value):
+            merged.append(then_value)
+        elif type(then_value) in bools:
+            merged.append(SmtBool(space, bool, z3.If(
+                condition.var,
+                force_to_smt_sort(space, then_value, z3.BoolSort()),
+                force_to_smt_sort(space, else_value, z3.BoolSort()))))
+        else:
+            merged.append(SmtInt(space, int, z3.If(
+                condition.var,
+                force_to_smt_sort(space, then_value, z3.IntSort()),
+                force_to_smt_sort(space, else_value, z3.IntSort()))))
+    return tuple(merged)
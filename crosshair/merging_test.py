@@ -0,0 +1,80 @@
+import unittest
+
+from crosshair.core_and_libs import *
+from crosshair.merging import *
+from crosshair.test_util import check_fail
+
+_LIMIT = 10
+
+
+def counts(x: int, y: int, flag: bool = False) -> tuple:
+    total = 0
+    if x > 0:
+        total += x
+    if y > x:
+        total -= 1
+        flag = True
+    else:
+        low = y * 2
+    if flag:
+        total = total + 100
+    return (total, flag)
+
+
+def reads_global(x: int) -> int:
+    if x > 0:
+        x = _LIMIT
+    return x
+
+
+def maybe_unbound(x: int) -> int:
+    if x > 0:
+        y = 1
+    if x > 1:
+        y += 1
+    return x
+
+
+def calls(x: int) -> int:
+    if x > 0:
+        x = abs(x)
+    return x
+
+
+def mixed_types(a: int) -> str:
+    ''' post: _ != 'True' '''
+    if a > 0:
+        x = a > 5
+    else:
+        x = 0
+    return str(x)
+
+
+class MergingTest(unittest.TestCase):
+    def test_merged_functions_behave_the_same(self) -> None:
+        merged = merged_function(counts)
+        self.assertIsNot(merged, counts)
+        self.assertEqual(merged.__name__, 'counts')
+        for x in (-2, 0, 3):
+            for y in (-3, 1, 5):
+                self.assertEqual(merged(x, y), counts(x, y))
+                self.assertEqual(merged(x, y, flag=True), counts(x, y, flag=True))
+        self.assertEqual(merged.__defaults__, (False,))
+
+    def test_unmergeable_functions_are_unchanged(self) -> None:
+        self.assertIs(merged_function(reads_global), reads_global)
+        self.assertIs(merged_function(maybe_unbound), maybe_unbound)
+        self.assertIs(merged_function(calls), calls)
+        self.assertIs(merged_function(len), len)
+
+    def test_mixed_types_are_not_merged(self) -> None:
+        merged = merged_function(mixed_types)
+        self.assertIsNot(merged, mixed_types)
+        for a in (-1, 3, 6):
+            self.assertEqual(merged(a), mixed_types(a))
+        # (a merged `x` would be an int on both sides, so `str(x)` could never be 'True')
+        self.assertEqual(*check_fail(mixed_types, AnalysisOptions(merge_branches=True)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+'''
+Line and branch coverage of the code under analysis, path by path.
+
+With `--coverage_guided`, each path runs under a trace function (see
+sys.settrace) that records the lines of user code that it executes, and
+the arcs between consecutive lines in each frame. When a path covers
+something new, the branch decisions along it are credited; later paths
+favor the branches with the most new coverage per visit (see
+TrackingStateSpace.coverage_direction).
+
+The coverage of each function under analysis is measured against the
+lines and branches in its bytecode. `check --report_coverage` reports it
+per condition.
+'''
+
+import contextlib
+import dis
+import os
+import sys
+import types
+from typing import *
+
+from crosshair.util import is_framework_file, is_stdlib_file
+
+# (filename, line of a branch, line that it went to):
+Arc = Tuple[str, int, int]
+
+_CONDITIONAL_JUMPS = frozenset([
+    'POP_JUMP_IF_FALSE', 'POP_JUMP_IF_TRUE', 'JUMP_IF_FALSE_OR_POP',
+    'JUMP_IF_TRUE_OR_POP', 'JUMP_IF_NOT_EXC_MATCH', 'FOR_ITER'])
+
+
+class PathCoverage:
+    def __init__(self) -> None:
+        self.lines: Set[Tuple[str, int]] = set()
+        self.arcs: Set[Arc] = set()
+
+    def update(self, other: 'PathCoverage') -> int:
+        ''' Adds the other coverage to this one. Returns how much of it was new. '''
+        new_lines = other.lines - self.lines
+        new_arcs = other.arcs - self.arcs
+        self.lines |= new_lines
+        self.arcs |= new_arcs
+        return len(new_lines) + len(new_arcs)
+
+
+class CoverageTracer:
+    '''
+    Records the coverage of user code (that is, neither CrossHair itself,
+    the standard library, nor compiled conditions) while tracing().
+    '''
+    def __init__(self) -> None:
+        self.coverage = PathCoverage()
+        self._traced_files: Dict[str, bool] = {}
+        # CrossHair's own dependencies, which symbolic values call into:
+        self._dependency_paths = tuple(
+            os.path.dirname(module.__file__) if module.__name__ == 'z3' else module.__file__
+            for module in map(sys.modules.get, ('z3', 'typing_extensions', 'typing_inspect'))
+            if module is not None and getattr(module, '__file__', None))
+
+    def _trace_call(self, frame, event, arg):
+        # NOTE: this runs in the midst of symbolic execution, so it sticks to
+        # operations on concrete values that the patched builtins leave alone.
+        filename = frame.f_code.co_filename
+        traced = self._traced_files.get(filename)
+        if traced is None:
+            traced = not (filename.startswith('<') or is_framework_file(filename) or
+                          is_stdlib_file(filename) or filename.startswith(self._dependency_paths))
+            self._traced_files[filename] = traced
+        if not traced:
+            return None
+        lines, arcs = self.coverage.lines, self.coverage.arcs
+        last_line = frame.f_lineno
+
+        def trace_line(frame, event, arg):
+            nonlocal last_line
+            if event == 'line':
+                line = frame.f_lineno
+                lines.add((filename, line))
+                arcs.add((filename, last_line, line))
+                last_line = line
+            return trace_line
+        return trace_line
+
+    @contextlib.contextmanager
+    def tracing(self) -> Iterator[PathCoverage]:
+        ''' Records a fresh coverage, which it yields. '''
+        self.coverage = PathCoverage()
+        previous = sys.gettrace()
+        sys.settrace(self._trace_call)
+        try:
+            yield self.coverage
+        finally:
+            sys.settrace(previous)
+
+
+def _code_objects(code: types.CodeType) -> Iterator[types.CodeType]:
+    yield code
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            yield from _code_objects(const)
+
+
+def coverable(code: types.CodeType) -> Tuple[FrozenSet[int], FrozenSet[Tuple[int, int]]]:
+    '''
+    The lines of some code (including the code nested in it), and its
+    branches, as pairs of the line that branches and a line it may go to.
+    (Only branches between distinct lines can be observed by tracing.)
+
+    >>> def f(x):
+    ...     if x:
+    ...         return 1
+    ...     return 2
+    >>> lines, branches = coverable(f.__code__)
+    >>> first = f.__code__.co_firstlineno
+    >>> sorted(line - first for line in lines)
+    [1, 2, 3]
+    >>> sorted((src - first, dst - first) for (src, dst) in branches)
+    [(1, 2), (1, 3)]
+    '''
+    lines: Set[int] = set()
+    branches: Set[Tuple[int, int]] = set()
+    for subcode in _code_objects(code):
+        line_starts = dict(dis.findlinestarts(subcode))
+        lines.update(line_starts.values())
+        instructions = list(dis.get_instructions(subcode))
+        line_at: Dict[int, int] = {}
+        cur_line = subcode.co_firstlineno
+        for instr in instructions:
+            cur_line = line_starts.get(instr.offset, cur_line)
+            line_at[instr.offset] = cur_line
+        for idx, instr in enumerate(instructions[:-1]):
+            if instr.opname not in _CONDITIONAL_JUMPS:
+                continue
+            for offset in (instructions[idx + 1].offset, instr.argval):
+                # A line event fires at the start of a line, or after a jump backward:
+                if offset in line_starts or offset < instr.offset:
+                    dest_line = line_at.get(offset)
+                    if dest_line is not None and dest_line != line_at[instr.offset]:
+                        branches.add((line_at[instr.offset], dest_line))
+    return frozenset(lines), frozenset(branches)
+
+
+def coverage_counts(fn: Callable, coverage: PathCoverage) -> Dict[str, int]:
+    '''
+    Summarizes the coverage of a function (and of the code that it calls),
+    as counters for its ConditionStats.
+    '''
+    code = getattr(fn, '__code__', None)
+    if code is None:
+        return {}
+    filename = code.co_filename
+    lines, branches = coverable(code)
+    covered_lines = {line for (f, line) in coverage.lines if f == filename and line in lines}
+    covered_branches = {(src, dst) for (f, src, dst) in coverage.arcs
+                        if f == filename and (src, dst) in branches}
+    return {
+        'coverable_lines': len(lines),
+        'covered_lines': len(covered_lines),
+        'coverable_branches': len(branches),
+        'covered_branches': len(covered_branches),
+        'callee_lines': len(coverage.lines) - len(covered_lines),
+    }
@@ -0,0 +1,124 @@
+'''
+Racing alternative solver configurations on hard queries.
+
+When a satisfiability check runs past a threshold, a SolverPortfolio
+re-runs it under several configurations at once (different tactics, string
+solvers, mbqi settings and random seeds), and takes the first definite
+answer. Each configuration gets its own z3 context, so that the races can
+run in threads. The portfolio counts which configurations win, and new
+paths start with the configuration that has won most often.
+
+>>> portfolio = SolverPortfolio([SolverConfig('gives_up', tactic='fail'), DEFAULT_SOLVER_CONFIG])
+>>> x = z3.Int('x')
+>>> config, result, model = portfolio.race([x > 2], [x < 4], timeout=5.0)
+>>> (config.name, result, model.evaluate(x), portfolio.best_config().name)
+('smt', sat, 3, 'smt')
+'''
+
+import collections
+import itertools
+import queue
+import threading
+from dataclasses import dataclass
+from typing import *
+
+import z3  # type: ignore
+
+
+@dataclass(frozen=True)
+class SolverConfig:
+    name: str
+    # A z3 tactic name, or None for z3's default (incremental) solver:
+    tactic: Optional[str] = 'smt'
+    params: Tuple[Tuple[str, object], ...] = ()
+
+    def make_solver(self, timeout: float, ctx: Optional[z3.Context] = None) -> z3.Solver:
+        timeout_ms = 1 + int(timeout * 1000)
+        if self.tactic is None:
+            solver = z3.Solver(ctx=ctx)
+            solver.set('timeout', timeout_ms)
+        else:
+            solver = z3.TryFor(z3.Tactic(self.tactic, ctx=ctx), timeout_ms, ctx=ctx).solver()
+        for key, value in self.params:
+            solver.set(key, value)
+        return solver
+
+
+_SEEDED = (('smt.random-seed', 42), ('random-seed', 42))
+
+DEFAULT_SOLVER_CONFIG = SolverConfig('smt', params=_SEEDED + (('mbqi', True),))
+
+PORTFOLIO_CONFIGS: Tuple[SolverConfig, ...] = (
+    DEFAULT_SOLVER_CONFIG,
+    SolverConfig('smt_no_mbqi', params=_SEEDED + (('mbqi', False),)),
+    SolverConfig('smt_z3str3', params=_SEEDED + (('mbqi', True), ('smt.string_solver', 'z3str3'))),
+    SolverConfig('smt_reseeded', params=(('smt.random-seed', 7), ('random-seed', 7), ('mbqi', True))),
+    SolverConfig('incremental', tactic=None, params=(('random-seed', 42),)),
+)
+
+
+def _run_entrant(config: SolverConfig, solver: z3.Solver, exprs: List[z3.ExprRef],
+                 results: queue.Queue) -> None:
+    model = None
+    try:
+        ret = solver.check(*exprs)
+        if ret == z3.sat:
+            model = solver.model()
+    except z3.Z3Exception:
+        ret = z3.unknown
+    results.put((config, ret, model))
+
+
+def _translate_model(model: z3.ModelRef, ctx: z3.Context) -> z3.ModelRef:
+    # (ModelRef.translate() is broken in some z3 versions)
+    return z3.ModelRef(z3.Z3_model_translate(model.ctx.ref(), model.model, ctx.ref()), ctx)
+
+
+class SolverPortfolio:
+    def __init__(self, configs: Sequence[SolverConfig] = PORTFOLIO_CONFIGS,
+                 threshold: float = 0.25):
+        self.configs = list(configs)
+        # Checks that take longer than this many seconds are raced:
+        self.threshold = threshold
+        self.wins: Counter[str] = collections.Counter()
+
+    def best_config(self) -> SolverConfig:
+        ''' The configuration that has won most often (ties go to the earliest). '''
+        return max(self.configs, key=lambda config: self.wins[config.name])
+
+    def race(self, assertions: Sequence[z3.ExprRef], exprs: Sequence[z3.ExprRef],
+             timeout: float) -> Optional[Tuple[SolverConfig, z3.CheckSatResult,
+                                               Optional[z3.ModelRef]]]:
+        '''
+        Checks `exprs` under `assertions` with every configuration at once.
+        Returns the first configuration to reach a definite answer, with that
+        answer (and its model, when sat), or None if none of them could
+        decide the query.
+        '''
+        main_ctx = next((e.ctx for e in itertools.chain(assertions, exprs)), None) or z3.main_ctx()
+        # z3 contexts are not thread-safe; translate everything before starting:
+        entrants = []
+        for config in self.configs:
+            ctx = z3.Context()
+            solver = config.make_solver(timeout, ctx)
+            solver.add([a.translate(ctx) for a in assertions])
+            entrants.append((config, ctx, solver, [e.translate(ctx) for e in exprs]))
+        results: queue.Queue = queue.Queue()
+        threads = [threading.Thread(target=_run_entrant, args=(config, solver, translated, results),
+                                    daemon=True)
+                   for (config, _, solver, translated) in entrants]
+        for thread in threads:
+            thread.start()
+        winner = None
+        for _ in threads:
+            config, ret, model = results.get()
+            if ret != z3.unknown:
+                winner = (config, ret, None if model is None else _translate_model(model, main_ctx))
+                break
+        for (_, ctx, _, _) in entrants:
+            ctx.interrupt()
+        for thread in threads:
+            thread.join()
+        if winner is not None:
+            self.wins[winner[0].name] += 1
+        return winner
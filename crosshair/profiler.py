@@ -0,0 +1,166 @@
+'''
+A sampling profiler for the analysis process.
+
+While active, a background thread periodically inspects the stack of the
+analyzing thread. Each sample is classified by what was running at the top
+of that stack:
+
+  z3         - inside the solver (or its Python bindings)
+  framework  - CrossHair bookkeeping (the statespace reports that it is
+               running framework code, or we're between paths)
+  builtins   - symbolic values and patched builtins from crosshair.libimpl
+  user       - the code under analysis (and anything it calls)
+
+Samples can be written as collapsed stacks (the input format for most
+flame graph tools), or as a speedscope (https://www.speedscope.app/) file.
+'''
+
+import collections
+import contextlib
+import json
+import os
+import sys
+import threading
+from typing import *
+from typing import TextIO
+
+import z3  # type: ignore
+
+from crosshair.statespace import StateSpace
+from crosshair.util import is_framework_file
+
+_Z3_DIR = os.path.dirname(os.path.abspath(z3.__file__))
+_LIBIMPL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'libimpl')
+
+CATEGORIES = ('z3', 'framework', 'builtins', 'user')
+
+
+def classify_frame(frame, space: Optional[StateSpace]) -> str:
+    filename = frame.f_code.co_filename
+    if filename.startswith(_Z3_DIR):
+        return 'z3'
+    if space is None or space.running_framework_code:
+        return 'framework'
+    if filename.startswith(_LIBIMPL_DIR):
+        return 'builtins'
+    if is_framework_file(filename):
+        return 'framework'
+    return 'user'
+
+
+def describe_frame(frame) -> str:
+    code = frame.f_code
+    return f'{code.co_name} ({code.co_filename}:{code.co_firstlineno})'
+
+
+class SamplingProfiler:
+    '''
+    Samples the stack of the thread that created it; only samples taken
+    while inside analyzing() are recorded.
+    '''
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples: Counter[Tuple[str, ...]] = collections.Counter()
+        self._thread_id = threading.get_ident()
+        self._space_getter: Optional[Callable[[], Optional[StateSpace]]] = None
+        self._stopping = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+
+    def __enter__(self) -> 'SamplingProfiler':
+        self._stopping.clear()
+        self._sampler = threading.Thread(target=self._run, name='crosshair-profiler', daemon=True)
+        self._sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stopping.set()
+        assert self._sampler is not None
+        self._sampler.join()
+        self._sampler = None
+        return False
+
+    @contextlib.contextmanager
+    def analyzing(self, space_getter: Callable[[], Optional[StateSpace]]) -> Iterator[None]:
+        prev = self._space_getter
+        self._space_getter = space_getter
+        try:
+            yield
+        finally:
+            self._space_getter = prev
+
+    def _run(self) -> None:
+        while not self._stopping.wait(self.interval):
+            self.take_sample()
+
+    def take_sample(self) -> None:
+        space_getter = self._space_getter
+        if space_getter is None:
+            return
+        frame = sys._current_frames().get(self._thread_id)
+        if frame is None:
+            return
+        category = classify_frame(frame, space_getter())
+        stack = []
+        while frame is not None:
+            stack.append(describe_frame(frame))
+            frame = frame.f_back
+        stack.append(category)
+        stack.reverse()
+        self.samples[tuple(stack)] += 1
+
+    def category_totals(self) -> Counter[str]:
+        totals: Counter[str] = collections.Counter()
+        for stack, count in self.samples.items():
+            totals[stack[0]] += count
+        return totals
+
+    def summary(self) -> str:
+        totals = self.category_totals()
+        total = sum(totals.values()) or 1
+        return 'Profile: ' + ', '.join(
+            f'{category} {100 * totals[category] / total:.1f}%' for category in CATEGORIES)
+
+    def write_collapsed(self, fh: TextIO) -> None:
+        for stack, count in sorted(self.samples.items()):
+            fh.write(';'.join(stack) + f' {count}\n')
+
+    def write_speedscope(self, fh: TextIO, name: str = 'crosshair') -> None:
+        frame_indices: Dict[str, int] = {}
+        sampled_stacks = []
+        weights = []
+        for stack, count in sorted(self.samples.items()):
+            sampled_stacks.append([frame_indices.setdefault(f, len(frame_indices)) for f in stack])
+            weights.append(count * self.interval)
+        json.dump({
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'exporter': 'crosshair',
+            'name': name,
+            'shared': {'frames': [{'name': f} for f in frame_indices]},
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': sum(weights),
+                'samples': sampled_stacks,
+                'weights': weights,
+            }],
+        }, fh)
+
+    def write(self, filename: str) -> None:
+        ''' Writes speedscope JSON for ".json" filenames, and collapsed stacks otherwise. '''
+        with open(filename, 'w') as fh:
+            if filename.endswith('.json'):
+                self.write_speedscope(fh, name=os.path.basename(filename))
+            else:
+                self.write_collapsed(fh)
+
+
+@contextlib.contextmanager
+def profiling(profiler: Optional[SamplingProfiler],
+              space_getter: Callable[[], Optional[StateSpace]]) -> Iterator[None]:
+    if profiler is None:
+        yield
+    else:
+        with profiler.analyzing(space_getter):
+            yield
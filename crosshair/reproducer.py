@@ -0,0 +1,142 @@
+'''
+Standalone pytest reproducers for counterexamples.
+
+`crosshair check --reproducers FILE` writes a pytest file with one test per
+counterexample. Each test calls the function on concrete copies of the
+refuting arguments (realized from the solver's model on the refuting path,
+rather than parsed from their reprs), and then checks the postcondition
+that failed. A test fails for as long as its bug remains; since it only
+makes a concrete call, it runs quickly in an ordinary test job. The file
+includes its own copy of check_call(), so it needs nothing beyond the
+standard library and the code under test. (CrossHair itself needs z3.)
+'''
+
+import copy
+import functools
+import inspect
+import math
+import os
+import pickle
+import types
+from typing import *
+
+from crosshair.statespace import AnalysisMessage, MessageType
+from crosshair.util import extract_module_from_file
+
+
+def value_source(value: object) -> str:
+    '''
+    Python source that evaluates to a copy of the given (concrete) value.
+    Plain data is written as literals; anything else is pickled. Raises
+    ValueError when the value can be written neither way.
+
+    >>> value_source([1, 'a', (None,), {2.5: b'x'}])
+    "[1, 'a', (None,), {2.5: b'x'}]"
+    >>> value_source({float('nan'), frozenset()})
+    "{float('nan'), frozenset()}"
+    >>> value_source(lambda: 0)
+    Traceback (most recent call last):
+        ...
+    ValueError: Unable to write a <class 'function'> as source
+    '''
+    typ = type(value)
+    if value is None or typ in (bool, int, str, bytes):
+        return repr(value)
+    if typ is float:
+        return repr(value) if math.isfinite(value) else f"float('{value}')"  # type: ignore
+    if typ is complex:
+        return f'complex({value_source(value.real)}, {value_source(value.imag)})'  # type: ignore
+    if typ is list:
+        return '[' + ', '.join(map(value_source, value)) + ']'  # type: ignore
+    if typ is tuple:
+        items = list(map(value_source, value))  # type: ignore
+        return '(' + items[0] + ',)' if len(items) == 1 else '(' + ', '.join(items) + ')'
+    if typ is set:
+        return '{' + ', '.join(map(value_source, value)) + '}' if value else 'set()'  # type: ignore
+    if typ is frozenset:
+        return 'frozenset({' + ', '.join(map(value_source, value)) + '})' if value else 'frozenset()'  # type: ignore
+    if typ is dict:
+        return '{' + ', '.join(f'{value_source(k)}: {value_source(v)}'
+                               for k, v in value.items()) + '}'  # type: ignore
+    try:
+        return f'pickle.loads({pickle.dumps(value)!r})'
+    except Exception:
+        raise ValueError(f'Unable to write a {typ} as source')
+
+
+def check_call(module: types.ModuleType, qualname: str, arguments: Mapping[str, object],
+               postcondition: Optional[str] = None) -> object:
+    '''
+    Calls the named function of the module on the given arguments, and then
+    checks the postcondition (if any). The generated tests include a copy of
+    this function, so it may use only the standard library.
+    '''
+    fn = functools.reduce(getattr, qualname.split('.'), module)
+    args = inspect.signature(fn).bind_partial()  # type: ignore
+    args.arguments.update(arguments)
+    old = copy.deepcopy(dict(args.arguments))
+    ret = fn(*args.args, **args.kwargs)  # type: ignore
+    if postcondition is not None:
+        namespace = {**module.__dict__, **args.arguments, fn.__name__: fn,  # type: ignore
+                     '__return__': ret, '_': ret, '__old__': types.SimpleNamespace(**old)}
+        assert eval(postcondition, namespace), postcondition
+    return ret
+
+
+def reproducer_source(messages: Iterable[AnalysisMessage]) -> Tuple[str, int]:
+    '''
+    The source of a pytest file that reproduces the given messages (those
+    that have input_sources), and how many tests it has.
+    '''
+    imports: Set[str] = set()
+    tests: List[str] = []
+    seen: Set[Tuple[str, str, Tuple[Tuple[str, str], ...]]] = set()
+    name_counts: Dict[str, int] = {}
+    for message in messages:
+        if not message.input_sources or not message.test_fn or '<locals>' in message.test_fn:
+            continue
+        _, module = extract_module_from_file(message.filename)
+        key = (module, message.test_fn, message.input_sources)
+        if key in seen:
+            continue
+        seen.add(key)
+        imports.add(module)
+        test_name = 'test_' + message.test_fn.replace('.', '_')
+        name_counts[test_name] = name_counts.get(test_name, 0) + 1
+        if name_counts[test_name] > 1:
+            test_name += f'_{name_counts[test_name]}'
+        summary = message.message.splitlines()[0] if message.message else message.state.name
+        arguments = ', '.join(f'{name!r}: {source}' for name, source in message.input_sources)
+        # (an exception reproduces itself; a failed postcondition must be checked)
+        postcondition = f', {message.condition_src!r}' \
+            if message.state == MessageType.POST_FAIL and message.condition_src else ''
+        tests.append(
+            f'def {test_name}():\n'
+            f'    # {os.path.basename(message.filename)}:{message.line}: {summary}\n'
+            f'    check_call({module}, {message.test_fn!r}, {{{arguments}}}{postcondition})\n')
+    header = [
+        "'''",
+        'Reproducers for counterexamples found by CrossHair.',
+        '',
+        'Each test repeats a call that broke a contract; it passes once the bug',
+        'is fixed. Generated by `crosshair check --reproducers`.',
+        "'''",
+        'import copy',
+        'import functools',
+        'import inspect',
+    ]
+    if any('pickle.loads(' in test for test in tests):
+        header.append('import pickle')
+    header.append('import types')
+    header.extend(f'import {module}' for module in sorted(imports))
+    header.extend(['from typing import Mapping, Optional', '', '', ''])
+    tests.insert(0, inspect.getsource(check_call))
+    return '\n'.join(header) + '\n\n'.join(tests), len(tests) - 1
+
+
+def write_reproducers(filename: str, messages: Iterable[AnalysisMessage]) -> int:
+    ''' Writes a pytest file that reproduces the messages. Returns the number of tests. '''
+    source, num_tests = reproducer_source(messages)
+    with open(filename, 'w') as fh:
+        fh.write(source)
+    return num_tests
@@ -0,0 +1,224 @@
+'''
+Independence slicing of path constraints.
+
+A SlicedSolver partitions its assertions into groups that share no
+uninterpreted symbols, and keeps a separate incremental solver for each
+group. A query only goes to the group whose symbols it mentions (groups
+that a query spans are merged first), so constraints on unrelated inputs
+never reach z3. Each group also caches its latest model; queries that the
+cached model already satisfies are answered without calling the solver.
+
+>>> x, y = z3.Ints('x y')
+>>> solver = SlicedSolver(z3.Solver)
+>>> solver.add(x > 2, y > 2)
+>>> len(solver.groups)
+2
+>>> solver.check(x < 5)
+sat
+>>> solver.check(x < 5)  # (answered by the cached model)
+sat
+>>> solver.cache_hits
+1
+>>> solver.check(x < y, x < 2)
+unsat
+>>> len(solver.groups)
+1
+'''
+
+from typing import *
+
+import z3  # type: ignore
+
+from crosshair.stats import ConditionStats
+from crosshair.util import UnknownSatisfiability
+
+
+# Assertions without any uninterpreted symbols form a group of their own:
+_GROUND = -1
+
+
+def _flatten(exprs: Iterable) -> Iterator[z3.ExprRef]:
+    for expr in exprs:
+        if isinstance(expr, (list, tuple, z3.AstVector)):
+            yield from _flatten(expr)
+        else:
+            yield expr
+
+
+class _Group:
+    def __init__(self, solver: z3.Solver):
+        self.solver = solver
+        self.symbols: Set[int] = set()
+        self.assertions: List[z3.ExprRef] = []
+        # A model of the assertions (when known):
+        self.model: Optional[z3.ModelRef] = None
+
+    def satisfied_by_model(self, exprs: Sequence[z3.ExprRef]) -> bool:
+        model = self.model
+        return model is not None and all(
+            z3.is_true(model.evaluate(expr, model_completion=True)) for expr in exprs)
+
+
+class SlicedSolver:
+    '''
+    Offers the subset of the z3.Solver interface that StateSpace uses:
+    add(), check(), model(), and assertions().
+    '''
+    def __init__(self, make_solver: Callable[[], z3.Solver],
+                 stats: Optional[ConditionStats] = None):
+        self.make_solver = make_solver
+        self.stats = stats
+        self.groups: List[_Group] = []
+        self.group_of: Dict[int, _Group] = {}
+        self.cache_hits = 0
+        # The group that answered the latest check, and the assertions that
+        # it sent to z3 (None when cached models answered it):
+        self.last_checked: Optional[_Group] = None
+        self.checked_assertions: Optional[List[z3.ExprRef]] = None
+        # Symbols of each subexpression that we have seen, by z3 ast id.
+        # (we hold the expressions, so that their ids are not reused)
+        self._symbols: Dict[int, Tuple[z3.ExprRef, FrozenSet[int]]] = {}
+
+    def symbols(self, expr: z3.ExprRef) -> FrozenSet[int]:
+        ''' The ids of the uninterpreted constants and functions in `expr`. '''
+        memo = self._symbols
+        todo = [expr]
+        while todo:
+            cur = todo[-1]
+            cur_id = cur.get_id()
+            if cur_id in memo:
+                todo.pop()
+                continue
+            children = cur.children()
+            missing = [c for c in children if c.get_id() not in memo]
+            if missing:
+                # (expressions can be deeper than Python's recursion limit)
+                todo.extend(missing)
+                continue
+            todo.pop()
+            symbols: Set[int] = set()
+            for child in children:
+                symbols.update(memo[child.get_id()][1])
+            if z3.is_app(cur) and cur.decl().kind() == z3.Z3_OP_UNINTERPRETED:
+                symbols.add(cur.decl().get_id())
+            memo[cur_id] = (cur, frozenset(symbols))
+        return memo[expr.get_id()][1]
+
+    def _group_for(self, symbols: AbstractSet[int]) -> _Group:
+        symbols = symbols or {_GROUND}
+        groups = list({id(g): g for g in (self.group_of.get(s) for s in symbols) if g}.values())
+        if not groups:
+            group = _Group(self.make_solver())
+            self.groups.append(group)
+        else:
+            # Merge into the largest group, which keeps the most incremental state:
+            groups.sort(key=lambda g: len(g.assertions), reverse=True)
+            group = groups[0]
+            for other in groups[1:]:
+                group.solver.add(other.assertions)
+                group.assertions.extend(other.assertions)
+                for symbol in other.symbols:
+                    self.group_of[symbol] = group
+                group.symbols |= other.symbols
+                group.model = None
+                self.groups.remove(other)
+            if len(groups) > 1 and self.stats is not None:
+                self.stats.incr('slice_merges')
+        for symbol in symbols:
+            self.group_of[symbol] = group
+        group.symbols.update(symbols)
+        return group
+
+    def add(self, *exprs: z3.ExprRef) -> None:
+        for expr in _flatten(exprs):
+            group = self._group_for(self.symbols(expr))
+            group.solver.add(expr)
+            group.assertions.append(expr)
+            # Branch decisions usually agree with the model that found them feasible:
+            if not group.satisfied_by_model([expr]):
+                group.model = None
+
+    def _check_group(self, group: _Group, exprs: Sequence[z3.ExprRef]) -> z3.CheckSatResult:
+        self.last_checked = group
+        if group.satisfied_by_model(exprs):
+            self.cache_hits += 1
+            if self.stats is not None:
+                self.stats.incr('model_cache_hits')
+            return z3.sat
+        if self.checked_assertions is None:
+            self.checked_assertions = []
+        self.checked_assertions.extend(group.assertions)
+        ret = group.solver.check(*exprs)
+        if ret == z3.sat:
+            group.model = group.solver.model()
+        return ret
+
+    def check(self, *exprs: z3.ExprRef) -> z3.CheckSatResult:
+        self.checked_assertions = None
+        exprs = tuple(_flatten(exprs))
+        if exprs:
+            symbols: Set[int] = set()
+            for expr in exprs:
+                symbols.update(self.symbols(expr))
+            return self._check_group(self._group_for(symbols), exprs)
+        for group in list(self.groups):
+            ret = self._check_group(group, ())
+            if ret != z3.sat:
+                return ret
+        return z3.sat
+
+    def replace_solver(self, group: _Group, solver: z3.Solver,
+                       model: Optional[z3.ModelRef] = None) -> None:
+        '''
+        Moves a group to another solver (say, one that decided a query that
+        the group's own solver could not). `model`, when given, is a model of
+        the group's assertions.
+        '''
+        solver.add(group.assertions)
+        group.solver = solver
+        if model is not None:
+            group.model = model
+
+    def model(self) -> '_SlicedModel':
+        return _SlicedModel(self)
+
+    def assertions(self) -> List[z3.ExprRef]:
+        return [expr for group in self.groups for expr in group.assertions]
+
+    def sexpr(self) -> str:
+        return '\n'.join(group.solver.sexpr() for group in self.groups)
+
+    def __str__(self) -> str:
+        return '\n'.join(str(group.solver) for group in self.groups)
+
+
+class _SlicedModel:
+    '''
+    Evaluates expressions in the models of the groups that they belong to.
+    Models are only current for groups that have been checked (and not
+    changed) since; the others are checked on demand.
+    '''
+    def __init__(self, solver: SlicedSolver):
+        self.solver = solver
+
+    def _model_for(self, symbols: AbstractSet[int]) -> z3.ModelRef:
+        solver = self.solver
+        group = solver._group_for(symbols)
+        if group.model is None:
+            if solver.stats is not None:
+                solver.stats.incr('solver_calls')
+            ret = solver._check_group(group, ())
+            if ret == z3.unknown:
+                raise UnknownSatisfiability
+            if ret != z3.sat:
+                raise z3.Z3Exception('model is not available')
+        return group.model
+
+    def evaluate(self, expr: z3.ExprRef, model_completion: bool = False) -> z3.ExprRef:
+        return self._model_for(self.solver.symbols(expr)).evaluate(expr, model_completion)
+
+    def __getitem__(self, item: Union[z3.ExprRef, z3.FuncDeclRef]) -> object:
+        decl = item if isinstance(item, z3.FuncDeclRef) else item.decl()
+        if decl.get_id() not in self.solver.group_of:
+            return None
+        return self._model_for({decl.get_id()})[item]
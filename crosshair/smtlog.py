@@ -0,0 +1,44 @@
+'''
+Logging of solver queries as SMT-LIB2 files.
+
+`crosshair check --dump_smt DIR` writes one file per satisfiability check
+that a StateSpace makes. Each file holds the assertions in effect (with
+sliced constraints, just those of the group that was checked), the checked
+expressions, and (in comments) the original result and timing.
+See crosshair.smtreplay to replay them.
+'''
+
+import os
+from typing import *
+
+import z3  # type: ignore
+
+
+class QueryLogger:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.count = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def log(self, assertions: Sequence[z3.ExprRef], exprs: Sequence[z3.ExprRef],
+            result: z3.CheckSatResult, seconds: float, label: str = '') -> None:
+        query = z3.Solver()
+        query.add(*assertions)
+        query.add(*exprs)
+        self.count += 1
+        filename = os.path.join(self.directory, f'{os.getpid()}_{self.count:06d}.smt2')
+        with open(filename, 'w') as fh:
+            fh.write(f'; crosshair: {label}\n')
+            fh.write(f'; result: {result}\n')
+            fh.write(f'; seconds: {seconds:.6f}\n')
+            fh.write(query.to_smt2())
+
+
+def read_logged_result(filename: str) -> Optional[str]:
+    with open(filename) as fh:
+        for line in fh:
+            if not line.startswith(';'):
+                break
+            if line.startswith('; result: '):
+                return line[len('; result: '):].strip()
+    return None
@@ -0,0 +1,101 @@
+'''
+Replays a directory of SMT queries (as logged by `crosshair check --dump_smt`)
+under one or more solver configurations:
+
+    python -m crosshair.smtreplay DIR --tactic smt --timeout 0.5 --timeout 5
+
+Every combination of tactic and timeout is reported with its latency
+distribution, result counts, and the number of results that differ from
+the ones that were logged.
+'''
+
+import argparse
+import collections
+import glob
+import os
+import sys
+import time
+from dataclasses import dataclass
+from typing import *
+
+import z3  # type: ignore
+
+from crosshair.smtlog import read_logged_result
+
+
+@dataclass
+class ReplayReport:
+    tactic: str
+    timeout: float
+    latencies: List[float]
+    results: Counter[str]
+    mismatches: int
+
+    def percentile(self, fraction: float) -> float:
+        '''
+        >>> ReplayReport('smt', 1.0, [3.0, 1.0, 2.0, 4.0], collections.Counter(), 0).percentile(0.5)
+        2.0
+        '''
+        ordered = sorted(self.latencies)
+        if not ordered:
+            return 0.0
+        return ordered[max(0, int(round(fraction * len(ordered))) - 1)]
+
+    def describe(self) -> str:
+        results = ' '.join(f'{k}={v}' for k, v in sorted(self.results.items()))
+        return (f'{self.tactic} timeout={self.timeout}s: {len(self.latencies)} queries, '
+                f'total={sum(self.latencies):.3f}s '
+                f'p50={self.percentile(0.5):.4f}s p90={self.percentile(0.9):.4f}s '
+                f'p99={self.percentile(0.99):.4f}s max={max(self.latencies, default=0.0):.4f}s '
+                f'[{results}] mismatches={self.mismatches}')
+
+
+def replay(filenames: Sequence[str], tactic: str, timeout: float) -> ReplayReport:
+    latencies: List[float] = []
+    results: Counter[str] = collections.Counter()
+    mismatches = 0
+    for filename in filenames:
+        solver = z3.TryFor(z3.Tactic(tactic), 1 + int(timeout * 1000)).solver()
+        if tactic == 'smt':
+            # The same settings that StateSpace uses. (other tactics may reject
+            # these, and z3 only reports that when checking)
+            solver.set(mbqi=True)
+            solver.set('random-seed', 42)
+            solver.set('smt.random-seed', 42)
+        start = time.time()
+        try:
+            solver.add(z3.parse_smt2_file(filename))
+            result = str(solver.check())
+        except z3.Z3Exception:
+            result = 'error'
+        latencies.append(time.time() - start)
+        results[result] += 1
+        logged = read_logged_result(filename)
+        if logged is not None and logged != result:
+            mismatches += 1
+    return ReplayReport(tactic, timeout, latencies, results, mismatches)
+
+
+def command_line_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Replay SMT queries logged by `crosshair check --dump_smt`')
+    parser.add_argument('directory', type=str)
+    parser.add_argument('--tactic', action='append', type=str,
+                        help='z3 tactic to solve with (may be repeated; default: smt)')
+    parser.add_argument('--timeout', action='append', type=float,
+                        help='per-query timeout in seconds (may be repeated; default: 1.0)')
+    return parser
+
+
+def main() -> None:
+    args = command_line_parser().parse_args()
+    filenames = sorted(glob.glob(os.path.join(args.directory, '*.smt2')))
+    if not filenames:
+        print(f'No .smt2 files found in "{args.directory}"', file=sys.stderr)
+        sys.exit(1)
+    for tactic in args.tactic or ['smt']:
+        for timeout in args.timeout or [1.0]:
+            print(replay(filenames, tactic, timeout).describe())
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,28 @@
 import ast
+import collections
 import copy
 import enum
 import itertools
 import functools
+import pickle
 import random
+import sys
 import time
 import traceback
+import types
 from dataclasses import dataclass
 from typing import *
 
 import z3  # type: ignore
 
 from crosshair import dynamic_typing
-from crosshair.util import debug, PathTimeout, UnknownSatisfiability, CrosshairInternal, IgnoreAttempt, IdentityWrapper
+from crosshair.util import debug, PathTimeout, UnknownSatisfiability, CrosshairInternal, IgnoreAttempt, IdentityWrapper, user_code_site
 from crosshair.condition_parser import ConditionExpr
+from crosshair.forking import ForkChannel
+from crosshair.portfolio import DEFAULT_SOLVER_CONFIG, SolverPortfolio
+from crosshair.slicing import SlicedSolver
+from crosshair.smtlog import QueryLogger
+from crosshair.stats import ConditionStats
 from crosshair.type_repo import SmtTypeRepository
 
 
@@ -54,6 +63,11 @@ class AnalysisMessage:
     execution_log: Optional[str] = None
     test_fn: Optional[str] = None
     condition_src: Optional[str] = None
+    # The (name, repr) of each argument, for messages about a particular call:
+    input_reprs: Optional[Tuple[Tuple[str, str], ...]] = None
+    # The (name, Python source) of a concrete copy of each argument, when the
+    # analysis realizes inputs (see crosshair.reproducer):
+    input_sources: Optional[Tuple[Tuple[str, str], ...]] = None
 
     def toJSON(self):
         d = self.__dict__.copy()
@@ -63,6 +77,9 @@ class AnalysisMessage:
     @classmethod
     def fromJSON(cls, d):
         d['state'] = MessageType[d['state']]
+        for field in ('input_reprs', 'input_sources'):
+            if d.get(field) is not None:
+                d[field] = tuple(map(tuple, d[field]))
         return AnalysisMessage(**d)
 
 @functools.total_ordering
@@ -84,6 +101,13 @@ class CallAnalysis:
     failing_precondition: Optional[ConditionExpr] = None
     failing_precondition_reason: str = ''
 
+    def portable(self) -> 'CallAnalysis':
+        ''' A copy that can be sent between processes (conditions cannot be; their reasons can). '''
+        if self.failing_precondition is None and isinstance(self.messages, list):
+            return self
+        return CallAnalysis(self.verification_status, list(self.messages),
+                            None, self.failing_precondition_reason)
+
 HeapRef = z3.DeclareSort('HeapRef')
 SnapshotRef = NewType('SnapshotRef', int)
 
@@ -101,6 +125,14 @@ def model_value_to_python(value: z3.ExprRef) -> object:
         return ast.literal_eval(repr(value))
 
 
+def _model_satisfies(model: z3.ModelRef, expr: z3.ExprRef) -> bool:
+    try:
+        return z3.is_true(model.evaluate(expr, model_completion=True))
+    except z3.Z3Exception:
+        # (the model may no longer be available; then it is of no further use)
+        return False
+
+
 class NotDeterministic(Exception):
     pass
 
@@ -120,21 +152,109 @@ class WithFrameworkCode:
         self.space.running_framework_code = self.previous
 
 
+class LearnedLemmas:
+    '''
+    Sets of constraints that cannot hold together (unsat cores), learned from
+    infeasible branches. They are shared by all the paths of a search, so that
+    a later path which accumulates the same contradictory constraints can
+    decide the branch without a solver query.
+
+    >>> x = z3.Int('x')
+    >>> lemmas = LearnedLemmas()
+    >>> lemmas.learn([x > 3, x < 2])
+    >>> lemmas.refutes({(x > 3).get_id(), (x > 7).get_id()}, x < 2)
+    True
+    >>> lemmas.refutes({(x > 7).get_id()}, x < 2)
+    False
+    '''
+    def __init__(self):
+        # (z3 hash-conses expressions; holding onto them keeps their ids unique)
+        self.exprs: Dict[int, z3.ExprRef] = {}
+        self.by_member: Dict[int, List[FrozenSet[int]]] = collections.defaultdict(list)
+        self.infeasible_counts: Counter[int] = collections.Counter()
+
+    def recurring(self, expr: z3.ExprRef) -> bool:
+        expr_id = expr.get_id()
+        self.exprs[expr_id] = expr
+        self.infeasible_counts[expr_id] += 1
+        return self.infeasible_counts[expr_id] > 1
+
+    def learn(self, core: Sequence[z3.ExprRef]) -> None:
+        ids = frozenset(expr.get_id() for expr in core)
+        for expr in core:
+            self.exprs[expr.get_id()] = expr
+        for expr_id in ids:
+            self.by_member[expr_id].append(ids)
+
+    def refutes(self, known: AbstractSet[int], expr: z3.ExprRef) -> bool:
+        ''' Whether some lemma shows that `expr` contradicts the `known` constraint ids. '''
+        expr_id = expr.get_id()
+        return any(all(i == expr_id or i in known for i in core)
+                   for core in self.by_member.get(expr_id, ()))
+
+
 class StateSpace:
-    def __init__(self, model_check_timeout: float):
-        smt_tactic = z3.TryFor(z3.Tactic('smt'), 1 +
-                               int(model_check_timeout * 1000))
-        self.solver = smt_tactic.solver()
-        self.solver.set(mbqi=True)
-        # turn off every randomization thing we can think of:
-        self.solver.set('random-seed', 42)
-        self.solver.set('smt.random-seed', 42)
-        #self.solver.set('randomize', False)
+    def __init__(self, model_check_timeout: float, stats: Optional[ConditionStats] = None,
+                 query_logger: Optional[QueryLogger] = None,
+                 solver_rlimit: Optional[int] = None,
+                 portfolio: Optional[SolverPortfolio] = None,
+                 lemmas: Optional[LearnedLemmas] = None,
+                 slice_constraints: bool = False,
+                 record_sites: bool = False):
+        self.model_check_timeout = model_check_timeout
+        self.solver_rlimit = solver_rlimit
+        self.portfolio = portfolio
+        self.lemmas = lemmas
+        # The constraints added along this path (a subset of the solver's assertions):
+        self.constraints: List[z3.ExprRef] = []
+        self.constraint_ids: Set[int] = set()
+        self.stats = stats if stats is not None else ConditionStats()
+        self.solver = SlicedSolver(self.make_solver, self.stats) if slice_constraints \
+            else self.make_solver()
         self.choices_made: List[SearchTreeNode] = []
         self.running_framework_code = False
+        # Whether to work out where (in the code under analysis) decisions and
+        # realizations happen; this walks the stack, so only reports ask for it:
+        self.record_sites = record_sites
+        self.outermost_frame: Optional[types.FrameType] = None
+        if record_sites:
+            # Stack frames at or below the one that set up this space never
+            # belong to the code under analysis:
+            frame = sys._getframe(1)
+            while frame.f_code.co_name == '__init__' and frame.f_locals.get('self') is self:
+                frame = frame.f_back
+            self.outermost_frame = frame
         self.heaps: List[List[Tuple[z3.ExprRef, Type, object]]] = [[]]
         self.next_uniq = 1
         self.type_repo = SmtTypeRepository(self.solver)
+        # Models of the path constraints (newest first), and the number of
+        # types in the type repository when they were made:
+        self.models: List[z3.ModelRef] = []
+        self.models_num_types = 0
+        # Models that new branches follow, for as long as they agree with the
+        # path constraints (see steer_by()):
+        self.steering_models: List[z3.ModelRef] = []
+        self.query_logger = query_logger
+        self.slowest_check = 0.0  # (seconds)
+
+    def make_solver(self) -> z3.Solver:
+        portfolio = self.portfolio
+        if self.solver_rlimit is not None:
+            # Limit each check by z3's (deterministic) resource counter instead of
+            # the clock. (tactic-based solvers do not accept an rlimit)
+            solver = z3.Solver()
+            solver.set('rlimit', self.solver_rlimit)
+            solver.set(mbqi=True)
+            # turn off every randomization thing we can think of:
+            solver.set('random-seed', 42)
+            #solver.set('randomize', False)
+            return solver
+        if portfolio is None:
+            return DEFAULT_SOLVER_CONFIG.make_solver(self.model_check_timeout)
+        # Give the winningest configuration a head start; slower
+        # checks are then raced with the rest of the portfolio:
+        return portfolio.best_config().make_solver(
+            min(self.model_check_timeout, portfolio.threshold))
 
     def framework(self) -> ContextManager:
         return WithFrameworkCode(self)
@@ -148,18 +268,224 @@ class StateSpace:
     def add(self, expr: z3.ExprRef) -> None:
         #debug('Committed to ', expr)
         self.solver.add(expr)
+        self.constraints.append(expr)
+        self.constraint_ids.add(expr.get_id())
+        if self.models:
+            self.models = [m for m in self.models if _model_satisfies(m, expr)]
+        if self.steering_models:
+            self.steering_models = [m for m in self.steering_models if _model_satisfies(m, expr)]
+
+    def cached_model(self) -> Optional[z3.ModelRef]:
+        ''' A model of the current path constraints, if one is at hand. '''
+        if self.models and self.models_num_types != len(self.type_repo.pytype_to_smt):
+            # (the type repository has added axioms that the models may not satisfy)
+            self.models = []
+        return self.models[0] if self.models else None
+
+    def seed_models(self, models: Sequence[z3.ModelRef]) -> None:
+        '''
+        Offers models (say, from an earlier path) for this path to follow, for
+        as long as they agree with the path's constraints.
+        '''
+        self.models = list(models) + self.models
+        self.models_num_types = len(self.type_repo.pytype_to_smt)
+
+    def steer_by(self, model: z3.ModelRef) -> None:
+        '''
+        Makes new branches on this path go the way that `model` does, for as
+        long as it agrees with the path's constraints.
+        '''
+        self.seed_models([model])
+        self.steering_models.append(model)
+
+    def steering_direction(self, expr: z3.ExprRef) -> Optional[bool]:
+        if self.steering_models and self.models_num_types != len(self.type_repo.pytype_to_smt):
+            self.steering_models = []
+        if not self.steering_models:
+            return None
+        value = self.steering_models[0].evaluate(expr, model_completion=True)
+        return True if z3.is_true(value) else False if z3.is_false(value) else None
+
+    def type_axioms(self) -> List[z3.ExprRef]:
+        ''' The solver's assertions that are not path constraints (those of the type repository). '''
+        return [expr for expr in self.solver.assertions() if expr.get_id() not in self.constraint_ids]
+
+    def find_model_with(self, exprs: Sequence[z3.ExprRef]) -> Optional[z3.ModelRef]:
+        '''
+        A model of the path constraints, together with `exprs`, if there is one.
+
+        >>> space = SimpleStateSpace()
+        >>> repo = space.type_repo
+        >>> space.find_model_with([repo.issubclass(object, int)]) is None
+        True
+        '''
+        solver = self.make_solver()
+        solver.add(self.type_axioms())
+        solver.add(self.constraints)
+        solver.add(*exprs)
+        self.stats.incr('solver_calls')
+        return solver.model() if self.logged_check(solver, (), 'find_model_with') == z3.sat else None
+
+    def find_diverse_models(self, exprs: Sequence[z3.ExprRef], count: int,
+                            num_constraints: Optional[int] = None,
+                            exclude: Iterable[Sequence[z3.ExprRef]] = ()) -> List[z3.ModelRef]:
+        '''
+        Finds up to `count` models of the path constraints (of only the first
+        `num_constraints` of them, if given), no two of which agree on the
+        values of all of `exprs`. Models that give `exprs` any of the value
+        sequences in `exclude` are skipped.
+        '''
+        solver = self.make_solver()
+        solver.add(self.type_axioms())
+        solver.add(self.constraints[:num_constraints])
+        for values in exclude:
+            solver.add(z3.Or([expr != value for expr, value in zip(exprs, values)]))
+        models: List[z3.ModelRef] = []
+        while len(models) < count:
+            self.stats.incr('solver_calls')
+            if self.logged_check(solver, (), 'find_diverse_models') != z3.sat:
+                break
+            model = solver.model()
+            models.append(model)
+            solver.add(z3.Or([expr != model.evaluate(expr, model_completion=True) for expr in exprs]))
+        return models
+
+    def find_model(self) -> z3.ModelRef:
+        model = self.cached_model()
+        if model is not None:
+            self.stats.incr('model_reuses')
+            return model
+        if not self.solver_is_sat():
+            debug('bad solver', self.solver.sexpr())
+            raise CrosshairInternal('unexpected un sat')
+        return self.solver.model()
 
     def check(self, expr: z3.ExprRef) -> z3.CheckSatResult:
         solver = self.solver
-        solver.push()
-        solver.add(expr)
-        #debug('CHECK ? ' + str(solver.sexpr()))
-        ret = solver.check()
-        #debug('CHECK => ' + str(ret))
+        ret = self.logged_check(solver, (expr,), 'check')
         if ret not in (z3.sat, z3.unsat):
             debug('Solver cannot decide satisfiability')
             raise UnknownSatisfiability(str(ret) + ': ' + str(solver))
-        solver.pop()
+        return ret
+
+    def logged_check(self, solver: z3.Solver, exprs: Sequence[z3.ExprRef],
+                     kind: str) -> z3.CheckSatResult:
+        '''
+        Checks `exprs` with one of our solvers. (every check that we make goes
+        through here, so that --dump_smt sees all of them)
+        '''
+        start = time.time()
+        ret = solver.check(*exprs)
+        if self.query_logger is not None:
+            if not isinstance(solver, SlicedSolver):
+                self.log_query(solver.assertions(), exprs, ret, time.time() - start, kind)
+            elif solver.checked_assertions is not None:
+                self.log_query(solver.checked_assertions, exprs, ret, time.time() - start, kind)
+        return ret
+
+    def log_query(self, assertions: Sequence[z3.ExprRef], exprs: Sequence[z3.ExprRef],
+                  ret: z3.CheckSatResult, seconds: float, kind: str) -> None:
+        stats = self.stats
+        cast(QueryLogger, self.query_logger).log(
+            assertions, exprs, ret, seconds,
+            label=f'{stats.filename}:{stats.line}:{stats.function} ({kind})')
+
+    def solver_is_sat(self, *exprs: z3.ExprRef) -> bool:
+        stats = self.stats
+        stats.incr('solver_calls')
+        start = time.time()
+        ret = self.logged_check(self.solver, exprs, 'solver_is_sat')
+        seconds = time.time() - start
+        stats.timers['solver'] += seconds
+        self.slowest_check = max(self.slowest_check, seconds)
+        stats.incr(str(ret))
+        if ret == z3.unknown and self.portfolio is not None:
+            ret = self.race_portfolio(exprs)
+        if ret == z3.unknown:
+            debug('Unknown satisfiability. Solver state follows:\n', self.solver)
+            raise UnknownSatisfiability
+        if ret == z3.sat and not isinstance(self.solver, SlicedSolver):
+            # Keep a couple of recent models; later branches can often be
+            # decided by evaluating them instead of querying the solver.
+            # (a SlicedSolver keeps a model per group already; its model() is
+            # a live view of them, which may change under us)
+            previous = self.cached_model()
+            self.models = [self.solver.model()] + ([previous] if previous is not None else [])
+            self.models_num_types = len(self.type_repo.pytype_to_smt)
+        return ret == z3.sat
+
+    def refuted_by_lemma(self, expr: z3.ExprRef) -> bool:
+        if self.lemmas is None or not self.lemmas.refutes(self.constraint_ids, expr):
+            return False
+        self.stats.incr('lemma_prunes')
+        return True
+
+    def learn_infeasible(self, expr: z3.ExprRef) -> None:
+        '''
+        Records why `expr` cannot hold on this path, as an unsat core over the
+        path's constraints. Cores come from a separate, non-incremental solver
+        (tactic-based solvers do not produce cores), which is comparatively
+        expensive, so we only learn from expressions that are found infeasible
+        more than once.
+        '''
+        if self.lemmas is None or not self.lemmas.recurring(expr):
+            return
+        solver = z3.Solver()
+        if self.solver_rlimit is None:
+            solver.set('timeout', 1 + int(self.model_check_timeout * 1000))
+        else:
+            solver.set('rlimit', self.solver_rlimit)
+        with self.stats.timing('lemmas'):
+            ret = self.logged_check(solver, (*self.constraints, expr), 'learn_infeasible')
+        # (without type repository axioms, some infeasible branches look feasible here)
+        if ret == z3.unsat:
+            core = solver.unsat_core()
+            if any(member.eq(expr) for member in core):
+                self.lemmas.learn(core)
+                self.stats.incr('lemmas_learned')
+
+    def race_portfolio(self, exprs: Sequence[z3.ExprRef]) -> z3.CheckSatResult:
+        '''
+        Races the portfolio on a query that the solver could not decide; the
+        winning configuration takes over the rest of this path. When slicing,
+        only the group that the query went to takes part.
+
+        >>> x, y = z3.Ints('x y')
+        >>> space = StateSpace(1.0, portfolio=SolverPortfolio(), slice_constraints=True)
+        >>> space.add(x > 2); space.add(y > 2)
+        >>> space.solver.check(x < 5)
+        sat
+        >>> space.race_portfolio([x < 5])
+        sat
+        >>> (type(space.solver).__name__, space.find_model_value(x) in (3, 4))
+        ('SlicedSolver', True)
+        '''
+        portfolio, stats = cast(SolverPortfolio, self.portfolio), self.stats
+        stats.incr('portfolio_races')
+        # When slicing, only the group that could not decide the query takes part:
+        group = self.solver.last_checked if isinstance(self.solver, SlicedSolver) else None
+        assertions = group.assertions if group is not None else self.solver.assertions()
+        with stats.timing('solver'):
+            start = time.time()
+            winner = portfolio.race(assertions, exprs, self.model_check_timeout)
+            if self.query_logger is not None:
+                self.log_query(assertions, exprs, z3.unknown if winner is None else winner[1],
+                               time.time() - start, 'race_portfolio')
+            if winner is None:
+                return z3.unknown
+            config, ret, model = winner
+            stats.incr('portfolio_won_by_' + config.name)
+            debug('Solver portfolio decided', ret, 'with', config.name)
+            # The winner takes over the rest of this path:
+            solver = config.make_solver(self.model_check_timeout)
+            if group is not None:
+                cast(SlicedSolver, self.solver).replace_solver(group, solver, model)
+                return ret
+            solver.add(assertions)
+            self.solver = self.type_repo.solver = solver
+            if ret == z3.sat:
+                # (a z3.Solver only offers the model of its own check)
+                ret = self.logged_check(solver, exprs, 'race_portfolio')
         return ret
 
     def fork_with_confirm_or_else(self, false_probabilty: float) -> bool:
@@ -171,7 +497,12 @@ class StateSpace:
     def choose_possible(self, expr: z3.ExprRef, favor_true=False) -> bool:
         raise NotImplementedError
 
+    def code_site(self) -> Optional[str]:
+        ''' Where the code under analysis is (if we are recording sites; see user_code_site). '''
+        return user_code_site(outermost_frame=self.outermost_frame) if self.record_sites else None
+
     def find_model_value(self, expr: z3.ExprRef) -> object:
+        self.stats.record_realization(self.code_site(), 0)
         value = self.solver.model().evaluate(expr, model_completion=True)
         return model_value_to_python(value)
 
@@ -277,6 +608,12 @@ class SearchTreeNode(NodeLike):
     statehash: Optional[str] = None
     result: CallAnalysis = CallAnalysis()
     exhausted: bool = False
+    # Diagnostics, for exporting the tree (see crosshair.treedump):
+    site: str = ''  # the source location that created this decision
+    visits: int = 0
+    solver_time: float = 0.0  # seconds spent in the solver to create this node
+    # How many lines and arcs were first covered by paths through this node:
+    new_coverage: int = 0
 
     def choose(self, favor_true=False) -> Tuple[bool, NodeLike]:
         raise NotImplementedError
@@ -293,14 +630,13 @@ class SearchTreeNode(NodeLike):
         return False
     def compute_result(self) -> Tuple[CallAnalysis, bool]:
         raise NotImplementedError
+    def __getstate__(self) -> dict:
+        # (forked children send their subtrees back to the parent; see ForkedChild)
+        state = self.__dict__.copy()
+        if 'result' in state:
+            state['result'] = state['result'].portable()
+        return state
 
-def solver_is_sat(solver, *a) -> bool:
-    ret = solver.check(*a)
-    if ret == z3.unknown:
-        debug('Unknown satisfiability. Solver state follows:\n', solver)
-        raise UnknownSatisfiability
-    return ret == z3.sat
-    
 def node_result(node: Optional[NodeLike]) -> Optional[CallAnalysis]:
     if node is None:
         return None
@@ -417,14 +753,37 @@ def merge_node_results(left: CallAnalysis, exhausted: bool, node: NodeLike) -> T
 
 class WorstResultNode(RandomizedBinaryPathNode):
     forced_path: Optional[bool] = None
-    def __init__(self, rand: random.Random, expr: z3.ExprRef, solver: z3.Solver):
+    def __init__(self, rand: random.Random, expr: z3.ExprRef, space: StateSpace):
         RandomizedBinaryPathNode.__init__(self, rand)
         notexpr = z3.Not(expr)
-        could_be_true = solver_is_sat(solver, expr)
-        could_be_false = solver_is_sat(solver, notexpr)
+        # We only get here on feasible paths, so when a learned lemma rules
+        # out one direction, the other one must be possible:
+        if space.refuted_by_lemma(expr):
+            self.forced_path = False
+            return
+        if space.refuted_by_lemma(notexpr):
+            self.forced_path = True
+            return
+        # A model that we already have decides one direction; only the other
+        # one needs the solver:
+        model = space.cached_model()
+        known = model.evaluate(expr, model_completion=True) if model is not None else None
+        if known is not None and z3.is_true(known):
+            space.stats.incr('model_reuses')
+            could_be_true = True
+            could_be_false = space.solver_is_sat(notexpr)
+        elif known is not None and z3.is_false(known):
+            space.stats.incr('model_reuses')
+            could_be_false = True
+            could_be_true = space.solver_is_sat(expr)
+        else:
+            could_be_true = space.solver_is_sat(expr)
+            could_be_false = space.solver_is_sat(notexpr)
+        if could_be_true != could_be_false:
+            space.learn_infeasible(notexpr if could_be_true else expr)
         if (not could_be_true) and (not could_be_false):
             debug(' *** Reached impossible code path *** ')
-            debug('Current solver state:\n', str(solver))
+            debug('Current solver state:\n', str(space.solver))
             raise CrosshairInternal('Reached impossible code path')
         elif not could_be_true:
             self.forced_path = False
@@ -464,55 +823,197 @@ class WorstResultNode(RandomizedBinaryPathNode):
 
 class ModelValueNode(WorstResultNode):
     condition_value: object = None
-    def __init__(self, rand: random.Random, expr: z3.ExprRef, solver: z3.Solver):
+    def __init__(self, rand: random.Random, expr: z3.ExprRef, space: StateSpace):
         if self.condition_value is None:
-            if not solver_is_sat(solver):
-                debug('bad solver', solver.sexpr())
-                raise CrosshairInternal('unexpected un sat')
-            self.condition_value = solver.model().evaluate(expr, model_completion=True)
-        WorstResultNode.__init__(self, rand, expr == self.condition_value, solver)
+            model = space.find_model()
+            self.condition_value = model.evaluate(expr, model_completion=True)
+        WorstResultNode.__init__(self, rand, expr == self.condition_value, space)
+    def __getstate__(self) -> dict:
+        state = WorstResultNode.__getstate__(self)
+        state.pop('condition_value', None)  # (only needed to create the node)
+        return state
+
+@dataclass
+class ForkReport:
+    ''' What a forked child sends back about the subtree that it explored. '''
+    analysis: CallAnalysis
+    exhausted: bool
+    counters: Counter
+    timers: Counter
+    # Whatever else the search wants to carry over (see fork_report_handler):
+    search_state: object = None
+    # The explored subtree itself, pickled (None when it could not be):
+    subtree: Optional[bytes] = None
+
+
+class ForkedChild:
+    def __init__(self, channel: ForkChannel, stem: NodeLike, stats: ConditionStats):
+        self.channel = channel
+        self.stem = stem
+        self.counters_at_fork = stats.counters.copy()
+        self.timers_at_fork = stats.timers.copy()
+
+    def report(self, stats: ConditionStats, search_state: object = None) -> NoReturn:
+        node = self.stem.simplify()
+        analysis = node.get_result().portable()
+        timers = stats.timers - self.timers_at_fork
+        # (the parent records these for itself, when the results reach its root)
+        for key in ('until_refuted', 'until_confirmed'):
+            timers.pop(key, None)
+        subtree = None
+        if isinstance(node, SearchTreeNode):
+            try:
+                subtree = pickle.dumps(node)
+            except (pickle.PicklingError, TypeError, RecursionError):
+                debug('Unable to send the forked subtree back; sending its result only')
+        self.channel.send_and_exit(ForkReport(
+            analysis, node.is_exhausted(), stats.counters - self.counters_at_fork, timers,
+            search_state, subtree))
+
+    def abandon(self) -> NoReturn:
+        self.channel.abandon()
+
 
 class TrackingStateSpace(StateSpace):
     search_position: NodeLike
     def __init__(self,
                  execution_deadline: float,
                  model_check_timeout: float,
-                 search_root: SinglePathNode):
-        StateSpace.__init__(self, model_check_timeout)
+                 search_root: SinglePathNode,
+                 stats: Optional[ConditionStats] = None,
+                 query_logger: Optional[QueryLogger] = None,
+                 solver_rlimit: Optional[int] = None,
+                 max_decisions: Optional[int] = None,
+                 portfolio: Optional[SolverPortfolio] = None,
+                 lemmas: Optional[LearnedLemmas] = None,
+                 slice_constraints: bool = False,
+                 fork_budget: int = 0,
+                 record_sites: bool = False):
+        StateSpace.__init__(self, model_check_timeout, stats, query_logger, solver_rlimit,
+                            portfolio, lemmas, slice_constraints, record_sites)
         self.execution_deadline = execution_deadline
+        self.path_seconds = execution_deadline - time.time()
+        self.max_decisions = max_decisions
+        # How many more times this path may fork (see fork_at()), and, in a
+        # forked child, the state it reports back to its parent:
+        self.fork_budget = fork_budget
+        self.forked_child: Optional[ForkedChild] = None
+        # How many times (after a fork) this path, or a child that it forked,
+        # resumed in the other direction:
+        self.resumed_paths = 0
+        # Called (in the parent) with each report from a forked child:
+        self.fork_report_handler: Optional[Callable[[ForkReport], None]] = None
+        # Branches that were decided without a decision node:
+        self.fast_decisions = 0
+        # How many constraints the path had before it first committed to a
+        # realized value:
+        self.num_unrealized_constraints: Optional[int] = None
+        # Branch decisions that this path has yet to replay (see replay()):
+        self.replay_choices: Deque[bool] = collections.deque()
+        # Whether to favor branches that have led to new coverage:
+        self.coverage_guided = False
         self._random = newrandom()
+        search_root.visits += 1
         _, self.search_position = search_root.choose()
 
+    def grow(self, make_node: Callable[[], SearchTreeNode]) -> SearchTreeNode:
+        ''' Replaces the current (stem) position with a new decision node. '''
+        solver_time_before = self.stats.timers['solver']
+        node = make_node()
+        node.solver_time = self.stats.timers['solver'] - solver_time_before
+        node.site = self.code_site() or ''
+        return self.search_position.grow_into(node)
+
+    def record_choice(self, node: SearchTreeNode) -> None:
+        node.visits += 1
+        self.choices_made.append(node)
+
+    def coverage_direction(self, node: SearchTreeNode) -> Optional[bool]:
+        '''
+        Picks a side of a branch that both sides of remain open: an
+        unexplored side over an explored one, or else the side whose paths
+        have found the most new coverage per visit (if either has).
+        '''
+        if not isinstance(node, WorstResultNode) or node.forced_path is not None:
+            return None
+        positive, negative = node.positive.simplify(), node.negative.simplify()
+        if positive.is_exhausted() or negative.is_exhausted():
+            return None
+        if positive.is_stem() != negative.is_stem():
+            return positive.is_stem()
+        if not isinstance(positive, SearchTreeNode) or not isinstance(negative, SearchTreeNode):
+            return None
+        positive_rate = positive.new_coverage / max(1, positive.visits)
+        negative_rate = negative.new_coverage / max(1, negative.visits)
+        if positive_rate == negative_rate:
+            return None
+        return positive_rate > negative_rate
+
+    def credit_coverage(self, amount: int) -> None:
+        ''' Credits the decisions of this path with the new coverage that it found. '''
+        for node in self.choices_made:
+            node.new_coverage += amount
+
+    def replay(self, log: str) -> None:
+        '''
+        Makes this path take the branch decisions in `log` (as made by
+        execution_log()), for as long as they remain possible.
+        '''
+        self.replay_choices = collections.deque(bit == '1' for bit in log)
+
+    def replayed_choice(self, node: BinaryPathNode, choose_true: bool,
+                        stem: NodeLike) -> Tuple[bool, NodeLike]:
+        if not self.replay_choices:
+            return (choose_true, stem)
+        replayed = self.replay_choices.popleft()
+        if isinstance(node, WorstResultNode) and node.forced_path not in (None, replayed):
+            debug('Path diverged from the replayed log; ', len(self.replay_choices),
+                  ' decisions were left to replay')
+            self.stats.incr('replay_divergences')
+            self.replay_choices.clear()
+            return (choose_true, stem)
+        self.stats.incr('replayed_decisions')
+        return (replayed, node.positive if replayed else node.negative)
+
     def fork_with_confirm_or_else(self, false_probability: float) -> bool:
         if self.search_position.is_stem():
-            self.search_position = self.search_position.grow_into(ConfirmOrElseNode(false_probability))
+            self.search_position = self.grow(lambda: ConfirmOrElseNode(false_probability))
         node = self.search_position.simplify()
-        assert isinstance(node, SearchTreeNode)
-        self.choices_made.append(node)
-        ret, next_node = node.choose()
+        assert isinstance(node, ConfirmOrElseNode)
+        self.record_choice(node)
+        ret, next_node = self.replayed_choice(node, *node.choose())
         self.search_position = next_node
         return ret
 
     def fork_parallel(self, false_probability: float) -> bool:
         if self.search_position.is_stem():
-            self.search_position = self.search_position.grow_into(ParallelNode(false_probability))
+            self.search_position = self.grow(lambda: ParallelNode(false_probability))
         node = self.search_position.simplify()
-        assert isinstance(node, SearchTreeNode)
-        self.choices_made.append(node)
-        ret, next_node = node.choose()
+        assert isinstance(node, ParallelNode)
+        self.record_choice(node)
+        ret, next_node = self.replayed_choice(node, *node.choose())
         self.search_position = next_node
         return ret
 
     def choose_possible(self, expr: z3.ExprRef, favor_true=False) -> bool:
         with self.framework():
-            if time.time() > self.execution_deadline:
+            if self.max_decisions is not None:
+                if len(self.choices_made) + self.fast_decisions >= self.max_decisions:
+                    debug('Path exceeded its budget of ', self.max_decisions, ' decisions.')
+                    raise PathTimeout
+            elif time.time() > self.execution_deadline:
                 debug('Path execution timeout after making ',
                       len(self.choices_made), ' choices.')
                 raise PathTimeout
+            known = self.known_value(expr)
+            if known is not None:
+                self.fast_decisions += 1
+                return known
             notexpr = z3.Not(expr)
-            if self.search_position.is_stem():
-                self.search_position = self.search_position.grow_into(
-                    WorstResultNode(self._random, expr, self.solver))
+            is_new = self.search_position.is_stem()
+            if is_new:
+                self.search_position = self.grow(
+                    lambda: WorstResultNode(self._random, expr, self))
 
             self.search_position = self.search_position.simplify()
             node = self.search_position
@@ -536,48 +1037,133 @@ class TrackingStateSpace(StateSpace):
                         node.statehash.split('\n'), statedesc.split('\n'))))
                     debug(' *** End Not Deterministic Debug *** ')
                     raise NotDeterministic()
-            choose_true, stem = node.choose(favor_true=favor_true)
+            steered = self.steering_direction(expr) if is_new else None
+            if steered is not None and isinstance(node, WorstResultNode) and \
+                    node.forced_path in (None, steered):
+                self.stats.incr('steered_branches')
+                choose_true, stem = steered, (node.positive if steered else node.negative)
+            else:
+                guided = self.coverage_direction(node) if self.coverage_guided and not is_new else None
+                if guided is not None:
+                    self.stats.incr('coverage_guided_branches')
+                    choose_true, stem = guided, (node.positive if guided else node.negative)
+                else:
+                    choose_true, stem = node.choose(favor_true=favor_true)
+            if self.replay_choices:
+                assert isinstance(node, BinaryPathNode)
+                choose_true, stem = self.replayed_choice(node, choose_true, stem)
+            if is_new and self.fork_budget > 0 and isinstance(node, WorstResultNode) \
+                    and node.forced_path is None:
+                choose_true, stem = self.fork_at(node, choose_true)
             assert isinstance(self.search_position, SearchTreeNode)
-            self.choices_made.append(self.search_position)
+            self.record_choice(self.search_position)
             self.search_position = stem
             expr = expr if choose_true else notexpr
             #debug('CHOOSE', expr)
             self.add(expr)
             return choose_true
 
+    def fork_at(self, node: BinaryPathNode, choose_true: bool) -> Tuple[bool, NodeLike]:
+        '''
+        Forks at a new branch. The child goes in the `choose_true` direction.
+        The parent waits for the child's path to finish, grafts the child's
+        subtree into its tree (so that later paths resume below the child's,
+        rather than take it again), and then goes in the other direction,
+        with a fresh path timeout.
+        '''
+        self.fork_budget -= 1
+        stem = node.positive if choose_true else node.negative
+        channel = ForkChannel()
+        if channel.is_child():
+            self.forked_child = ForkedChild(channel, stem, self.stats)
+            return (choose_true, stem)
+        report = channel.receive()
+        stats = self.stats
+        if isinstance(report, ForkReport):
+            stats.counters.update(report.counters)
+            stats.timers.update(report.timers)
+            # (the child may have resumed paths after forks of its own)
+            self.resumed_paths += report.counters['resumed_paths']
+            if report.subtree is not None:
+                stem.grow_into(pickle.loads(report.subtree))
+            elif report.exhausted or report.analysis.verification_status == VerificationStatus.REFUTED:
+                stem.grow_into(SearchLeaf(report.analysis))
+            if self.fork_report_handler is not None:
+                self.fork_report_handler(report)
+        else:
+            stats.incr('failed_forks')
+        stats.incr('paths')
+        stats.incr('resumed_paths')
+        self.resumed_paths += 1
+        self.execution_deadline = time.time() + self.path_seconds
+        return (not choose_true, node.negative if choose_true else node.positive)
+
+    def known_value(self, expr: z3.ExprRef) -> Optional[bool]:
+        '''
+        Decides `expr` without the solver (and without a decision node), when it
+        simplifies to a constant, or when this path has already committed to it
+        (or to its negation). Loop conditions are often re-tested this way.
+        '''
+        ids = self.constraint_ids
+        if expr.get_id() in ids:
+            self.stats.incr('repeated_branches')
+            return True
+        if (z3.is_not(expr) and expr.arg(0).get_id() in ids) or z3.Not(expr).get_id() in ids:
+            self.stats.incr('repeated_branches')
+            return False
+        simple = z3.simplify(expr)
+        if z3.is_true(simple) or z3.is_false(simple):
+            self.stats.incr('constant_branches')
+            return z3.is_true(simple)
+        return None
+
     def find_model_value(self, expr: z3.ExprRef) -> object:
+        forks = 0
         with self.framework():
-            while True:
-                if self.search_position.is_stem():
-                    self.search_position = self.search_position.grow_into(ModelValueNode(self._random, expr, self.solver))
-                node = self.search_position.simplify()
-                assert isinstance(node, ModelValueNode)
-                (chosen, next_node) = node.choose(favor_true=True)
-                self.choices_made.append(node)
-                self.search_position = next_node
-                #if self.choose_possible(self, expr == node.condition_value, favor_true=False) -> bool:
-                if chosen:
-                    self.solver.add(expr == node.condition_value)
-                    return model_value_to_python(node.condition_value)
-                else:
-                    self.solver.add(expr != node.condition_value)
+            site = self.code_site()
+            try:
+                while True:
+                    if self.search_position.is_stem():
+                        self.search_position = self.grow(lambda: ModelValueNode(self._random, expr, self))
+                        forks += 1
+                    node = self.search_position.simplify()
+                    assert isinstance(node, ModelValueNode)
+                    (chosen, next_node) = self.replayed_choice(node, *node.choose(favor_true=True))
+                    self.record_choice(node)
+                    self.search_position = next_node
+                    #if self.choose_possible(self, expr == node.condition_value, favor_true=False) -> bool:
+                    if chosen:
+                        if self.num_unrealized_constraints is None:
+                            self.num_unrealized_constraints = len(self.constraints)
+                        self.add(expr == node.condition_value)
+                        return model_value_to_python(node.condition_value)
+                    else:
+                        self.add(expr != node.condition_value)
+            finally:
+                self.stats.record_realization(site, forks)
     
     def find_model_value_for_function(self, expr: z3.ExprRef) -> object:
         # TODO: this need to go into a tree node that returns UNKNOWN or worse
         # (because it just returns one example function; it's not covering the space)
-        if not solver_is_sat(self.solver):
+        if not self.solver_is_sat():
             raise CrosshairInternal(
                 'model unexpectedly became unsatisfiable')
         return self.solver.model()[expr]
     
     def execution_log(self) -> str:
+        '''
+        The branch decisions of this path so far, as a string of ones (for
+        the positive side) and zeros. See replay().
+        '''
         log = []
         choices = self.choices_made
-        for idx, node in enumerate(choices[:-1]):
-            next_node = choices[idx + 1]
+        next_nodes = choices[1:] + [self.search_position]
+        for node, next_node in zip(choices, next_nodes):
             if isinstance(node, BinaryPathNode):
-                assert next_node is node.positive or next_node is node.negative
-                log.append('1' if node.positive is next_node else '0')
+                next_node = next_node.simplify()
+                positive = node.positive.simplify()
+                assert next_node is positive or next_node is node.negative.simplify()
+                log.append('1' if positive is next_node else '0')
         return ''.join(log)
 
     def bubble_status(self, analysis: CallAnalysis) -> Tuple[
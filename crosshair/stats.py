@@ -0,0 +1,188 @@
+'''
+Counters and timers gathered while analyzing individual conditions.
+
+Stats from different processes (or different runs) can be combined:
+
+>>> a, b = ConditionStats(), ConditionStats()
+>>> a.incr('solver_calls')
+>>> b.incr('solver_calls', 2)
+>>> b.record_heap_size(7)
+>>> a.merge(b)
+>>> (a.counters['solver_calls'], a.max_heap_size)
+(3, 7)
+>>> ConditionStats.fromJSON(a.toJSON()) == a
+True
+'''
+
+import collections
+import contextlib
+import dataclasses
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import *
+
+
+@dataclass
+class ConditionStats:
+    function: str = ''
+    condition: str = ''
+    filename: str = ''
+    line: int = 0
+    # Event counts (solver calls, sat/unsat/unknown results, paths, ...):
+    counters: Counter[str] = dataclasses.field(default_factory=collections.Counter)
+    # Accumulated seconds spent, by activity:
+    timers: Counter[str] = dataclasses.field(default_factory=collections.Counter)
+    # Number of paths by the number of decisions made along them:
+    path_depths: Counter[int] = dataclasses.field(default_factory=collections.Counter)
+    max_heap_size: int = 0
+    # Realizations (symbolic values made concrete), by the user source
+    # location that requested them, and the search tree forks they caused:
+    realization_sites: Counter[str] = dataclasses.field(default_factory=collections.Counter)
+    realization_forks: Counter[str] = dataclasses.field(default_factory=collections.Counter)
+
+    def incr(self, key: str, amount: int = 1) -> None:
+        self.counters[key] += amount
+
+    @contextlib.contextmanager
+    def timing(self, key: str) -> Iterator[None]:
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.timers[key] += time.time() - start
+
+    def record_path(self, depth: int) -> None:
+        self.path_depths[depth] += 1
+
+    def record_heap_size(self, size: int) -> None:
+        self.counters['heap_entries'] += size
+        self.max_heap_size = max(self.max_heap_size, size)
+
+    def record_realization(self, site: Optional[str], forks: int) -> None:
+        ''' Counts a realization (and where it happened, when that is known). '''
+        self.counters['realizations'] += 1
+        if site is None:
+            return
+        self.realization_sites[site] += 1
+        if forks:
+            self.realization_forks[site] += forks
+
+    def merge(self, other: 'ConditionStats') -> None:
+        self.counters.update(other.counters)
+        self.timers.update(other.timers)
+        self.path_depths.update(other.path_depths)
+        self.max_heap_size = max(self.max_heap_size, other.max_heap_size)
+        self.realization_sites.update(other.realization_sites)
+        self.realization_forks.update(other.realization_forks)
+
+    def toJSON(self) -> dict:
+        return {
+            'function': self.function,
+            'condition': self.condition,
+            'filename': self.filename,
+            'line': self.line,
+            'counters': dict(self.counters),
+            'timers': dict(self.timers),
+            'path_depths': {str(k): v for k, v in self.path_depths.items()},
+            'max_heap_size': self.max_heap_size,
+            'realization_sites': dict(self.realization_sites),
+            'realization_forks': dict(self.realization_forks),
+        }
+
+    @classmethod
+    def fromJSON(cls, d: dict) -> 'ConditionStats':
+        d = dict(d)
+        d['counters'] = collections.Counter(d['counters'])
+        d['timers'] = collections.Counter(d['timers'])
+        d['path_depths'] = collections.Counter(
+            {int(k): v for k, v in d['path_depths'].items()})
+        d['realization_sites'] = collections.Counter(d.get('realization_sites', {}))
+        d['realization_forks'] = collections.Counter(d.get('realization_forks', {}))
+        return ConditionStats(**d)
+
+
+def condition_key(function: str, filename: str, line: int) -> str:
+    return f'{filename}:{line}:{function}'
+
+
+def merge_condition_stats(into: MutableMapping[str, ConditionStats],
+                          other: Mapping[str, ConditionStats]) -> None:
+    for key, stats in other.items():
+        if key in into:
+            into[key].merge(stats)
+        else:
+            into[key] = ConditionStats.fromJSON(stats.toJSON())
+
+
+def stats_to_json(condition_stats: Mapping[str, ConditionStats]) -> str:
+    return json.dumps({
+        'version': 1,
+        'conditions': {k: v.toJSON() for k, v in sorted(condition_stats.items())},
+    }, indent=2)
+
+
+def realization_report(condition_stats: Mapping[str, ConditionStats],
+                       limit: int = 20) -> str:
+    '''
+    Rank the source locations that forced symbolic values to be realized,
+    most expensive (in search tree forks) first.
+
+    >>> s = ConditionStats()
+    >>> s.record_realization('foo.py:3', 4)
+    >>> s.record_realization('foo.py:3', 0)
+    >>> s.record_realization('bar.py:9', 1)
+    >>> print(realization_report({'f': s}))
+    Realization hot spots:
+      forks  realizations  location
+          4             2  foo.py:3
+          1             1  bar.py:9
+    '''
+    sites: Counter[str] = collections.Counter()
+    forks: Counter[str] = collections.Counter()
+    for stats in condition_stats.values():
+        sites.update(stats.realization_sites)
+        forks.update(stats.realization_forks)
+    if not sites:
+        return 'Realization hot spots: none'
+    ranked = sorted(sites, key=lambda site: (-forks[site], -sites[site], site))
+    lines = ['Realization hot spots:',
+             '  forks  realizations  location']
+    for site in ranked[:limit]:
+        lines.append(f'  {forks[site]:5d}  {sites[site]:12d}  {site}')
+    return '\n'.join(lines)
+
+
+def _fraction(covered: int, total: int) -> str:
+    percent = f'{100 * covered // total}%' if total else '-'
+    return f'{covered}/{total} {percent:>4}'
+
+
+def coverage_report(condition_stats: Mapping[str, ConditionStats]) -> str:
+    '''
+    Describe how much of each function under analysis its paths covered
+    (see crosshair.pathcoverage), least covered first.
+
+    >>> s = ConditionStats(function='foo', filename='foo.py', line=3)
+    >>> s.counters.update(coverable_lines=8, covered_lines=6, coverable_branches=4,
+    ...                   covered_branches=1, callee_lines=12)
+    >>> print(coverage_report({'f': s}))
+    Coverage:
+            lines     branches  callee lines  condition
+         6/8  75%     1/4  25%            12  foo (foo.py:3)
+    '''
+    rows = [stats for stats in condition_stats.values() if 'coverable_lines' in stats.counters]
+    if not rows:
+        return 'Coverage: none recorded'
+    rows.sort(key=lambda s: (s.counters['covered_lines'] / max(1, s.counters['coverable_lines']),
+                             s.filename, s.line))
+    lines = ['Coverage:',
+             '        lines     branches  callee lines  condition']
+    for stats in rows:
+        counters = stats.counters
+        line_fraction = _fraction(counters['covered_lines'], counters['coverable_lines'])
+        branch_fraction = _fraction(counters['covered_branches'], counters['coverable_branches'])
+        lines.append(f'  {line_fraction:>11}  {branch_fraction:>11}  {counters["callee_lines"]:12d}'
+                     f'  {stats.function} ({os.path.basename(stats.filename)}:{stats.line})')
+    return '\n'.join(lines)
@@ -2,9 +2,12 @@ from dataclasses import replace
 import types
 
 from crosshair.core import analyze_function
+from crosshair.core import checkables_for_function
+from crosshair.core import run_checkables
 from crosshair.core import AnalysisMessage
 from crosshair.core import AnalysisOptions
 from crosshair.core import MessageType
+from crosshair.stats import ConditionStats
 from typing import *
 
 ComparableLists = Tuple[List, List]
@@ -37,6 +40,13 @@ def check_ok(fn: Callable, options: Optional[AnalysisOptions]=None) -> Comparabl
     return (messages, [])
 
 
+def analyze_function_stats(fn: Callable, options: AnalysisOptions) -> Tuple[List[AnalysisMessage], ConditionStats]:
+    (search,) = checkables_for_function(fn, options)
+    (completed,) = run_checkables([search], options)
+    (stats,) = completed.get_stats().values()
+    return (completed.get_messages(), stats)
+
+
 def check_messages(msgs: List[AnalysisMessage], **kw) -> ComparableLists:
     if kw.get('state') != MessageType.CONFIRMED:
         # Normally, ignore confirmation messages:
@@ -47,7 +57,7 @@ def check_messages(msgs: List[AnalysisMessage], **kw) -> ComparableLists:
     default_msg = AnalysisMessage(MessageType.CANNOT_CONFIRM, '', '', 0, 0, '')
     msg = msgs[0] if msgs else replace(default_msg)
     fields = ('state', 'message', 'filename', 'line', 'column', 'traceback',
-              'execution_log', 'test_fn', 'condition_src')
+              'execution_log', 'test_fn', 'condition_src', 'input_reprs')
     for k in fields:
         if k not in kw:
             default_val = getattr(default_msg, k)
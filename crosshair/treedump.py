@@ -0,0 +1,123 @@
+'''
+Export explored search trees, for visualization.
+
+Each decision node reports its type, the source location that created it,
+how many paths went through it, how long the solver took to create it, and
+its (current) result. Branches that were never taken are reported as
+"Unexplored" nodes.
+
+Trees are flattened into a list of nodes (rather than nested), because
+paths can be deeper than Python's recursion limit.
+
+>>> root = SinglePathNode(True)
+>>> _ = root.child.grow_into(SearchLeaf(CallAnalysis(VerificationStatus.CONFIRMED)))
+>>> [(n['id'], n['type'], n['result'], n['children']) for n in tree_to_json(root)]
+[(0, 'SinglePathNode', 'CONFIRMED', [['true', 1]]), (1, 'SearchLeaf', 'CONFIRMED', [])]
+'''
+
+import json
+from typing import *
+
+from crosshair.statespace import BinaryPathNode, CallAnalysis, ModelValueNode, NodeLike, SearchLeaf, SearchTreeNode, SinglePathNode, VerificationStatus, WorstResultNode
+
+
+def _children(node: NodeLike) -> List[Tuple[str, NodeLike]]:
+    if isinstance(node, SinglePathNode):
+        return [(str(node.decision).lower(), node.child)]
+    if isinstance(node, BinaryPathNode):
+        return [('true', node.positive), ('false', node.negative)]
+    return []
+
+
+def _describe(node: NodeLike) -> dict:
+    node = node.simplify()
+    if not isinstance(node, SearchTreeNode):
+        return {'type': 'Unexplored', 'site': '', 'visits': 0,
+                'solver_time': 0.0, 'result': None, 'exhausted': False}
+    status = node.get_result().verification_status
+    desc = {
+        'type': type(node).__name__,
+        'site': node.site,
+        'visits': node.visits,
+        'solver_time': node.solver_time,
+        'result': status.name if status is not None else None,
+        'exhausted': node.is_exhausted(),
+    }
+    if isinstance(node, WorstResultNode) and node.forced_path is not None:
+        desc['forced_path'] = node.forced_path
+    if isinstance(node, ModelValueNode):
+        desc['model_value'] = str(node.condition_value)
+    if node.new_coverage:
+        desc['new_coverage'] = node.new_coverage
+    return desc
+
+
+def tree_to_json(root: NodeLike) -> List[dict]:
+    ''' Lists the nodes of a tree, parents before children; the root has id 0. '''
+    if isinstance(root, SinglePathNode):
+        # The search root is not one of the choices that results bubble up through:
+        root.update_result()
+    nodes: List[dict] = []
+    pending: List[Tuple[int, NodeLike]] = [(0, root)]
+    next_id = 1
+    while pending:
+        node_id, node = pending.pop()
+        desc = _describe(node)
+        desc['id'] = node_id
+        desc['children'] = []
+        for label, child in _children(node.simplify()):
+            desc['children'].append([label, next_id])
+            pending.append((next_id, child))
+            next_id += 1
+        nodes.append(desc)
+    nodes.sort(key=lambda desc: desc['id'])
+    return nodes
+
+
+def trees_to_json(trees: Mapping[str, NodeLike]) -> str:
+    return json.dumps({
+        'version': 1,
+        'trees': {key: tree_to_json(root) for key, root in sorted(trees.items())},
+    }, indent=2)
+
+
+_STATUS_COLORS = {
+    'REFUTED': 'red',
+    'UNKNOWN': 'gray',
+    'CONFIRMED': 'darkgreen',
+}
+
+
+def _dot_quote(*lines: str) -> str:
+    return '"' + '\\n'.join(line.replace('\\', '\\\\').replace('"', '\\"') for line in lines) + '"'
+
+
+def trees_to_dot(trees: Mapping[str, NodeLike]) -> str:
+    ''' Renders trees as a Graphviz digraph, with one cluster per condition. '''
+    lines = ['digraph crosshair {', '  node [shape=box, fontsize=10];']
+    for tree_idx, (key, root) in enumerate(sorted(trees.items())):
+        lines.append(f'  subgraph cluster_{tree_idx} {{')
+        lines.append(f'    label={_dot_quote(key)};')
+        nodes = tree_to_json(root)
+        for desc in nodes:
+            name = f'n{tree_idx}_{desc["id"]}'
+            label = [desc['type']]
+            if desc['site']:
+                label.append(desc['site'])
+            if desc['type'] != 'Unexplored':
+                label.append(f'visits={desc["visits"]} solver={desc["solver_time"]:.3f}s')
+                label.append(desc['result'] or 'IGNORED')
+            color = _STATUS_COLORS.get(desc['result'] or '', 'black')
+            style = ', style=dashed' if desc['type'] == 'Unexplored' else ''
+            lines.append(f'    {name} [label={_dot_quote(*label)}, color={color}{style}];')
+            for branch, child_id in desc['children']:
+                lines.append(f'    {name} -> n{tree_idx}_{child_id} [label={branch}];')
+        lines.append('  }')
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_search_trees(filename: str, trees: Mapping[str, NodeLike]) -> None:
+    ''' Writes Graphviz for ".dot" filenames, and JSON otherwise. '''
+    with open(filename, 'w') as fh:
+        fh.write(trees_to_dot(trees) if filename.endswith('.dot') else trees_to_json(trees))
@@ -4,8 +4,13 @@ import importlib.util
 import inspect
 import functools
 import os
+import signal
 import sys
+import sysconfig
+import threading
+import time
 import traceback
+import types
 from typing import *
 
 
@@ -145,6 +150,48 @@ def memo(f):
     return memo_wrapper
 
 
+_CROSSHAIR_DIR = os.path.dirname(os.path.abspath(__file__))
+_EXAMPLES_DIR = os.path.join(_CROSSHAIR_DIR, 'examples')
+_STDLIB_DIR = sysconfig.get_paths()['stdlib']
+
+
+def is_framework_file(filename: str) -> bool:
+    ''' True for CrossHair's own modules (but not its examples or tests). '''
+    return (filename.startswith(_CROSSHAIR_DIR) and
+            not filename.startswith(_EXAMPLES_DIR) and
+            not filename.endswith('_test.py'))
+
+
+def is_stdlib_file(filename: str) -> bool:
+    return filename.startswith(_STDLIB_DIR) and 'site-packages' not in filename
+
+
+def user_code_site(frame=None, outermost_frame: Optional[types.FrameType] = None) -> str:
+    '''
+    Describe the stack location (as "filename:line") in the code under
+    analysis that led to the calling framework code. Standard library frames
+    are skipped when possible. Condition expressions are compiled from
+    strings and are reported as "<condition>"; activity that CrossHair
+    initiated by itself (that is, without passing through code under analysis
+    before reaching `outermost_frame`) is reported as "<crosshair>".
+    '''
+    frame = frame or sys._getframe(1)
+    fallback = None
+    while frame is not None and frame is not outermost_frame:
+        filename = frame.f_code.co_filename
+        if filename == '<string>':
+            return '<condition>'
+        if is_framework_file(filename):
+            if fallback is not None:
+                break
+        elif not is_stdlib_file(filename):
+            return f'{filename}:{frame.f_lineno}'
+        elif fallback is None:
+            fallback = f'{filename}:{frame.f_lineno}'
+        frame = frame.f_back
+    return fallback or '<crosshair>'
+
+
 _T = TypeVar('_T')
 
 
@@ -197,3 +244,54 @@ class CrosshairUnsupported(UnexploredPath):
 class IgnoreAttempt(Exception):
     def __init__(self, *a):
         debug('IgnoreAttempt', str(self))
+
+
+@contextlib.contextmanager
+def concrete_deadline(deadline: float) -> Iterator[None]:
+    '''
+    Raises PathTimeout in the Python code that is still running at the
+    deadline. Symbolic execution checks its deadline whenever it makes a
+    decision, but concrete calls make none; so, on the main thread, this
+    sets an interval timer (see signal.setitimer). Elsewhere, it falls back
+    to checking the time every so often in a trace function.
+    '''
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        raise PathTimeout
+    if not (hasattr(signal, 'setitimer') and
+            threading.current_thread() is threading.main_thread()):
+        with _traced_deadline(deadline):
+            yield
+        return
+
+    def on_alarm(signum, frame):
+        raise PathTimeout
+    previous_handler = signal.signal(signal.SIGALRM, on_alarm)
+    previous_delay, _ = signal.setitimer(signal.ITIMER_REAL, remaining)
+    start = time.time()
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+        if previous_delay:
+            # (an enclosing timer must still go off, if late)
+            signal.setitimer(signal.ITIMER_REAL, max(previous_delay - (time.time() - start), 1e-6))
+
+
+@contextlib.contextmanager
+def _traced_deadline(deadline: float, check_every: int = 1000) -> Iterator[None]:
+    events = 0
+
+    def trace(frame, event, arg):
+        nonlocal events
+        events += 1
+        if events % check_every == 0 and time.time() > deadline:
+            raise PathTimeout
+        return trace
+    previous = sys.gettrace()
+    sys.settrace(trace)
+    try:
+        yield
+    finally:
+        sys.settrace(previous)